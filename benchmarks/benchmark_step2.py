@@ -0,0 +1,277 @@
+# ---------------------------------------------------------------------------
+# benchmark_step2
+# Last updated: 2026-10-17
+# Authors: Mariel Sorlien
+#
+# Description:
+# Times the tabular stages of ejmap_step2 on synthetic inputs (see
+# synthetic_data), from three states up to national scale. GIS and raster
+# stages are replaced by their output tables (zonal statistics, sea level rise
+# areas), so no ArcGIS is needed.
+#   ingest = read block groups, EJScreen, CDC, First Street, NLCD, NOAA tables
+#   tract_broadcast = align block group datasets, copy tract datasets to block groups
+#   merge = add all datasets to block group table
+#   percentiles = state and study area percentiles
+#   csv_output = save block group csv
+# Wall time and peak memory (tracemalloc, measured in a second run) per stage
+# are added to a JSON history file, and compared to the last run at the same
+# scale.
+#
+# Run from the repository folder:
+#   python -m benchmarks.benchmark_step2
+#   python -m benchmarks.benchmark_step2 --scale national
+#   python -m benchmarks.benchmark_step2 --block-groups 50000 --tracts 17000 --states 10
+# ---------------------------------------------------------------------------
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import subprocess
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+from benchmarks.synthetic_data import cdc_metrics
+from benchmarks.synthetic_data import epa_metrics
+from benchmarks.synthetic_data import make_synthetic_inputs
+from benchmarks.synthetic_data import scales
+from benchmarks.synthetic_data import study_area_values
+from functions.add_csv_dataset import add_csv_dataset
+from functions.add_csv_dataset import add_first_street_data
+from functions.add_raster_dataset import process_raster_data
+from functions.area_membership import build_membership_table
+from functions.area_membership import membership_matrix
+from functions.area_membership import select_region_rows
+from functions.assemble_datasets import assemble_datasets
+from functions.calculate_percentiles import calculate_percentiles
+from functions.calculate_sea_level_rise import interpolate_slr_area
+from functions.key_index import align_block_group_data
+from functions.key_index import broadcast_tract_data
+from functions.key_index import build_key_index
+from functions.source_cache import normalize_key_columns
+
+benchmark_folder = os.path.dirname(os.path.abspath(__file__))
+default_history = os.path.join(benchmark_folder, 'results', 'history.json')
+default_data_folder = os.path.join(tempfile.gettempdir(), 'ejmap_benchmark')
+
+# Same settings as ejmap_step2
+keep_fields = ['GEOID', 'Town', 'State', 'HUC10', 'HUC10_Name', 'Study_Area', 'ALAND', 'AWATER']
+csv_max_memory_mb = 500
+sea_level_rise_depth_ft = 0.85
+# Slower or bigger than last run by more than this share (and more than the minimum change) = flagged
+regression_threshold = 0.1
+regression_minimum = {'seconds': 0.05, 'peak_mb': 1}
+
+# --------------------- run_benchmark -----------------------------
+# Run all stages, return dictionary (stage name: {'seconds', 'peak_mb'})
+# inputs = output of make_synthetic_inputs
+# track_memory = if True, runs all stages a second time to record peak memory per stage (tracemalloc slows
+#                stages down, so times come from the first run)
+
+
+def run_benchmark(inputs, output_folder, track_memory=True):
+    results = {x: {'seconds': y, 'peak_mb': None} for x, y in run_stages_once(inputs, output_folder).items()}
+    if track_memory is True:
+        print('\nRECORDING PEAK MEMORY')
+        for stage_name, peak_mb in run_stages_once(inputs, output_folder, track_memory=True).items():
+            results[stage_name]['peak_mb'] = peak_mb
+    return results
+
+# --------------------- run_stages_once -----------------------------
+# Return dictionary (stage name: seconds, or peak MB if track_memory is True)
+
+
+def run_stages_once(inputs, output_folder, track_memory=False):
+    results = {}
+    data = {'inputs': inputs, 'output_folder': output_folder}
+    for stage_name, stage_function in [('ingest', ingest_stage), ('tract_broadcast', tract_broadcast_stage),
+                                       ('merge', merge_stage), ('percentiles', percentile_stage),
+                                       ('csv_output', csv_output_stage)]:
+        print('\nSTAGE: ' + stage_name)
+        if track_memory is True:
+            tracemalloc.start()
+            stage_function(data)
+            results[stage_name] = round(tracemalloc.get_traced_memory()[1] / 1024 / 1024, 1)
+            tracemalloc.stop()
+        else:
+            start_time = time.perf_counter()
+            stage_function(data)
+            results[stage_name] = round(time.perf_counter() - start_time, 3)
+    return results
+
+# --------------------- stages -----------------------------
+# Same steps as ejmap_step2; each stage reads and adds to data (dictionary)
+
+
+def ingest_stage(data):
+    inputs = data['inputs']
+    states = inputs['states']
+    # Block group table (gis.read_table in ejmap_step2)
+    df_bg = pd.read_csv(inputs['bg_csv'], dtype={'GEOID': str, 'HUC10': str})[keep_fields]
+    df_bg = normalize_key_columns(df_bg)
+    data['key_index'] = build_key_index(df_bg['GEOID'])
+    df_bg['GEOID'] = data['key_index']['geoid']
+    df_bg['Tract_ID'] = data['key_index']['tract']
+    data['df_bg'] = df_bg
+
+    data['df_epa'] = add_csv_dataset(inputs['epa_csv'], epa_metrics, None, ['ID', 'STATE_NAME', 'ACSTOTPOP'],
+                                     states, 'STATE_NAME', max_memory_mb=csv_max_memory_mb)
+    data['df_cdc'] = add_csv_dataset(inputs['cdc_csv'], cdc_metrics, None, ['TractFIPS', 'StateDesc'],
+                                     states, 'StateDesc', max_memory_mb=csv_max_memory_mb)
+    data['df_flood'] = add_first_street_data(inputs['flood_csv'], 'flood')
+    data['df_heat'] = add_first_street_data(inputs['heat_csv'], 'heat')
+
+    # Zonal statistics and sea level rise tables (outputs of raster and GIS stages)
+    df_tree = process_raster_data(normalize_key_columns(pd.read_csv(inputs['tree_csv'])), df_bg, 'TREE')
+    df_tree['TREE'] = 1 - df_tree['TREE']
+    data['df_tree'] = df_tree
+    data['df_imper'] = process_raster_data(normalize_key_columns(pd.read_csv(inputs['imper_csv'])), df_bg, 'IMPER')
+    df_slr = normalize_key_columns(pd.read_csv(inputs['slr_csv']))
+    df_slr['SLR'] = interpolate_slr_area(df_slr, sea_level_rise_depth_ft) / df_slr['ALAND']
+    data['df_slr'] = df_slr[['GEOID', 'SLR']]
+
+
+def tract_broadcast_stage(data):
+    key_index = data['key_index']
+    index = data['df_bg'].index
+    data['bg_datasets'] = [
+        align_block_group_data(key_index, data['df_epa'], 'ID', index),
+        broadcast_tract_data(key_index, data['df_cdc'], 'TractFIPS', index),
+        align_block_group_data(key_index, data['df_tree'], 'GEOID', index),
+        align_block_group_data(key_index, data['df_imper'], 'GEOID', index),
+        align_block_group_data(key_index, data['df_slr'], 'GEOID', index).fillna(0),
+        broadcast_tract_data(key_index, data['df_flood'], 'Tract_ID', index),
+        broadcast_tract_data(key_index, data['df_heat'], 'Tract_ID', index)
+    ]
+    data['all_metrics'] = epa_metrics + cdc_metrics + ['TREE', 'IMPER', 'SLR', 'FLOOD', 'HEAT']
+
+
+def merge_stage(data):
+    data['df_bg'] = assemble_datasets(data['df_bg'], data['bg_datasets'])
+    data['bg_datasets'] = None
+
+
+def percentile_stage(data):
+    df_bg = data['df_bg']
+    # Membership table is saved by ejmap_step1; built here from Study_Area
+    df_membership = build_membership_table(df_bg, 'GEOID', ['Study_Area'])
+    area_matrix = membership_matrix(df_membership, df_bg['GEOID'], 'Study_Area')
+    study_area_rows = select_region_rows(area_matrix, {'study_area': study_area_values})['study_area']
+    df_pct = calculate_percentiles(df_bg, data['all_metrics'], [], 'State', data['inputs']['states'],
+                                   study_area_rows)
+    data['df_bg'] = pd.concat([df_bg, df_pct], axis=1)
+
+
+def csv_output_stage(data):
+    all_metrics = data['all_metrics']
+    col_list = (keep_fields + ['ACSTOTPOP'] + all_metrics + ['P_' + x for x in all_metrics] +
+                ['N_' + x for x in all_metrics])
+    df_bg = data['df_bg'][col_list]
+    df_bg['DataSource'] = 'synthetic'
+    df_bg['SourceYear'] = 'synthetic'
+    df_bg.to_csv(os.path.join(data['output_folder'], 'block_groups_final.csv'), index=False, na_rep='-999999')
+
+# --------------------- history -----------------------------
+# History file = list of runs (newest last)
+
+
+def read_history(history_path):
+    if not os.path.exists(history_path):
+        return []
+    with open(history_path) as f:
+        return json.load(f)
+
+
+def save_history(history_path, history):
+    os.makedirs(os.path.dirname(os.path.abspath(history_path)), exist_ok=True)
+    with open(history_path, 'w') as f:
+        json.dump(history, f, indent=1)
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=benchmark_folder,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+# --------------------- print_results -----------------------------
+# Print stage results, compared to last run with the same number of block groups
+
+
+def print_results(run, previous_run=None):
+    print('\n' + 'Stage'.ljust(18) + 'Seconds'.rjust(10) + 'Peak MB'.rjust(10) + '  Change vs last run')
+    for stage_name, stage in run['stages'].items():
+        line = stage_name.ljust(18) + str(stage['seconds']).rjust(10) + str(stage['peak_mb']).rjust(10)
+        if previous_run is not None and stage_name in previous_run['stages']:
+            changes = []
+            for key, label in [('seconds', 'time'), ('peak_mb', 'memory')]:
+                old_value = previous_run['stages'][stage_name][key]
+                new_value = stage[key]
+                if old_value and new_value is not None:
+                    change = new_value / old_value - 1
+                    flag = ''
+                    if change > regression_threshold and new_value - old_value > regression_minimum[key]:
+                        flag = ' (REGRESSION)'
+                    changes.append(label + ' ' + '{:+.0%}'.format(change) + flag)
+            line += '  ' + ', '.join(changes)
+        print(line)
+    print('total'.ljust(18) + str(run['total_seconds']).rjust(10))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark ejmap_step2 tabular stages on synthetic data')
+    parser.add_argument('--scale', default='three_states', choices=sorted(scales))
+    parser.add_argument('--block-groups', type=int, help='custom scale: number of block groups')
+    parser.add_argument('--tracts', type=int, help='custom scale: number of tracts')
+    parser.add_argument('--states', type=int, help='custom scale: number of states')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--data-folder', default=default_data_folder, help='synthetic input folder')
+    parser.add_argument('--history', default=default_history, help='JSON history file')
+    parser.add_argument('--label', help='note saved with run (ex: release name)')
+    parser.add_argument('--regenerate', action='store_true', help='rewrite synthetic inputs')
+    parser.add_argument('--no-memory', action='store_true', help='skip peak memory run (tracemalloc)')
+    parser.add_argument('--no-save', action='store_true', help='do not add run to history')
+    args = parser.parse_args()
+
+    scale = dict(scales[args.scale])
+    scale_name = args.scale
+    for key in ['block_groups', 'tracts', 'states']:
+        if getattr(args, key) is not None:
+            scale[key] = getattr(args, key)
+            scale_name = 'custom'
+    data_folder = os.path.join(args.data_folder, scale_name + '_' + str(scale['block_groups']) + '_' +
+                               str(args.seed))
+    inputs = make_synthetic_inputs(data_folder, scale, args.seed, args.regenerate)
+
+    stage_results = run_benchmark(inputs, data_folder, track_memory=not args.no_memory)
+    run = {
+        'timestamp': datetime.datetime.now().isoformat(timespec='seconds'),
+        'label': args.label,
+        'git_commit': git_commit(),
+        'scale': scale_name,
+        'block_groups': inputs['block_groups'],
+        'tracts': inputs['tracts'],
+        'states': len(inputs['states']),
+        'track_memory': not args.no_memory,
+        'python': platform.python_version(),
+        'pandas': pd.__version__,
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'stages': stage_results,
+        'total_seconds': round(sum(x['seconds'] for x in stage_results.values()), 3)
+    }
+
+    history = read_history(args.history)
+    previous_runs = [x for x in history if x['block_groups'] == run['block_groups'] and
+                     x['track_memory'] == run['track_memory']]
+    print_results(run, previous_runs[-1] if previous_runs else None)
+    if args.no_save is False:
+        history.append(run)
+        save_history(args.history, history)
+        print('\nSaved run to ' + args.history)
@@ -0,0 +1,173 @@
+# ---------------------------------------------------------------------------
+# synthetic_data
+# Last updated: 2026-10-17
+# Authors: Mariel Sorlien
+#
+# Description:
+# Generates synthetic ejmap_step2 inputs for benchmarks (see benchmark_step2):
+# block group table, EJScreen, CDC PLACES, First Street flood/heat, NLCD
+# zonal statistics tables, NOAA sea level rise areas. Column names and ID
+# formats match the source data; values are random. Same scale and seed =
+# same files.
+# ---------------------------------------------------------------------------
+
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+# Scale: number of block groups, tracts, states
+# three_states = RI, CT, MA (2020 census); national = 50 states, DC, PR
+scales = {
+    'three_states': {'block_groups': 8647, 'tracts': 2754, 'states': 3},
+    'national': {'block_groups': 242335, 'tracts': 85190, 'states': 52}
+}
+state_names = ['Rhode Island', 'Connecticut', 'Massachusetts']
+
+# Same metrics as ejmap_step2
+epa_metrics = [
+    'PEOPCOLORPCT', 'LOWINCPCT', 'UNEMPPCT', 'LINGISOPCT', 'LESSHSPCT', 'UNDER5PCT', 'OVER64PCT', 'LIFEEXPPCT', 'PM25',
+    'OZONE', 'DSLPM', 'CANCER', 'RESP', 'RSEI_AIR', 'PTRAF', 'PRE1960PCT', 'PNPL', 'PRMP', 'PTSDF', 'UST', 'PWDIS'
+]
+cdc_metrics = ['CASTHMA_CrudePrev', 'BPHIGH_CrudePrev', 'CANCER_CrudePrev', 'DIABETES_CrudePrev', 'MHLTH_CrudePrev']
+study_area_values = [
+    'Narragansett Bay Watershed',
+    'Little Narragansett Bay Watershed',
+    'Southwest Coastal Ponds Watershed'
+]
+slr_depths = list(range(0, 11))
+# Source csv files have many columns that are never used (read, then dropped)
+extra_csv_columns = 40
+null_fraction = 0.02
+study_area_fraction = 0.1
+coastal_fraction = 0.1
+
+# --------------------- make_synthetic_inputs -----------------------------
+# Write synthetic inputs to folder (skipped if files for same scale and seed exist), return dictionary
+# scale = name in scales, or dictionary (block_groups, tracts, states)
+# Returns dictionary: file paths (bg_csv, epa_csv, cdc_csv, flood_csv, heat_csv, tree_csv, imper_csv, slr_csv),
+#   states (list of state names), block_groups, tracts
+
+
+def make_synthetic_inputs(folder, scale='three_states', seed=0, regenerate=False):
+    if not isinstance(scale, dict):
+        if scale not in scales:
+            raise ValueError('Unknown scale: ' + str(scale))
+        scale = scales[scale]
+    settings = {'scale': scale, 'seed': seed, 'extra_csv_columns': extra_csv_columns}
+    os.makedirs(folder, exist_ok=True)
+    info_path = os.path.join(folder, 'synthetic_inputs.json')
+    if regenerate is False and os.path.exists(info_path):
+        with open(info_path) as f:
+            info = json.load(f)
+        if info['settings'] == settings and all(os.path.exists(x) for x in info['files'].values()):
+            print('Using synthetic inputs in ' + folder)
+            return dict(info['files'], states=info['states'], block_groups=info['block_groups'],
+                        tracts=info['tracts'])
+
+    print('Generating synthetic inputs (' + str(scale['block_groups']) + ' block groups, ' +
+          str(scale['tracts']) + ' tracts, ' + str(scale['states']) + ' states)')
+    rng = np.random.default_rng(seed)
+    states = (state_names + ['State ' + str(x) for x in range(len(state_names) + 1, scale['states'] + 1)])
+    states = states[:scale['states']]
+    files = {x: os.path.join(folder, x[:-4] + '.csv') for x in
+             ['bg_csv', 'epa_csv', 'cdc_csv', 'flood_csv', 'heat_csv', 'tree_csv', 'imper_csv', 'slr_csv']}
+
+    print('\tBlock groups')
+    df_bg, tract_ids, tract_states = make_block_groups(rng, scale['block_groups'], scale['tracts'], states)
+    df_bg.to_csv(files['bg_csv'], index=False)
+    n_bg = len(df_bg)
+
+    print('\tEJScreen')
+    df = pd.DataFrame({'ID': df_bg['GEOID'], 'STATE_NAME': df_bg['State'],
+                       'ACSTOTPOP': rng.integers(0, 5000, n_bg)})
+    df = pd.concat([df, random_metrics(rng, epa_metrics, n_bg), filler_columns(rng, n_bg)], axis=1)
+    df.to_csv(files['epa_csv'], index=False)
+
+    print('\tCDC PLACES')
+    df = pd.DataFrame({'StateAbbr': 'XX', 'StateDesc': tract_states, 'TractFIPS': tract_ids})
+    df = pd.concat([df, random_metrics(rng, cdc_metrics, len(tract_ids), 100), filler_columns(rng, len(tract_ids))],
+                   axis=1)
+    df.to_csv(files['cdc_csv'], index=False)
+
+    for metric in ['flood', 'heat']:
+        print('\tFirst Street ' + metric)
+        counts = rng.integers(0, 200, (len(tract_ids), 10))
+        df = pd.DataFrame(counts, columns=['count_' + metric + 'factor' + str(x) for x in range(1, 11)])
+        df.insert(0, 'count_property', counts.sum(axis=1) + 1)
+        df.insert(0, 'fips', tract_ids)
+        df.to_csv(files[metric + '_csv'], index=False)
+
+    print('\tNLCD zonal statistics')
+    for name in ['tree_csv', 'imper_csv']:
+        df = pd.DataFrame({'GEOID': df_bg['GEOID'], 'COUNT': rng.integers(1, 10000, n_bg),
+                           'MEAN': rng.random(n_bg) * 100})
+        df.to_csv(files[name], index=False)
+
+    print('\tNOAA sea level rise')
+    coastal = rng.random(n_bg) < coastal_fraction
+    aland = df_bg['ALAND'].values[coastal]
+    # Area covered grows with depth, never more than ALAND
+    shares = np.cumsum(rng.random((coastal.sum(), len(slr_depths))), axis=1)
+    shares = shares / shares[:, -1:] * rng.random((coastal.sum(), 1))
+    df = pd.DataFrame(shares * aland[:, None], columns=['AREA_' + str(x) + 'FT' for x in slr_depths])
+    df.insert(0, 'ALAND', aland)
+    df.insert(0, 'GEOID', df_bg['GEOID'].values[coastal])
+    df.to_csv(files['slr_csv'], index=False)
+
+    info = {'settings': settings, 'files': files, 'states': states, 'block_groups': n_bg,
+            'tracts': len(tract_ids)}
+    with open(info_path, 'w') as f:
+        json.dump(info, f, indent=1)
+    return dict(files, states=states, block_groups=n_bg, tracts=len(tract_ids))
+
+# --------------------- make_block_groups -----------------------------
+# Block group table (same columns as ejmap_step1 output), return (dataframe, tract IDs, tract states)
+
+
+def make_block_groups(rng, n_block_groups, n_tracts, states):
+    # Tracts split evenly between states; state FIPS = state position + 1, county = 001-020
+    tract_state = np.arange(n_tracts) * len(states) // n_tracts
+    county = np.arange(n_tracts) % 20 + 1
+    tract_ids = (tract_state + 1) * 10 ** 9 + county * 10 ** 6 + np.arange(n_tracts)
+    # 1 to 9 block groups per tract
+    bg_counts = 1 + np.bincount(rng.integers(0, n_tracts, max(n_block_groups - n_tracts, 0)), minlength=n_tracts)
+    bg_counts = np.minimum(bg_counts, 9)
+    bg_tract = np.repeat(np.arange(n_tracts), bg_counts)
+    bg_number = np.arange(len(bg_tract)) - np.repeat(np.cumsum(bg_counts) - bg_counts, bg_counts) + 1
+    geoids = tract_ids[bg_tract] * 10 + bg_number
+    n_bg = len(geoids)
+
+    study_area = np.full(n_bg, 'Outside Study Area', dtype=object)
+    in_study_area = rng.random(n_bg) < study_area_fraction
+    labels = study_area_values + [study_area_values[0] + '; ' + study_area_values[2]]
+    study_area[in_study_area] = np.array(labels, dtype=object)[rng.integers(0, len(labels), in_study_area.sum())]
+    huc10 = rng.integers(10 ** 9, 10 ** 10, n_bg // 20 + 1)[rng.integers(0, n_bg // 20 + 1, n_bg)]
+
+    df_bg = pd.DataFrame({
+        # GEOID text with leading 0 (same as census shapefile)
+        'GEOID': pd.Series(geoids).astype(str).str.zfill(12),
+        'Town': 'Town ' + pd.Series(bg_tract // 5).astype(str),
+        'State': np.array(states, dtype=object)[tract_state[bg_tract]],
+        'HUC10': pd.Series(huc10).astype(str),
+        'HUC10_Name': 'Watershed ' + pd.Series(huc10 % 1000).astype(str),
+        'Study_Area': study_area,
+        'ALAND': rng.integers(10 ** 4, 10 ** 7, n_bg).astype(float),
+        'AWATER': np.where(rng.random(n_bg) < 0.3, rng.integers(0, 10 ** 6, n_bg), 0).astype(float)
+    })
+    tract_states = np.array(states, dtype=object)[tract_state]
+    return df_bg, pd.Series(tract_ids).astype(str).str.zfill(11), tract_states
+
+# --------------------- random_metrics, filler_columns -----------------------------
+
+
+def random_metrics(rng, metrics, n_rows, max_value=1):
+    values = rng.random((n_rows, len(metrics))) * max_value
+    values[rng.random(values.shape) < null_fraction] = np.nan
+    return pd.DataFrame(values, columns=metrics)
+
+
+def filler_columns(rng, n_rows):
+    values = rng.random((n_rows, extra_csv_columns))
+    return pd.DataFrame(values, columns=['EXTRA_' + str(x) for x in range(extra_csv_columns)])
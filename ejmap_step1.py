@@ -6,28 +6,34 @@
 #
 # Description:
 # Adds town, watershed, and study area data to census block groups.
-# REQUIRES GIS/ARCPY
+# REQUIRES GIS/ARCPY, or geopandas + pyogrio (gis_backend = 'geopandas')
+# Run as a script, or import and call run_step1(config) (see default_config)
 # ---------------------------------------------------------------------------
 
-import arcpy
 import os
 
 from functions.add_metadata import add_metadata_fields
-from functions.refine_block_groups import block_group_spatial_join
+from functions.area_membership import build_membership_table
+from functions.area_membership import save_membership_table
+from functions.gis_backend import get_gis_backend
+from functions.instrumentation import configure_instrumentation
+from functions.instrumentation import save_run_report
+from functions.instrumentation import stage
+from functions.refine_block_groups import block_group_overlay, block_group_spatial_join
 from functions.replace_null_gis import replace_null_in_field
 
-arcpy.env.overwriteOutput = True
-
 # ------------------------------ STEP 1 -------------------------------------
 # Set workspace, projection, initial variables (MANDATORY)
 
+# Set GIS backend: 'arcpy' (ArcGIS Pro) or 'geopandas' (geopandas + pyogrio, no ArcGIS needed)
+gis_backend = 'arcpy'
+
 # Set workspace
 base_folder = os.getcwd()
-scratch_folder = arcpy.env.scratchFolder
 gis_folder = base_folder + '/gis_data/int_gisdata/ejmap_intdata.gdb'
 
-# Set default projection
-arcpy.env.outputCoordinateSystem = arcpy.SpatialReference('NAD 1983 UTM Zone 19N')
+# Set default projection (NAD 1983 UTM Zone 19N)
+output_crs = 26919
 
 # Set inputs
 gis_block_groups = gis_folder + '/source_data/block_groups'
@@ -35,6 +41,15 @@ keep_fields = ['GEOID', 'ALAND', 'AWATER']
 
 # Set output
 gis_output = gis_folder + '/RICTMA_BlockGroups_2020_NBEP2023'
+# Block group x area table (one row per block group and study area / watershed), used by ejmap_step2
+# (None = skip)
+membership_csv = base_folder + '/tabular_data/int_data/block_group_areas.csv'
+membership_fields = ['Study_Area', 'HUC10']  # Fields with areas joined with '; ' (output names)
+# Run report: wall time, CPU time, peak memory, and rows for each stage (None = print summary only)
+run_report_json = base_folder + '/tabular_data/int_data/ejmap_step1_run_report.json'
+# Profile stages (stage name: 'cprofile' or 'tracemalloc'), ex: {'block_group_overlay': 'cprofile'}
+profile_stages = {}
+profile_folder = base_folder + '/tabular_data/int_data/profiles'
 
 # ------------------------------ STEP 2 -------------------------------------
 # Add towns, watersheds, study area (optional)
@@ -43,6 +58,8 @@ gis_output = gis_folder + '/RICTMA_BlockGroups_2020_NBEP2023'
 add_town_names = True
 add_watershed_names = True
 add_study_area = True
+spatial_join_workers = 1  # geopandas backend: processes per join (None = all cores)
+fused_overlay = True  # True = all joins in one pass, one output write (REQUIRES SHAPELY 2); False = one join at a time
 
 # Set inputs
 gis_towns = gis_folder + '/source_data/towns'
@@ -66,71 +83,148 @@ source_year = '2020; 2021; 2001; 2005; 2023; 2017'
 
 # ---------------------------- RUN SCRIPT -----------------------------------
 
-# Add towns
-if add_town_names is True:
-    print('Adding town names')
-    # Add spatial join
-    block_group_spatial_join(gis_block_groups, gis_towns, '', gis_output)
-    # Replace null/blank values
-    replace_null_in_field(
-        in_table=gis_output,
-        fields=town_columns,
-        new_text='No Data')
-    # Update gis_block_groups
-    gis_block_groups = gis_output
-    print('Updating column list')
-    keep_fields += town_columns
-
-if add_watershed_names is True:
-    print('\nAdding watershed names')
-    # Add spatial join
-    block_group_spatial_join(gis_block_groups, gis_watersheds, watershed_columns, gis_output)
-    # Update gis_block_groups
-    gis_block_groups = gis_output
-    print('Updating column list')
-    keep_fields += watershed_columns
-
-if add_study_area is True:
-    print('\nAdding study area names')
-    # Add spatial join
-    block_group_spatial_join(gis_block_groups, gis_study_area, study_area_columns, gis_output)
-    # Replace null/blank values
-    replace_null_in_field(
-        in_table=gis_output,
-        fields=study_area_columns,
-        new_text='Outside Study Area')
-    # Update gis_block_groups
-    gis_block_groups = gis_output
-    print('Updating column list')
-    keep_fields += study_area_columns
-
-if gis_block_groups != gis_output:
-    print('\nSaving output')
-    arcpy.management.CopyFeatures(gis_block_groups, gis_output)
-
-print('\nDropping extra columns')
-arcpy.management.DeleteField(gis_output, keep_fields, 'KEEP_FIELDS')
-
-if len(new_column_names) > 0:
-    print('Renaming columns')
-    for old_name, new_name in new_column_names.items():
-        # Check if old and new name match, ignoring case
-        # If yes - replace old name with 'temp_name'
-        if old_name.lower() == new_name.lower():
-            arcpy.management.AlterField(
-                in_table=gis_output,
-                field=old_name,
-                new_field_name='temp_name')
-            old_name = 'temp_name'
-        # Replace old name with new name
-        arcpy.management.AlterField(
-            in_table=gis_output,
-            field=old_name,
-            new_field_name=new_name,
-            new_field_alias=new_name)
-
-print('Adding columns (DataSource, SourceYear)')
-add_metadata_fields(gis_output, data_source, source_year)
-
-print('\nDeleting scratch folder')
-arcpy.Delete_management(scratch_folder)
+# --------------------- default_config -----------------------------
+# Settings above as a dictionary (run config for run_step1)
+
+
+def default_config():
+    return {
+        'gis_backend': gis_backend,
+        'output_crs': output_crs,
+        'gis_block_groups': gis_block_groups,
+        'keep_fields': keep_fields,
+        'gis_output': gis_output,
+        'membership_csv': membership_csv,
+        'membership_fields': membership_fields,
+        'run_report_json': run_report_json,
+        'profile_stages': profile_stages,
+        'profile_folder': profile_folder,
+        'add_town_names': add_town_names,
+        'add_watershed_names': add_watershed_names,
+        'add_study_area': add_study_area,
+        'spatial_join_workers': spatial_join_workers,
+        'fused_overlay': fused_overlay,
+        'gis_towns': gis_towns,
+        'town_columns': town_columns,
+        'gis_watersheds': gis_watersheds,
+        'watershed_columns': watershed_columns,
+        'gis_study_area': gis_study_area,
+        'study_area_columns': study_area_columns,
+        'new_column_names': new_column_names,
+        'data_source': data_source,
+        'source_year': source_year
+    }
+
+# --------------------- run_step1 -----------------------------
+# Run step 1, return output feature class
+# config = run config (dictionary); missing settings use default_config()
+#   ex: run_step1({'gis_backend': 'geopandas', 'fused_overlay': False})
+
+
+def run_step1(config=None):
+    config = dict(default_config(), **(config or {}))
+    # GIS backend is imported here (not on import), so importing this script does not load arcpy
+    gis_backend = config['gis_backend']
+    gis = get_gis_backend(gis_backend)
+    gis.set_environment(output_crs=config['output_crs'])
+    scratch_folder = gis.scratch_folder()
+    gis_block_groups = config['gis_block_groups']
+    gis_output = config['gis_output']
+    # Copy (list is added to below)
+    keep_fields = list(config['keep_fields'])
+    town_columns = config['town_columns']
+    watershed_columns = config['watershed_columns']
+    study_area_columns = config['study_area_columns']
+    new_column_names = config['new_column_names']
+    spatial_join_workers = config['spatial_join_workers']
+
+    configure_instrumentation('ejmap_step1', config['profile_stages'], config['profile_folder'])
+
+    if config['fused_overlay'] is True:
+        print('Adding towns, watersheds, study area')
+        overlay_layers = []
+        if config['add_town_names'] is True:
+            # Join features, fields, match option, null value
+            overlay_layers.append([config['gis_towns'], town_columns, 'LARGEST_OVERLAP', 'No Data'])
+        if config['add_watershed_names'] is True:
+            overlay_layers.append([config['gis_watersheds'], watershed_columns, 'INTERSECT', None])
+        if config['add_study_area'] is True:
+            overlay_layers.append([config['gis_study_area'], study_area_columns, 'INTERSECT', 'Outside Study Area'])
+        block_group_overlay(gis_block_groups, overlay_layers, gis_output, keep_fields, new_column_names,
+                            backend=gis_backend, workers=spatial_join_workers)
+
+    else:
+        null_values = {}
+
+        # Add towns
+        if config['add_town_names'] is True:
+            with stage('towns', 'Adding town names'):
+                # Add spatial join
+                block_group_spatial_join(gis_block_groups, config['gis_towns'], '', gis_output,
+                                         backend=gis_backend, workers=spatial_join_workers)
+                # Null/blank values replaced after all joins (one pass)
+                null_values.update({x: 'No Data' for x in town_columns})
+                # Update gis_block_groups
+                gis_block_groups = gis_output
+                print('Updating column list')
+                keep_fields += town_columns
+
+        if config['add_watershed_names'] is True:
+            with stage('watersheds', '\nAdding watershed names'):
+                # Add spatial join
+                block_group_spatial_join(gis_block_groups, config['gis_watersheds'], watershed_columns, gis_output,
+                                         backend=gis_backend, workers=spatial_join_workers)
+                # Update gis_block_groups
+                gis_block_groups = gis_output
+                print('Updating column list')
+                keep_fields += watershed_columns
+
+        if config['add_study_area'] is True:
+            with stage('study_area', '\nAdding study area names'):
+                # Add spatial join
+                block_group_spatial_join(gis_block_groups, config['gis_study_area'], study_area_columns, gis_output,
+                                         backend=gis_backend, workers=spatial_join_workers)
+                # Null/blank values replaced after all joins (one pass)
+                null_values.update({x: 'Outside Study Area' for x in study_area_columns})
+                # Update gis_block_groups
+                gis_block_groups = gis_output
+                print('Updating column list')
+                keep_fields += study_area_columns
+
+        if len(null_values) > 0:
+            print('')
+            replace_null_in_field(gis_output, null_values, backend=gis_backend)
+
+        with stage('output', '\nSaving output'):
+            if gis_block_groups != gis_output:
+                gis.copy_features(gis_block_groups, gis_output)
+
+            print('Dropping extra columns')
+            gis.keep_fields(gis_output, keep_fields)
+
+            if len(new_column_names) > 0:
+                print('Renaming columns')
+                for old_name, new_name in new_column_names.items():
+                    gis.rename_field(gis_output, old_name, new_name)
+
+    print('Adding columns (DataSource, SourceYear)')
+    add_metadata_fields(gis_output, config['data_source'], config['source_year'], backend=gis_backend)
+
+    if config['membership_csv'] is not None:
+        with stage('membership', '\nSaving block group areas') as record:
+            df = gis.read_table(gis_output)
+            # Only fields in output (ex: add_study_area = False)
+            membership_fields = [x for x in config['membership_fields'] if x in df.columns]
+            df_membership = build_membership_table(df, 'GEOID', membership_fields)
+            save_membership_table(df_membership, config['membership_csv'])
+            record['rows'] = len(df_membership)
+
+    with stage('delete_scratch', '\nDeleting scratch folder'):
+        gis.delete(scratch_folder)
+
+    save_run_report(config['run_report_json'])
+    return gis_output
+
+
+if __name__ == '__main__':
+    run_step1()
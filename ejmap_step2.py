@@ -6,34 +6,53 @@
 #
 # Description:
 # Combines multiple datasets and calculates state and study area percentiles
-# REQUIRES GIS/ARCPY
+# REQUIRES GIS/ARCPY, or geopandas + pyogrio + rasterio (gis_backend = 'geopandas')
+# Run as a script, or import and call run_step2(config) (see default_config)
 # ---------------------------------------------------------------------------
 
-import arcpy
 import os
 import pandas as pd
-import numpy as np
-import math
 
 from functions.add_csv_dataset import add_csv_dataset
 from functions.add_csv_dataset import add_first_street_data
 from functions.add_raster_dataset import add_raster_dataset
-from functions.add_raster_dataset import process_raster_csv
-from functions.calculate_sea_level_rise import intersect_slr_block_groups
-
-arcpy.env.overwriteOutput = True
+from functions.add_raster_dataset import process_raster_data
+from functions.area_membership import build_membership_table
+from functions.area_membership import membership_matrix
+from functions.area_membership import read_membership_table
+from functions.area_membership import select_region_rows
+from functions.assemble_datasets import assemble_datasets
+from functions.calculate_sea_level_rise import interpolate_slr_area
+from functions.calculate_sea_level_rise import intersect_slr_all_depths
+from functions.calculate_sea_level_rise import slr_metric_names
+from functions.calculate_percentiles import calculate_percentiles
+from functions.calculate_percentiles import calculate_region_percentiles
+from functions.gis_backend import get_gis_backend
+from functions.instrumentation import configure_instrumentation
+from functions.instrumentation import save_run_report
+from functions.instrumentation import stage
+from functions.key_index import align_block_group_data
+from functions.key_index import broadcast_tract_data
+from functions.key_index import build_key_index
+from functions.source_cache import normalize_key_columns
+from functions.run_stages import run_stages
+from functions.stage_cache import run_cached_stage
+from functions.write_output import write_joined_features
 
 # ------------------------------ STEP 1 -------------------------------------
 # Set workspace, projection, initial variables (MANDATORY)
 
+# Set GIS backend: 'arcpy' (ArcGIS Pro) or 'geopandas' (geopandas + pyogrio + rasterio, no ArcGIS needed;
+# use raster_engine = 'numpy' and .tif rasters)
+gis_backend = 'arcpy'
+
 # Set workspace
 base_folder = os.getcwd()
-scratch_folder = arcpy.env.scratchFolder
 gis_folder = base_folder + '/gis_data/int_gisdata/ejmap_intdata.gdb'
 csv_folder = base_folder + '/tabular_data'
 
-# Set default projection
-arcpy.env.outputCoordinateSystem = arcpy.SpatialReference('NAD 1983 UTM Zone 19N')
+# Set default projection (NAD 1983 UTM Zone 19N)
+output_crs = 26919
 
 # Set inputs
 gis_block_groups = gis_folder + '/RICTMA_BlockGroups_2020_NBEP2023'
@@ -42,10 +61,20 @@ keep_fields = ['GEOID', 'Town', 'State', 'HUC10', 'HUC10_Name', 'Study_Area', 'A
 # Set outputs
 csv_output = csv_folder + '/int_data/block_groups_final.csv'
 gis_output = gis_folder + '/block_groups_final'
+# 'feature_class' (gis_output = feature class) or 'geoparquet' (gis_output = .parquet file; REQUIRES GEOPANDAS, PYARROW)
+gis_output_format = 'feature_class'
 
 # Set variables
 state_list = ['Rhode Island', 'Connecticut', 'Massachusetts']
 exclude_ocean_block_groups = True   # If true, drops all block groups with no land
+csv_max_memory_mb = 500  # Read national csv files in chunks of about this size (None = read whole file)
+source_cache_folder = csv_folder + '/cache/source'  # Parse csv files once, reuse on later runs (None = no cache)
+source_cache_max_mb = 5000  # Deletes least recently used cache files above this size
+# Run report: wall time, CPU time, peak memory, and rows for each stage (None = print summary only)
+run_report_json = csv_folder + '/int_data/ejmap_step2_run_report.json'
+# Profile stages (stage name: 'cprofile' or 'tracemalloc'), ex: {'calculate_percentiles': 'cprofile'}
+profile_stages = {}
+profile_folder = csv_folder + '/int_data/profiles'
 
 # ------------------------------ STEP 2 -------------------------------------
 # Add EPA data (MANDATORY)
@@ -84,28 +113,35 @@ add_noaa_sea_level_rise = True
 add_first_street_flood = True
 add_first_street_heat = True
 
-# Indicate whether to process raster datasets OR use csv summary file instead
-skip_to_tree_csv = False
-skip_to_impervious_surface_csv = False
-skip_to_sea_level_csv = False
+# Reuse raster, sea level rise, and csv outputs from earlier runs if inputs are unchanged (None = always rerun)
+stage_cache_folder = csv_folder + '/cache/stages'
 
 # List inputs
 cdc_csv = csv_folder + '/source_data/PLACES__Census_Tract_Data__GIS_Friendly_Format___2022_release.csv'
 tree_raster = gis_folder + '/nlcd_2021_treecanopy'
 impervious_surface_raster = gis_folder + '/nlcd_2021_impervious'
-noaa_sea_level_rise_0ft = gis_folder + '/source_data/noaa_slr_depth_0ft'
-noaa_sea_level_rise_low = gis_folder + '/source_data/noaa_slr_depth_0ft'  # Target sea level rise rounded down
-noaa_sea_level_rise_high = gis_folder + '/source_data/noaa_slr_depth_1ft'  # Target sea level rise rounded up
+# NOAA sea level rise layers (depth in ft: layer). Must include 0 ft and depths above/below target sea level rise
+noaa_sea_level_rise_layers = {x: gis_folder + '/source_data/noaa_slr_depth_' + str(x) + 'ft' for x in range(0, 11)}
 first_street_flood = csv_folder + '/source_data/flood_v2.1_summary_fsf_flood_tract_summary.csv'
 first_street_heat = csv_folder + '/source_data/heat_v1.1_summary_fsf_heat_tract_summary.csv'
 
-# List outputs
+# List outputs (only saved if save_intermediate_csv is True)
+save_intermediate_csv = False
 tree_csv = csv_folder + '/int_data/nlcd_tree.csv'
 impervious_surface_csv = csv_folder + '/int_data/nlcd_impervious.csv'
-sea_level_low_csv = csv_folder + '/int_data/noaa_slr_0ft.csv'
-sea_level_high_csv = csv_folder + '/int_data/noaa_slr_1ft.csv'
+sea_level_csv = csv_folder + '/int_data/noaa_slr_all_depths.csv'
+
+# Run stages at the same time (1 = one at a time)
+stage_workers = 1
+stage_executor = 'process'  # 'process' or 'thread' (arcpy stages need 'process')
 
 # Set variables
+raster_engine = 'arcpy'  # Zonal statistics engine: 'arcpy' (ZonalStatisticsAsTable) or 'numpy' (faster, no temp raster)
+zone_index_folder = base_folder + '/gis_data/int_gisdata/zone_index'  # Saved block group zone grids (numpy engine)
+raster_tile_size = None  # Numpy engine: read raster in tiles of this many cells per side (ex: 4096 for CONUS)
+raster_workers = 1  # Numpy engine: processes used for tiles (None = all cores)
+# Interpolated between NOAA depth layers. One number (metric 'SLR') or list of scenarios (ex: [0.85, 2, 4, 6]
+# adds metrics 'SLR_0_85', 'SLR_2', 'SLR_4', 'SLR_6'; all scenarios share one overlay)
 sea_level_rise_depth_ft = 0.85
 cdc_metrics = [
     'CASTHMA_CrudePrev', 'BPHIGH_CrudePrev', 'CANCER_CrudePrev', 'DIABETES_CrudePrev', 'MHLTH_CrudePrev'
@@ -126,280 +162,386 @@ rename_cdc_metrics = {
 
 calculate_state_percentiles = True
 calculate_study_area_percentiles = True
+calculate_national_percentiles = False  # If true, adds national percentiles (U_ columns)
 
 study_area_column = 'Study_Area'
+# Block group x area table from ejmap_step1 (None or missing file = split study_area_column)
+membership_csv = csv_folder + '/int_data/block_group_areas.csv'
 study_area_values = [
     'Narragansett Bay Watershed',
     'Little Narragansett Bay Watershed',
     'Southwest Coastal Ponds Watershed'
 ]
 
+# Batch mode: study area percentiles for more regions (ex: one per estuary program), calculated in one pass
+# Each region is saved as a copy of the output where N_ columns are that region's percentiles
+# region name: list of study area values (None = no regions)
+study_area_regions = None
+# ex: {
+#     'NBEP': ['Narragansett Bay Watershed', 'Little Narragansett Bay Watershed', 'Southwest Coastal Ponds Watershed'],
+#     'Buzzards_Bay': ['Buzzards Bay Watershed']
+# }
+region_output_folder = csv_folder + '/output_data/regions'  # csv files (region name + .csv)
+# Geodatabase for feature classes (block_groups_ + region name), or folder if gis_output_format = 'geoparquet'
+# None = csv only
+region_gis_folder = None
+
 data_source = 'EPA; CDC; NLCD; NLCD, USFS; RIGIS; First Street; NOAA'
 source_year = '2017-2022, 2022; 2019, 2020; 2019; 2021; 2021; 2022; 2019'
 
 # ---------------------------- RUN SCRIPT -----------------------------------
 
-# Step 1 ----
-# Define extra variables
-block_groups_xls = scratch_folder + '/block_groups.xls'
-block_groups_clip = scratch_folder + '/block_groups_clip.shp'
-temp_csv = scratch_folder + '/temp_csv.csv'
-temp_excel = scratch_folder + '/temp_excel.xls'
-inverse_metrics = []  # List of metrics where higher values are better, not worse
-
-print('ADDING BLOCK GROUP DATA')
-if exclude_ocean_block_groups is True:
-    print('Dropping block groups with no land')
-    arcpy.analysis.Select(
-        in_features=gis_block_groups,
-        out_feature_class=block_groups_clip,
-        where_clause='ALAND > 0'
-    )
-    gis_block_groups = block_groups_clip
-print('Exporting table to excel')
-arcpy.conversion.TableToExcel(gis_block_groups, block_groups_xls)
-print('Converting to dataframe')
-df_bg = pd.read_excel(block_groups_xls)
-print('Dropping extra columns')
-df_bg = df_bg[keep_fields]
-print('Adding column for tract ID')
-df_bg['Tract_ID'] = df_bg['GEOID'].astype(str)
-df_bg['Tract_ID'] = df_bg.Tract_ID.str[:-1]
-df_bg['Tract_ID'] = df_bg['Tract_ID'].astype(float)
-
-# Step 2 ----
-print('\nADDING EPA DATA')
-# Import csv, drop extra data, rename columns, save as temp  csv
-add_csv_dataset(
-    epa_csv, epa_metrics, rename_epa_metrics,
-    ['ID', 'STATE_NAME', 'ACSTOTPOP'],
-    state_list, 'STATE_NAME', temp_csv
-)
-print('Merging with block group data')
-# Reread csv file
-df_epa = pd.read_csv(temp_csv, sep=',')
-# Merge to block group data
-df_bg = pd.merge(df_bg, df_epa, left_on='GEOID', right_on='ID', how='left')
-print('Adding variable names to list')
-all_metrics = list(map(rename_epa_metrics.get, epa_metrics, epa_metrics))
-
-# Step 3 ----
-if add_cdc is True:
-    print('\nADDING CDC DATA')
-    # Import csv, drop extra data, rename columns, save as temp  csv
-    add_csv_dataset(
-        cdc_csv, cdc_metrics, rename_cdc_metrics,
-        ['TractFIPS', 'StateDesc'],
-        state_list, 'StateDesc', temp_csv
-    )
-    print('Merging with block group data')
-    # Reread csv file
-    df_cdc = pd.read_csv(temp_csv, sep=',')
-    # Merge to block group data
-    df_bg = pd.merge(df_bg, df_cdc, left_on='Tract_ID', right_on='TractFIPS', how='left')
-    print('Adding variable names to list')
-    all_metrics += list(map(rename_cdc_metrics.get, cdc_metrics, cdc_metrics))
-
-if add_nlcd_tree is True:
-    print('\nADDING NLCD TREE DATA')
-    if skip_to_tree_csv is False:
-        # Process raster, save output as csv
-        add_raster_dataset(gis_block_groups, tree_raster, tree_csv)
-    # Process csv data
-    process_raster_csv(tree_csv, df_bg, 'TREE', temp_csv)
-    print('Inverting data (% Trees to % Lack of Trees)')
-    # Reread csv file
-    df_tree = pd.read_csv(temp_csv, sep=',')
-    # Invert column
-    df_tree['TREE'] = 1 - df_tree['TREE']
-    print('Merging with block group data')
-    df_bg = pd.merge(df_bg, df_tree, on=['GEOID'], how='left')
-    print('Adding variable names to list')
-    all_metrics += ['TREE']
-
-if add_nlcd_impervious_surface is True:
-    print('\nADDING NLCD IMPERVIOUS DATA')
-    if skip_to_impervious_surface_csv is False:
-        # Process raster, save output as csv
-        add_raster_dataset(gis_block_groups, impervious_surface_raster, impervious_surface_csv)
-    # Process csv data
-    process_raster_csv(impervious_surface_csv, df_bg, 'IMPER', temp_csv)
-    print('Merging with block group data')
-    # Reread csv file
-    df_imper = pd.read_csv(temp_csv, sep=',')
-    # Merge to block group data
-    df_bg = pd.merge(df_bg, df_imper, on=['GEOID'], how='left')
-    print('Adding variable names to list')
-    all_metrics += ['IMPER']
-
-if add_noaa_sea_level_rise is True:
-    print('\nADDING NOAA SEA LEVEL RISE DATA')
-
-    slr_low = math.floor(sea_level_rise_depth_ft)
-    slr_high = math.ceil(sea_level_rise_depth_ft)
-    slr_remainder = sea_level_rise_depth_ft - slr_low
-
-    print('Calculating acres land covered by ' + str(slr_low) + ' ft sea level rise')
-    if skip_to_sea_level_csv is False:
-        intersect_slr_block_groups(noaa_sea_level_rise_low, noaa_sea_level_rise_0ft, gis_block_groups,
-                                   sea_level_low_csv)
-    print('Reading csv')
-    df_low = pd.read_csv(sea_level_low_csv)
-    print('Adjusting columns')
-    df_low['SLR_low'] = df_low['ASLR']
-    df_low = df_low[['GEOID', 'ALAND', 'SLR_low']]
-
-    if slr_low != slr_high:
-        print('Calculating acres land covered by ' + str(slr_high) + ' ft sea level rise')
-        if skip_to_sea_level_csv is False:
-            intersect_slr_block_groups(noaa_sea_level_rise_high, noaa_sea_level_rise_low, gis_block_groups,
-                                       sea_level_high_csv)
-        print('Reading csv')
-        df_high = pd.read_csv(sea_level_high_csv)
-        print('Adjusting columns')
-        df_high['SLR_high'] = df_high['ASLR']
-        df_high = df_high[['GEOID', 'ALAND', 'SLR_high']]
-
-        print('Merging dataframes')
-        df_slr = pd.merge(df_low, df_high, on=['GEOID', 'ALAND'], how='outer')
-        print('Setting blank values to 0')
-        df_slr['SLR_high'].fillna(0, inplace=True)
-        df_slr['SLR_low'].fillna(0, inplace=True)
-        print('Calculating acres inundated for ' + str(sea_level_rise_depth_ft) + ' ft sea level rise')
-        df_slr['SLR'] = df_slr['SLR_low'] + slr_remainder * df_slr['SLR_high']
-    else:
-        print('Adjusting dataframe')
-        df_slr = df_low
-        df_slr['SLR'] = df_slr['SLR_low']
-
-    print('Converting "area inundated" to "% land area inundated"')
-    df_slr['SLR'] = df_slr['SLR'] / df_slr['ALAND']
-    print('Dropping extra columns')
-    df_slr = df_slr[['GEOID', 'SLR']]
-    print('Merging with block group data')
-    # Merge to block group data
-    df_bg = pd.merge(df_bg, df_slr, on=['GEOID'], how='left')
-    print('Setting null values to 0')
-    # Must run this step AFTER merge
-    df_bg['SLR'].fillna(0, inplace=True)
-    print('Adding variable names to list')
-    all_metrics += ['SLR']
-
-if add_first_street_flood is True:
-    print('\nADDING FIRST STREET FLOOD DATA')
-    add_first_street_data(first_street_flood, 'flood', temp_csv)
-    print('Merging with block group data')
-    # Reread csv file
-    df_flood = pd.read_csv(temp_csv, sep=',')
-    # Merge to block group data
-    df_bg = pd.merge(df_bg, df_flood, on=['Tract_ID'], how='left')
-    print('Adding variable names to list')
-    all_metrics += ['FLOOD']
-
-if add_first_street_heat is True:
-    print('\nADDING FIRST STREET HEAT DATA')
-    add_first_street_data(first_street_heat, 'heat', temp_csv)
-    print('Merging with block group data')
-    # Reread csv file
-    df_heat = pd.read_csv(temp_csv, sep=',')
-    # Merge to block group data
-    df_bg = pd.merge(df_bg, df_heat, on=['Tract_ID'], how='left')
-    print('Adding variable names to list')
-    all_metrics += ['HEAT']
-
-# Step 4 ----
-print('\nCALCULATING PERCENTILES')
-if calculate_study_area_percentiles is True:
-    # Convert list to string with | (or) divider
-    study_areas = '|'.join(study_area_values)
-    print('Selecting study area tracts')
-    df_study_area = df_bg.loc[df_bg[study_area_column].str.contains(study_areas)]
-
-# Calc percentile for each variable
-for col in all_metrics:
-    print('Calculating percentiles for ' + col)
-    # Set variables
-    n_col = 'N_' + col
-    p_col = 'P_' + col
-
-    if col in inverse_metrics:
-        pct_ascending = False
-    else:
-        pct_ascending = True
-
-    print('\tAdding columns')
-    df_bg[['p_temp', p_col, n_col]] = [0, 0, 0]
-
-    if calculate_state_percentiles is True:
-        for state in state_list:
-            df_temp = df_bg.loc[df_bg['State'] == state]
-
-            print('\tCalculating ' + state + ' percentiles')
-            # Calc percentile, assign to p_temp
-            df_bg['p_temp'] = df_temp[col].rank(pct=True,
-                                                ascending=pct_ascending)
-            # Replace null values
-            df_bg['p_temp'].fillna(0, inplace=True)
-            # Multiply by 100, truncate
-            df_bg['p_temp'] = np.trunc(100 * df_bg['p_temp'])
-            # Add to p_col
-            df_bg[p_col] += df_bg['p_temp']
-        print('\tSetting percentile for rows with no data to null')
-        df_bg[p_col] = np.where(df_bg[col].isnull(), np.nan, df_bg[p_col])
-
-    if calculate_study_area_percentiles is True:
-        print('\tCalculating NBEP percentiles')
-        # Calc percentile
-        df_bg[n_col] = df_study_area[col].rank(pct=True,
-                                               ascending=pct_ascending)
-        # Multiply by 100, truncate
-        df_bg[n_col] = np.trunc(100*df_bg[n_col])
-
-print('Dropping extra columns')
-p_columns = ['P_' + x for x in all_metrics]
-n_columns = ['N_' + x for x in all_metrics]
-# Build list of col
-col_list = keep_fields + ['ACSTOTPOP'] + all_metrics + p_columns + n_columns
-# Drop all unlisted columns
-df_bg = df_bg[col_list]
-
-print('Adding new columns')
-df_bg['DataSource'] = data_source
-df_bg['SourceYear'] = source_year
-
-print('\nSAVING DATA')
-print('Saving csv')
-df_bg.to_csv(csv_output,
-             index=False,
-             na_rep='-999999')
-
-print('Saving shapefile copy')
-arcpy.management.CopyFeatures(in_features=gis_block_groups,
-                              out_feature_class=gis_output)
-print('Dropping all fields except GEOID')
-arcpy.management.DeleteField(in_table=gis_output,
-                             drop_field=['GEOID'],
-                             method='KEEP_FIELDS')
-print('Adding temp ID field (numeric)')
-# Add field
-arcpy.management.AddField(in_table=gis_output,
-                          field_name='temp_ID',
-                          field_type='DOUBLE')
-# Set Field to "GEOID"
-arcpy.management.CalculateField(in_table=gis_output,
-                                field='temp_ID',
-                                expression='float(!GEOID!)')
-
-print('Joining csv to shapefile')
-# Join on temp_ID (integer) not ID (string) because tracts_int_csv drops the 0 at the start of each ID
-arcpy.management.JoinField(in_data=gis_output,
-                           in_field='temp_ID',
-                           join_table=csv_output,
-                           join_field='GEOID')
-print('Dropping duplicate ID fields')
-arcpy.management.DeleteField(in_table=gis_output,
-                             drop_field=['GEOID_1', 'temp_ID']
-                             )
-
-print('\nDELETING SCRATCH FOLDER')
-arcpy.Delete_management(scratch_folder)
+# --------------------- default_config -----------------------------
+# Settings above as a dictionary (run config for run_step2)
+
+
+def default_config():
+    return {
+        'gis_backend': gis_backend,
+        'output_crs': output_crs,
+        'gis_block_groups': gis_block_groups,
+        'keep_fields': keep_fields,
+        'csv_output': csv_output,
+        'gis_output': gis_output,
+        'gis_output_format': gis_output_format,
+        'state_list': state_list,
+        'exclude_ocean_block_groups': exclude_ocean_block_groups,
+        'csv_max_memory_mb': csv_max_memory_mb,
+        'source_cache_folder': source_cache_folder,
+        'source_cache_max_mb': source_cache_max_mb,
+        'run_report_json': run_report_json,
+        'profile_stages': profile_stages,
+        'profile_folder': profile_folder,
+        'epa_csv': epa_csv,
+        'epa_metrics': epa_metrics,
+        'rename_epa_metrics': rename_epa_metrics,
+        'add_cdc': add_cdc,
+        'add_nlcd_tree': add_nlcd_tree,
+        'add_nlcd_impervious_surface': add_nlcd_impervious_surface,
+        'add_noaa_sea_level_rise': add_noaa_sea_level_rise,
+        'add_first_street_flood': add_first_street_flood,
+        'add_first_street_heat': add_first_street_heat,
+        'stage_cache_folder': stage_cache_folder,
+        'cdc_csv': cdc_csv,
+        'tree_raster': tree_raster,
+        'impervious_surface_raster': impervious_surface_raster,
+        'noaa_sea_level_rise_layers': noaa_sea_level_rise_layers,
+        'first_street_flood': first_street_flood,
+        'first_street_heat': first_street_heat,
+        'save_intermediate_csv': save_intermediate_csv,
+        'tree_csv': tree_csv,
+        'impervious_surface_csv': impervious_surface_csv,
+        'sea_level_csv': sea_level_csv,
+        'stage_workers': stage_workers,
+        'stage_executor': stage_executor,
+        'raster_engine': raster_engine,
+        'zone_index_folder': zone_index_folder,
+        'raster_tile_size': raster_tile_size,
+        'raster_workers': raster_workers,
+        'sea_level_rise_depth_ft': sea_level_rise_depth_ft,
+        'cdc_metrics': cdc_metrics,
+        'rename_cdc_metrics': rename_cdc_metrics,
+        'calculate_state_percentiles': calculate_state_percentiles,
+        'calculate_study_area_percentiles': calculate_study_area_percentiles,
+        'calculate_national_percentiles': calculate_national_percentiles,
+        'study_area_column': study_area_column,
+        'membership_csv': membership_csv,
+        'study_area_values': study_area_values,
+        'study_area_regions': study_area_regions,
+        'region_output_folder': region_output_folder,
+        'region_gis_folder': region_gis_folder,
+        'data_source': data_source,
+        'source_year': source_year
+    }
+
+# --------------------- run_step2 -----------------------------
+# Run step 2, return block group dataframe (same as csv output)
+# config = run config (dictionary); missing settings use default_config()
+#   ex: run_step2({'gis_backend': 'geopandas', 'raster_engine': 'numpy', 'state_list': ['Rhode Island']})
+
+
+def run_step2(config=None):
+    config = dict(default_config(), **(config or {}))
+    # GIS backend is imported here (not on import), so importing this script does not load arcpy
+    gis_backend = config['gis_backend']
+    gis = get_gis_backend(gis_backend)
+    gis.set_environment(output_crs=config['output_crs'])
+    scratch_folder = gis.scratch_folder()
+    gis_block_groups = config['gis_block_groups']
+    keep_fields = config['keep_fields']
+
+    configure_instrumentation('ejmap_step2', config['profile_stages'], config['profile_folder'])
+
+    # Step 1 ----
+    # Define extra variables
+    block_groups_clip = scratch_folder + '/block_groups_clip.shp'
+    inverse_metrics = []  # List of metrics where higher values are better, not worse
+    raster_options = {'engine': config['raster_engine'], 'zone_index_folder': config['zone_index_folder'],
+                      'tile_size': config['raster_tile_size'], 'workers': config['raster_workers'],
+                      'backend': gis_backend}
+
+    with stage('block_groups', 'ADDING BLOCK GROUP DATA') as record:
+        # Block group fingerprint for stage cache (based on source data, not scratch copy)
+        block_group_inputs = [(gis_block_groups, ['GEOID', 'ALAND', 'AWATER'])]
+        block_group_params = {'exclude_ocean_block_groups': config['exclude_ocean_block_groups'],
+                              'gis_backend': gis_backend}
+        if config['exclude_ocean_block_groups'] is True:
+            print('Dropping block groups with no land')
+            gis.select(
+                in_features=gis_block_groups,
+                out_features=block_groups_clip,
+                where_clause='ALAND > 0'
+            )
+            gis_block_groups = block_groups_clip
+        print('Converting to dataframe')
+        # Only imports selected columns (keep_fields)
+        df_bg = gis.read_table(gis_block_groups, keep_fields)
+        # Set ID columns to int64
+        df_bg = normalize_key_columns(df_bg)
+        print('Building block group and tract keys')
+        # int64 GEOID and tract ID; tract datasets are copied to block groups by position, not merged on float IDs
+        key_index = build_key_index(df_bg['GEOID'])
+        df_bg['GEOID'] = key_index['geoid']
+        df_bg['Tract_ID'] = key_index['tract']
+        record['rows'] = len(df_bg)
+
+    # Step 2 ----
+    with stage('epa', '\nADDING EPA DATA'):
+        # Import csv, drop extra data, rename columns
+        df_epa = run_cached_stage(
+            config['stage_cache_folder'], 'epa', add_csv_dataset,
+            [config['epa_csv'], config['epa_metrics'], config['rename_epa_metrics'], ['ID', 'STATE_NAME', 'ACSTOTPOP'],
+             config['state_list'], 'STATE_NAME'],
+            [config['epa_csv']], {},
+            {'max_memory_mb': config['csv_max_memory_mb'], 'cache_folder': config['source_cache_folder'],
+             'max_cache_mb': config['source_cache_max_mb']}
+        )
+        print('Aligning to block groups')
+        # Datasets are aligned to block group rows here and added to df_bg all at once (step 3)
+        bg_datasets = [align_block_group_data(key_index, df_epa, 'ID', df_bg.index)]
+        print('Adding variable names to list')
+        all_metrics = list(map(config['rename_epa_metrics'].get, config['epa_metrics'], config['epa_metrics']))
+
+    # Step 3 ----
+    with stage('supplemental_stages', '\nPROCESSING SUPPLEMENTAL DATASETS'):
+        # Stages only need source data and block group keys, so they can run at the same time.
+        # Results are merged below in a fixed order.
+        csv_options = {'cache_folder': config['source_cache_folder'], 'max_cache_mb': config['source_cache_max_mb']}
+        stages = []
+
+        if config['add_cdc'] is True:
+            # Import csv, drop extra data, rename columns
+            stages.append({
+                'name': 'cdc',
+                'function': run_cached_stage,
+                'args': [config['stage_cache_folder'], 'cdc', add_csv_dataset,
+                         [config['cdc_csv'], config['cdc_metrics'], config['rename_cdc_metrics'],
+                          ['TractFIPS', 'StateDesc'], config['state_list'], 'StateDesc'],
+                         [config['cdc_csv']], {}, dict(csv_options, max_memory_mb=config['csv_max_memory_mb'])]
+            })
+
+        if config['add_nlcd_tree'] is True:
+            # Process raster (skipped if inputs are unchanged)
+            stages.append({
+                'name': 'nlcd_tree',
+                'function': run_cached_stage,
+                'args': [config['stage_cache_folder'], 'nlcd_tree', add_raster_dataset,
+                         [gis_block_groups, config['tree_raster']], block_group_inputs + [config['tree_raster']],
+                         dict(block_group_params, engine=config['raster_engine']), raster_options],
+                'kwargs': {'csv_output': config['tree_csv'] if config['save_intermediate_csv'] else None}
+            })
+
+        if config['add_nlcd_impervious_surface'] is True:
+            # Process raster (skipped if inputs are unchanged)
+            stages.append({
+                'name': 'nlcd_impervious',
+                'function': run_cached_stage,
+                'args': [config['stage_cache_folder'], 'nlcd_impervious', add_raster_dataset,
+                         [gis_block_groups, config['impervious_surface_raster']],
+                         block_group_inputs + [config['impervious_surface_raster']],
+                         dict(block_group_params, engine=config['raster_engine']), raster_options],
+                'kwargs': {'csv_output': config['impervious_surface_csv'] if config['save_intermediate_csv'] else None}
+            })
+
+        if config['add_noaa_sea_level_rise'] is True:
+            # Acres land covered by sea level rise at every NOAA depth (one overlay; any depth is interpolated later)
+            stages.append({
+                'name': 'noaa_slr',
+                'function': run_cached_stage,
+                'args': [config['stage_cache_folder'], 'noaa_slr', intersect_slr_all_depths,
+                         [config['noaa_sea_level_rise_layers'], gis_block_groups],
+                         block_group_inputs + sorted(config['noaa_sea_level_rise_layers'].values()), block_group_params,
+                         {'backend': gis_backend}],
+                'kwargs': {'csv_output': config['sea_level_csv'] if config['save_intermediate_csv'] else None}
+            })
+
+        if config['add_first_street_flood'] is True:
+            stages.append({
+                'name': 'first_street_flood',
+                'function': run_cached_stage,
+                'args': [config['stage_cache_folder'], 'first_street_flood', add_first_street_data,
+                         [config['first_street_flood'], 'flood'], [config['first_street_flood']], {}, csv_options]
+            })
+
+        if config['add_first_street_heat'] is True:
+            stages.append({
+                'name': 'first_street_heat',
+                'function': run_cached_stage,
+                'args': [config['stage_cache_folder'], 'first_street_heat', add_first_street_data,
+                         [config['first_street_heat'], 'heat'], [config['first_street_heat']], {}, csv_options]
+            })
+
+        stage_results = run_stages(stages, config['stage_workers'], config['stage_executor'])
+
+    if config['add_cdc'] is True:
+        with stage('cdc_align', '\nADDING CDC DATA'):
+            df_cdc = stage_results['cdc']
+            print('Aligning to block groups')
+            bg_datasets.append(broadcast_tract_data(key_index, df_cdc, 'TractFIPS', df_bg.index))
+            print('Adding variable names to list')
+            all_metrics += list(map(config['rename_cdc_metrics'].get, config['cdc_metrics'], config['cdc_metrics']))
+
+    if config['add_nlcd_tree'] is True:
+        with stage('nlcd_tree_align', '\nADDING NLCD TREE DATA'):
+            # Process zonal statistics
+            df_tree = process_raster_data(stage_results['nlcd_tree'], df_bg, 'TREE')
+            print('Inverting data (% Trees to % Lack of Trees)')
+            # Invert column
+            df_tree['TREE'] = 1 - df_tree['TREE']
+            print('Aligning to block groups')
+            bg_datasets.append(align_block_group_data(key_index, df_tree, 'GEOID', df_bg.index))
+            print('Adding variable names to list')
+            all_metrics += ['TREE']
+
+    if config['add_nlcd_impervious_surface'] is True:
+        with stage('nlcd_impervious_align', '\nADDING NLCD IMPERVIOUS DATA'):
+            # Process zonal statistics
+            df_imper = process_raster_data(stage_results['nlcd_impervious'], df_bg, 'IMPER')
+            print('Aligning to block groups')
+            bg_datasets.append(align_block_group_data(key_index, df_imper, 'GEOID', df_bg.index))
+            print('Adding variable names to list')
+            all_metrics += ['IMPER']
+
+    if config['add_noaa_sea_level_rise'] is True:
+        with stage('noaa_slr_align', '\nADDING NOAA SEA LEVEL RISE DATA'):
+            df_slr = stage_results['noaa_slr']
+            slr_metrics = slr_metric_names(config['sea_level_rise_depth_ft'])
+            slr_columns = list(slr_metrics.values())
+            for depth, metric in slr_metrics.items():
+                print('Calculating % land area inundated for ' + str(depth) + ' ft sea level rise (' + metric + ')')
+                df_slr[metric] = interpolate_slr_area(df_slr, depth) / df_slr['ALAND']
+            print('Dropping extra columns')
+            df_slr = df_slr[['GEOID'] + slr_columns]
+            print('Aligning to block groups')
+            df_slr = align_block_group_data(key_index, df_slr, 'GEOID', df_bg.index)
+            print('Setting null values to 0')
+            # Must run this step AFTER aligning (block groups with no sea level rise are blank)
+            bg_datasets.append(df_slr.fillna(0))
+            print('Adding variable names to list')
+            all_metrics += slr_columns
+
+    if config['add_first_street_flood'] is True:
+        with stage('first_street_flood_align', '\nADDING FIRST STREET FLOOD DATA'):
+            df_flood = stage_results['first_street_flood']
+            print('Aligning to block groups')
+            bg_datasets.append(broadcast_tract_data(key_index, df_flood, 'Tract_ID', df_bg.index))
+            print('Adding variable names to list')
+            all_metrics += ['FLOOD']
+
+    if config['add_first_street_heat'] is True:
+        with stage('first_street_heat_align', '\nADDING FIRST STREET HEAT DATA'):
+            df_heat = stage_results['first_street_heat']
+            print('Aligning to block groups')
+            bg_datasets.append(broadcast_tract_data(key_index, df_heat, 'Tract_ID', df_bg.index))
+            print('Adding variable names to list')
+            all_metrics += ['HEAT']
+
+    with stage('merge', '\nMERGING DATASETS'):
+        df_bg = assemble_datasets(df_bg, bg_datasets)
+
+    # Step 4 ----
+    with stage('percentiles', '\nCALCULATING PERCENTILES'):
+        pct_states = None
+        if config['calculate_state_percentiles'] is True:
+            pct_states = config['state_list']
+
+        area_matrix = None
+        if config['calculate_study_area_percentiles'] is True or config['study_area_regions']:
+            print('Building study area membership matrix')
+            if config['membership_csv'] is not None and os.path.exists(config['membership_csv']):
+                df_membership = read_membership_table(config['membership_csv'])
+            else:
+                df_membership = build_membership_table(df_bg, 'GEOID', [config['study_area_column']])
+            area_matrix = membership_matrix(df_membership, df_bg['GEOID'], config['study_area_column'])
+
+        study_area_rows = None
+        if config['calculate_study_area_percentiles'] is True:
+            print('Selecting study area tracts')
+            study_area_rows = select_region_rows(area_matrix, {'study_area': config['study_area_values']})['study_area']
+
+        # Calc percentiles for all variables at once
+        df_pct = calculate_percentiles(df_bg, all_metrics, inverse_metrics, 'State', pct_states, study_area_rows,
+                                       national=config['calculate_national_percentiles'])
+        df_bg = pd.concat([df_bg, df_pct], axis=1)
+
+        region_pct = {}
+        if config['study_area_regions']:
+            print('Selecting region tracts')
+            region_rows = select_region_rows(area_matrix, config['study_area_regions'])
+            region_pct = calculate_region_percentiles(df_bg, all_metrics, inverse_metrics, region_rows)
+
+        print('Dropping extra columns')
+        p_columns = ['P_' + x for x in all_metrics]
+        n_columns = ['N_' + x for x in all_metrics]
+        u_columns = []
+        if config['calculate_national_percentiles'] is True:
+            u_columns = ['U_' + x for x in all_metrics]
+        # Build list of col
+        col_list = keep_fields + ['ACSTOTPOP'] + all_metrics + p_columns + n_columns + u_columns
+        # Drop all unlisted columns
+        df_bg = df_bg[col_list]
+
+        print('Adding new columns')
+        df_bg['DataSource'] = config['data_source']
+        df_bg['SourceYear'] = config['source_year']
+
+    with stage('save', '\nSAVING DATA') as record:
+        print('Saving csv')
+        df_bg.to_csv(config['csv_output'],
+                     index=False,
+                     na_rep='-999999')
+        record['rows'] = len(df_bg)
+
+        print('Saving shapefile')
+        # Block group geometry + df_bg joined on GEOID; nulls saved as -999999 (same as csv)
+        write_joined_features(gis_block_groups, config['gis_output'], df_bg, 'GEOID', null_value=-999999,
+                              output_format=config['gis_output_format'], crs=config['output_crs'],
+                              backend=gis_backend)
+
+    if len(region_pct) > 0:
+        with stage('save_regions', '\nSAVING REGIONS'):
+            os.makedirs(config['region_output_folder'], exist_ok=True)
+            for region, df_region_pct in region_pct.items():
+                print(region)
+                # Same rows and columns as main output; N_ columns replaced with region percentiles
+                df_region = df_bg.copy()
+                df_region[n_columns] = df_region_pct[n_columns]
+                region_csv = os.path.join(config['region_output_folder'], region + '.csv')
+                df_region.to_csv(region_csv, index=False, na_rep='-999999')
+                if config['region_gis_folder'] is not None:
+                    region_output = config['region_gis_folder'] + '/block_groups_' + region
+                    if config['gis_output_format'] == 'geoparquet':
+                        region_output += '.parquet'
+                    write_joined_features(gis_block_groups, region_output, df_region, 'GEOID', null_value=-999999,
+                                          output_format=config['gis_output_format'], crs=config['output_crs'],
+                                          backend=gis_backend)
+
+    with stage('delete_scratch', '\nDELETING SCRATCH FOLDER'):
+        gis.delete(scratch_folder)
+
+    save_run_report(config['run_report_json'])
+    return df_bg
+
+
+if __name__ == '__main__':
+    run_step2()
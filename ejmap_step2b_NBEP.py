@@ -13,6 +13,9 @@ from arcpy import metadata as md
 import os
 import pandas as pd
 
+from functions.area_membership import read_membership_table
+from functions.simplify_topology import simplify_features
+
 arcpy.env.overwriteOutput = True
 
 # ------------------------------ VARIABLES -------------------------------------
@@ -24,14 +27,16 @@ scratch_folder = arcpy.env.scratchFolder
 gis_folder = base_folder + '/gis_data/int_gisdata/ejmap_intdata.gdb'
 csv_folder = base_folder + '/tabular_data'
 
-# Set default projection
-arcpy.env.outputCoordinateSystem = arcpy.SpatialReference('NAD 1983 UTM Zone 19N')
+# Set default projection (NAD 1983 UTM Zone 19N)
+output_crs = 26919
+arcpy.env.outputCoordinateSystem = arcpy.SpatialReference(output_crs)
 
 # Set inputs
 gis_block_groups = gis_folder + '/block_groups_final'
-gis_block_groups_lowres = gis_folder + '/NBEP_block_groups_simplify_500m'
 
 csv_block_groups = csv_folder + '/int_data/block_groups_final.csv'
+# Block group x area table from ejmap_step1
+csv_membership = csv_folder + '/int_data/block_group_areas.csv'
 
 gis_metadata = base_folder + '/metadata_templates/ejmetrics_metadata.xml'
 
@@ -39,6 +44,8 @@ gis_metadata = base_folder + '/metadata_templates/ejmetrics_metadata.xml'
 gis_output = gis_folder + '/EJMETRICS_2023_NBEP2023'
 excel_output = csv_folder + '/final_data/EJMETRICS_2023_NBEP2023.xlsx'
 gis_output_lowres = gis_folder + '/EJMETRICS_2023_LOWRES_NBEP2023'
+# Leaflet map: one TopoJSON file per tolerance (EPSG 4326)
+topojson_folder = csv_folder + '/final_data/leaflet'
 
 # Set variables
 NBEP_year = 2023
@@ -46,6 +53,12 @@ ejscreen_year = 2023
 census_year = 2020
 EPA_agreements = 'CE00A00967'
 
+# Low resolution map: simplified from gis_output, neighbors keep shared boundaries
+simplify_tolerances = [100, 500]  # meters; small tolerance = zoomed in map, large tolerance = zoomed out map
+lowres_tolerance = 500  # tolerance for gis_output_lowres
+topojson_quantization = 100000  # coordinates rounded to 1/100000 of map width
+simplify_workers = 1  # Keep 1 (worker processes need an if __name__ == '__main__' guard on Windows)
+
 # ------------------------------ SCRIPT -------------------------------------
 # Define additional variables
 gis_temp = arcpy.env.scratchFolder + '/temp_file.shp'
@@ -56,10 +69,12 @@ print('Opening csv')
 df = pd.read_csv(csv_block_groups, sep=',')
 print('Dropping extra columns, rows')
 # only keep selected columns
-df = df[['State', 'Town', 'Study_Area']]
-# drop rows that aren't in Study_Area (and therefor have NaN value)
-df_NBEP = df.loc[
-    df['Study_Area'] != 'Outside Study Area']
+df = df[['GEOID', 'State', 'Town']]
+# drop rows that aren't in a study area (not listed in membership table)
+# GEOID compared as a number (csv drops the 0 at the start of each ID)
+df_membership = read_membership_table(csv_membership)
+study_area_ids = df_membership.loc[df_membership['Field'] == 'Study_Area', 'GEOID'].astype('int64')
+df_NBEP = df.loc[df['GEOID'].isin(study_area_ids), ['State', 'Town']]
 # drop duplicate rows
 df_NBEP = df_NBEP.drop_duplicates()
 print('Adding column (Town_Code)')
@@ -159,32 +174,15 @@ arcpy.conversion.TableToExcel(Input_Table=gis_output,
                               Output_Excel_File=excel_output)
 
 print('\nCreating low resolution display map for leaflet')
-print('Saving shapefile copy')
-arcpy.management.CopyFeatures(in_features=gis_block_groups_lowres,
-                              out_feature_class=gis_output_lowres)
-print('Dropping all fields except GEOID')
-arcpy.management.DeleteField(in_table=gis_output_lowres,
-                             drop_field=['GEOID'],
-                             method='KEEP_FIELDS')
-print('Adding temp ID field (numeric)')
-# Add field
-arcpy.management.AddField(in_table=gis_output_lowres,
-                          field_name='temp_ID',
-                          field_type='DOUBLE')
-# Set Field to "GEOID"
-arcpy.management.CalculateField(in_table=gis_output_lowres,
-                                field='temp_ID',
-                                expression='float(!GEOID!)')
-print('Joining csv to shapefile')
-# Join on temp_ID (integer) not ID (string) because tracts_int_csv drops the 0 at the start of each ID
-arcpy.management.JoinField(in_data=gis_output_lowres,
-                           in_field='temp_ID',
-                           join_table=csv_block_groups,
-                           join_field='GEOID')
-print('Dropping duplicate ID fields')
-arcpy.management.DeleteField(in_table=gis_output_lowres,
-                             drop_field=['GEOID_1', 'temp_ID']
-                             )
+# Simplified copy of gis_output (same fields), plus TopoJSON for each tolerance
+simplify_features(gis_output, simplify_tolerances, topojson_folder,
+                  out_features=gis_output_lowres,
+                  out_tolerance=lowres_tolerance,
+                  quantization=topojson_quantization,
+                  crs=output_crs,
+                  object_name='EJMETRICS_' + str(ejscreen_year) + '_NBEP' + str(NBEP_year),
+                  workers=simplify_workers,
+                  backend='arcpy')
 print('Adding metadata')
 tgt_item_md = md.Metadata(gis_output_lowres)
 if not tgt_item_md.isReadOnly:
@@ -5,49 +5,121 @@
 #
 # Description:
 # Helper functions to import and process csv datasets for ejmap_step2
+# Functions return dataframes; csv output is optional (for debugging/export)
 # ---------------------------------------------------------------------------
 
 import pandas as pd
 
+from functions.instrumentation import instrument_stage
+from functions.source_cache import normalize_key_columns
+from functions.source_cache import read_source_csv
+
 # --------------------- add_csv_dataset -----------------------------
-# Import csv, drop extra rows and columns, rename columns, save csv
+# Import csv, drop extra rows and columns, rename columns, return dataframe
 # csv_input = input csv name and location
 # metrics = column names for selected metrics (list)
 # new_metrics = dictionary of metric name substitutes (dictionary; old: new)
 # extra_columns = additional columns to keep
 # states = list of states
 # state_column = column in csv input with state names
-# csv_output = output csv name and location
+# csv_output = if set, saves copy of output as csv (name and location)
+# chunk_rows = if set, reads csv in chunks of chunk_rows rows (streaming mode)
+# max_memory_mb = if set, reads csv in chunks sized to stay under max_memory_mb (streaming mode)
+# cache_folder = if set, reads csv from source cache (cache is built with streaming mode if chunk_rows or max_memory_mb
+#   is set; only selected columns and states are cached)
+# max_cache_mb = source cache size limit
 
 
+@instrument_stage
 def add_csv_dataset(csv_input, metrics, new_metrics, extra_columns,
-                    states, state_column, csv_output):
+                    states, state_column, csv_output=None,
+                    chunk_rows=None, max_memory_mb=None,
+                    cache_folder=None, max_cache_mb=None):
     print('Selecting columns')
     column_list = extra_columns + metrics
-    print('Reading in csv')
-    # Only imports selected columns (column_list)
-    df = pd.read_csv(csv_input,
-                     sep=",",
-                     usecols=column_list)
-    print('Filtering data for selected states')
-    df = df[df[state_column].isin(states)]
+    if cache_folder is not None:
+        df = read_source_csv(csv_input, cache_folder, column_list, max_cache_mb,
+                             states, state_column, chunk_rows, max_memory_mb)
+    elif chunk_rows is None and max_memory_mb is None:
+        print('Reading in csv')
+        # Only imports selected columns (column_list)
+        df = pd.read_csv(csv_input,
+                         sep=",",
+                         usecols=column_list)
+        print('Filtering data for selected states')
+        df = df[df[state_column].isin(states)]
+    else:
+        df = read_csv_by_state(csv_input, column_list, states, state_column,
+                               chunk_rows, max_memory_mb)
     if new_metrics is not None:
         print('Renaming columns')
-        df.rename(columns=new_metrics,
-                  inplace=True)
-    print('Saving file')
-    df.to_csv(csv_output, index=False)
+        df = df.rename(columns=new_metrics)
+    # Set ID columns to int64
+    df = normalize_key_columns(df.reset_index(drop=True))
+    if csv_output is not None:
+        print('Saving file')
+        df.to_csv(csv_output, index=False)
+    return df
+
+# --------------------- read_csv_by_state -----------------------------
+# Read csv in chunks, drop rows for other states as each chunk is read
+# Peak memory is one chunk plus the rows kept, not the full national table
+# csv_input = input csv name and location
+# column_list = columns to import
+# states = list of states (None = all rows)
+# state_column = column in csv input with state names
+# chunk_rows = rows per chunk
+# max_memory_mb = memory ceiling per chunk (used to set chunk_rows if chunk_rows is None)
+
+
+def read_csv_by_state(csv_input, column_list, states, state_column,
+                      chunk_rows=None, max_memory_mb=None):
+    if chunk_rows is None:
+        print('Estimating chunk size')
+        # Measure memory per row from a sample of the csv
+        df_sample = pd.read_csv(csv_input, sep=",", usecols=column_list, nrows=1000)
+        row_bytes = df_sample.memory_usage(index=True, deep=True).sum() / max(len(df_sample), 1)
+        chunk_rows = max(int(max_memory_mb * 1024 * 1024 / max(row_bytes, 1)), 1)
+    print('Reading in csv (' + str(chunk_rows) + ' rows per chunk)')
+    rows_scanned = 0
+    rows_kept = 0
+    df_list = []
+    # Only imports selected columns (column_list)
+    with pd.read_csv(csv_input, sep=",", usecols=column_list, chunksize=chunk_rows) as reader:
+        for chunk in reader:
+            rows_scanned += len(chunk)
+            # Filter data for selected states
+            if states is not None:
+                chunk = chunk[chunk[state_column].isin(states)]
+            rows_kept += len(chunk)
+            df_list.append(chunk)
+    print('\tRows scanned: ' + str(rows_scanned))
+    print('\tRows kept: ' + str(rows_kept))
+    if len(df_list) == 0:
+        # Header only (no chunks)
+        return pd.DataFrame(columns=column_list)
+    df = pd.concat(df_list, ignore_index=True)
+    return df
 
 # --------------------- add_first_street_data -----------------------------
 # Imports first street dataset, calculates average risk factor per census tract
 # csv_input = input csv name and location
 # metric = 'flood', 'heat'
-# csv_output = output csv name and location
+# csv_output = if set, saves copy of output as csv (name and location)
+# cache_folder = if set, reads csv from source cache
+# max_cache_mb = source cache size limit
 
 
-def add_first_street_data(csv_input, metric, csv_output):
-    print('Reading in csv')
-    df = pd.read_csv(csv_input, sep=",")
+@instrument_stage
+def add_first_street_data(csv_input, metric, csv_output=None,
+                          cache_folder=None, max_cache_mb=None):
+    if cache_folder is not None:
+        column_list = ['fips', 'count_property'] + \
+                      ['count_' + metric.lower() + 'factor' + str(x) for x in range(1, 11)]
+        df = read_source_csv(csv_input, cache_folder, column_list, max_cache_mb)
+    else:
+        print('Reading in csv')
+        df = pd.read_csv(csv_input, sep=",")
     print('Calculating average ' + metric.lower() + ' risk')
     df[metric.upper()] = (df['count_' + metric.lower() + 'factor1'] +
                           2*df['count_' + metric.lower() + 'factor2'] +
@@ -63,7 +135,10 @@ def add_first_street_data(csv_input, metric, csv_output):
     print('Dropping extra columns')
     df = df[['fips', metric.upper()]]
     print('Renaming column')
-    df.rename(columns={'fips': 'Tract_ID'},
-              inplace=True)
-    print('Saving file')
-    df.to_csv(csv_output, index=False)
+    df = df.rename(columns={'fips': 'Tract_ID'})
+    # Set ID columns to int64
+    df = normalize_key_columns(df)
+    if csv_output is not None:
+        print('Saving file')
+        df.to_csv(csv_output, index=False)
+    return df
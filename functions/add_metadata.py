@@ -1,34 +1,37 @@
 # ---------------------------------------------------------------------------
 # add_NBEP_columns
-# Last updated: 2022-04-19
+# Last updated: 2026-10-17
 # Authors: Mariel Sorlien
 #
 # Description:
-# Arcpy script that adds standard metadata columns (DataSource, SourceYear) to a shapefile
+# Adds standard metadata columns (DataSource, SourceYear) to a shapefile
 # ---------------------------------------------------------------------------
 
-import arcpy
+from functions.gis_backend import get_gis_backend
+from functions.instrumentation import instrument_stage
 
 # Variables
 # table_name = input table
 # data_source = generally the organization, sometimes a journal citation
 # source_year = year of source dataset
+# backend = GIS backend ('arcpy' or 'geopandas')
 
 
-def add_metadata_fields(table_name, data_source, source_year):
+@instrument_stage
+def add_metadata_fields(table_name, data_source, source_year, backend='arcpy'):
+    gis = get_gis_backend(backend)
 
     len_data_source = len(data_source) + 5 if len(data_source) > 30 else 30
     len_source_year = len(source_year) + 5 if len(source_year) > 30 else 30
 
-    arcpy.management.AddFields(table_name,
-                               [
-                                   # Field name, field type, field alias, field length, default value
-                                   ['DataSource', 'TEXT', 'DataSource', len_data_source],
-                                   ['SourceYear', 'TEXT', 'SourceYear', len_source_year]
-                               ])
-    arcpy.management.CalculateFields(table_name,
-                                     "PYTHON3",
-                                     [
-                                         ['DataSource', '"' + data_source + '"'],
-                                         ['SourceYear', '"' + source_year + '"']
-                                     ])
+    gis.add_fields(table_name,
+                   [
+                       # Field name, field type, field alias, field length
+                       ['DataSource', 'TEXT', 'DataSource', len_data_source],
+                       ['SourceYear', 'TEXT', 'SourceYear', len_source_year]
+                   ])
+    gis.set_field_values(table_name,
+                         {
+                             'DataSource': data_source,
+                             'SourceYear': source_year
+                         })
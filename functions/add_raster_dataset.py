@@ -1,27 +1,56 @@
 # ---------------------------------------------------------------------------
 # add_raster_dataset
-# Last updated: 2022-04-20
+# Last updated: 2026-10-17
 # Authors: Mariel Sorlien
 #
 # Description:
 # Helper functions to import and process raster datasets for ejmap_step2
 # ---------------------------------------------------------------------------
 
-import arcpy
-from arcpy.sa import *
 import pandas as pd
-import numpy as np
+import uuid
 
-# Set variables
-temp_raster = arcpy.env.scratchFolder + '/temp_raster.tif'
-temp_table = arcpy.env.scratchFolder + '/temp_table.dbf'
-temp_excel = arcpy.env.scratchFolder + '/temp_excel.xls'
+from functions.gis_backend import get_gis_backend
+from functions.instrumentation import instrument_stage
+from functions.read_table import read_table
+from functions.source_cache import normalize_key_columns
+from functions.tiled_zonal_statistics import read_value_tile
+from functions.tiled_zonal_statistics import tiled_zonal_statistics
+from functions.zone_index import get_zone_index
+from functions.zonal_statistics import zonal_statistics
 
 # --------------------- add_raster_dataset -----------------------------
-# Calculate zonal statistics, save as csv
+# Calculate zonal statistics, return dataframe
+# csv_output = if set, saves copy of output as csv (name and location)
+# engine = 'arcpy' (ExtractByAttributes + ZonalStatisticsAsTable) or 'numpy' (zonal_statistics)
+# zone_index_folder = saved zone index location, numpy engine only (None = rebuild each run)
+# tile_size = if set, reads raster in tiles of tile_size x tile_size cells, numpy engine only
+# workers = number of processes for tiles (None = all cores)
+# backend = GIS backend ('arcpy' or 'geopandas'; geopandas reads rasters with rasterio, numpy engine only)
 
 
-def add_raster_dataset(gis_block_groups, raster_input, csv_output):
+@instrument_stage
+def add_raster_dataset(gis_block_groups, raster_input, csv_output=None, engine='arcpy',
+                       zone_index_folder=None, tile_size=None, workers=None, backend='arcpy'):
+    if engine == 'numpy':
+        df = add_raster_dataset_numpy(gis_block_groups, raster_input, zone_index_folder, tile_size, workers,
+                                      backend)
+        if csv_output is not None:
+            print('Saving csv')
+            df.to_csv(csv_output, index=False)
+        return df
+    if backend != 'arcpy':
+        raise ValueError('Raster engine "arcpy" needs GIS backend "arcpy" (use engine "numpy")')
+
+    import arcpy
+    from arcpy.sa import ExtractByAttributes
+    from arcpy.sa import ZonalStatisticsAsTable
+
+    # Temp values (unique names, so stages can run in parallel)
+    temp_id = uuid.uuid4().hex[:8]
+    temp_raster = arcpy.env.scratchFolder + '/temp_raster_' + temp_id + '.tif'
+    temp_table = arcpy.env.scratchFolder + '/temp_table_' + temp_id + '.dbf'
+
     print('Removing null data')
     raster_extract = ExtractByAttributes(raster_input, "VALUE < 101")
     raster_extract.save(temp_raster)
@@ -32,22 +61,51 @@ def add_raster_dataset(gis_block_groups, raster_input, csv_output):
                            out_table=temp_table,
                            statistics_type='MEAN')
 
-    print('Exporting to excel')
-    arcpy.conversion.TableToExcel(Input_Table=temp_table,
-                                  Output_Excel_File=temp_excel)
-    print('Converting to csv')
-    # Read in excel as dataframe
-    df = pd.read_excel(temp_excel)
-    # Save as csv
-    df.to_csv(csv_output, index=False)
+    print('Converting to dataframe')
+    df = read_table(temp_table)
+    # Set ID columns to int64
+    df = normalize_key_columns(df)
+    if csv_output is not None:
+        print('Saving csv')
+        df.to_csv(csv_output, index=False)
+    return df
+
+# --------------------- add_raster_dataset_numpy -----------------------------
+# Calculate zonal statistics with numpy, return dataframe
+# Block groups are rasterized once on the value raster grid (see zone_index),
+# then statistics are calculated in memory. Null data (VALUE >= 101) is
+# skipped in the same pass, so no temp value raster is saved.
+# zone_index_folder = saved zone index location (None = rebuild in scratch folder)
+# tile_size = if set, reads raster in tiles on multiple cores (for large/CONUS rasters)
+# workers = number of processes for tiles (None = all cores)
+
+
+def add_raster_dataset_numpy(gis_block_groups, raster_input, zone_index_folder=None, tile_size=None,
+                             workers=None, backend='arcpy'):
+    if zone_index_folder is None:
+        zone_index_folder = get_gis_backend(backend).scratch_folder() + '/zone_index'
+    zone_index = get_zone_index(gis_block_groups, raster_input, zone_index_folder, backend)
+    grid = zone_index['grid']
+    # Raster read with arcpy or rasterio
+    value_source = {'type': 'arcpy' if backend == 'arcpy' else 'rasterio', 'path': raster_input}
+
+    if tile_size is not None:
+        return tiled_zonal_statistics(zone_index, value_source, tile_size, workers, max_value=101)
+
+    print('Reading raster')
+    values = read_value_tile(value_source, grid, (0, 0, grid['nrows'], grid['ncols']), nodata_value=255)
+
+    print('Calculating zonal statistics')
+    return zonal_statistics(zone_index['zones'], values, zone_index['zone_lookup'], max_value=101)
 
-# ----------------------- process_raster_csv -----------------------------
-# Calculate average value per unit land
+# ----------------------- process_raster_data -----------------------------
+# Calculate average value per unit land, return dataframe
+# df = zonal statistics (output of add_raster_dataset)
+# csv_output = if set, saves copy of output as csv (name and location)
 
 
-def process_raster_csv(csv_input, block_groups, metric, csv_output):
-    print('Opening csv file')
-    df = pd.read_csv(csv_input, sep=",")
+@instrument_stage
+def process_raster_data(df, block_groups, metric, csv_output=None):
     print('Merging with block group data to add ALAND, AWATER columns')
     # Drop extra columns
     block_groups = block_groups[['GEOID', 'ALAND', 'AWATER']]
@@ -58,5 +116,7 @@ def process_raster_csv(csv_input, block_groups, metric, csv_output):
     df_merge[metric] = (df_merge['MEAN'] / 100) * (df_merge['ALAND'] / (df_merge['ALAND'] + df_merge['AWATER']))
     print('Dropping extra columns')
     df_merge = df_merge[['GEOID', metric]]
-    print('Saving csv')
-    df_merge.to_csv(csv_output, index=False)
+    if csv_output is not None:
+        print('Saving csv')
+        df_merge.to_csv(csv_output, index=False)
+    return df_merge
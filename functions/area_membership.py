@@ -0,0 +1,93 @@
+# ---------------------------------------------------------------------------
+# area_membership
+# Last updated: 2026-10-17
+# Authors: Mariel Sorlien
+#
+# Description:
+# Block group x area membership. Study_Area and HUC10 can list several areas
+# (spatial join INTERSECT, joined with '; '). Instead of searching the text
+# (str.contains, != 'Outside Study Area'), areas are split once into a
+# membership table (one row per block group and area):
+#   GEOID          Field        Area
+#   440010301001   Study_Area   Narragansett Bay Watershed
+# ejmap_step1 saves the table; ejmap_step2 turns it into a membership matrix
+# (boolean, block group x area) to select regions by exact area name.
+# ---------------------------------------------------------------------------
+
+import numpy as np
+import pandas as pd
+
+# Values that mean "not in any area" (null values from ejmap_step1)
+area_null_values = ['Outside Study Area', 'No Data']
+
+# --------------------- build_membership_table -----------------------------
+# Split multi-area fields, return membership table (id_field, Field, Area)
+# df = block group dataframe
+# id_field = block group ID column (ex: 'GEOID')
+# fields = columns with area names (ex: ['Study_Area', 'HUC10'])
+# delimiter = text between area names
+# null_values = area names to leave out (block group is not in any area)
+
+
+def build_membership_table(df, id_field, fields, delimiter='; ', null_values=None):
+    if null_values is None:
+        null_values = area_null_values
+    tables = []
+    for field in fields:
+        # Few distinct labels: split each label once, then match rows to labels by code
+        codes, labels = pd.factorize(df[field])
+        label_areas = pd.Series(labels, dtype=object).str.split(delimiter).explode().str.strip()
+        label_areas = label_areas[label_areas.notna() & ~label_areas.isin([''] + list(null_values))]
+        df_labels = pd.DataFrame({'code': label_areas.index.to_numpy(), 'Area': label_areas.to_numpy()})
+        df_rows = pd.DataFrame({id_field: df[id_field].to_numpy(), 'code': codes})
+        df_field = df_rows.merge(df_labels, on='code')
+        df_field['Field'] = field
+        tables.append(df_field[[id_field, 'Field', 'Area']])
+    df_membership = pd.concat(tables, ignore_index=True).drop_duplicates(ignore_index=True)
+    print('\t' + str(len(df_membership)) + ' block group areas')
+    return df_membership
+
+# --------------------- save_membership_table, read_membership_table -----------------------------
+# IDs are saved as text (keeps 0 at the start of GEOID)
+
+
+def save_membership_table(df_membership, csv_path):
+    df_membership.to_csv(csv_path, index=False)
+
+
+def read_membership_table(csv_path, id_field='GEOID'):
+    return pd.read_csv(csv_path, dtype={id_field: str, 'Field': str, 'Area': str})
+
+# --------------------- membership_matrix -----------------------------
+# Membership matrix for one field, return dataframe of booleans (row per id, column per area)
+# df_membership = membership table (see build_membership_table)
+# ids = block group IDs (series; output uses same index); membership IDs are converted to the same type
+# field = area field (ex: 'Study_Area')
+
+
+def membership_matrix(df_membership, ids, field, id_field='GEOID'):
+    df_field = df_membership[df_membership['Field'] == field]
+    area_codes, areas = pd.factorize(df_field['Area'])
+    row_positions = pd.Index(ids).get_indexer(df_field[id_field].astype(ids.dtype))
+    # IDs not in ids (ex: other states) are skipped
+    found = row_positions >= 0
+    matrix = np.zeros((len(ids), len(areas)), dtype=bool)
+    matrix[row_positions[found], area_codes[found]] = True
+    return pd.DataFrame(matrix, index=ids.index, columns=areas)
+
+# --------------------- select_region_rows -----------------------------
+# Find rows in each region, return dataframe of booleans (column per region)
+# area_matrix = membership matrix (see membership_matrix)
+# regions = dictionary (region name: list of area names)
+# Row is in region if it is in any of its areas (exact area name)
+
+
+def select_region_rows(area_matrix, regions):
+    region_rows = {}
+    for region, area_values in regions.items():
+        missing = [x for x in area_values if x not in area_matrix.columns]
+        if len(missing) > 0:
+            print('\tWarning: no block groups in ' + ', '.join(missing) + ' (' + str(region) + ')')
+        area_columns = [x for x in area_values if x in area_matrix.columns]
+        region_rows[region] = area_matrix[area_columns].to_numpy().any(axis=1)
+    return pd.DataFrame(region_rows, index=area_matrix.index)
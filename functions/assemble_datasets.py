@@ -0,0 +1,41 @@
+# ---------------------------------------------------------------------------
+# assemble_datasets
+# Last updated: 2026-10-17
+# Authors: Mariel Sorlien
+#
+# Description:
+# Combines block group data with every dataset in one step. Each dataset is
+# already aligned to the block group rows (see key_index), so all columns are
+# concatenated into one new dataframe at once instead of copying the growing
+# block group table once per merge.
+# ---------------------------------------------------------------------------
+
+import pandas as pd
+
+from functions.instrumentation import instrument_stage
+
+# --------------------- assemble_datasets -----------------------------
+# Add dataset columns to block group data, return dataframe
+# df_bg = block group data
+# datasets = list of dataframes with the same index as df_bg (columns added in list order)
+
+
+@instrument_stage
+def assemble_datasets(df_bg, datasets):
+    for df in datasets:
+        if not df.index.equals(df_bg.index):
+            raise ValueError('Dataset is not aligned to block groups: ' + ', '.join(df.columns))
+
+    # Memory a merge per dataset would copy (block group table + all datasets added so far)
+    frame_bytes = df_bg.memory_usage(index=True, deep=True).sum()
+    copied_bytes = 0
+    for df in datasets:
+        frame_bytes += df.memory_usage(index=False, deep=True).sum()
+        copied_bytes += frame_bytes
+
+    df_bg = pd.concat([df_bg] + datasets, axis=1)
+    print('Assembled ' + str(len(datasets)) + ' datasets (' + str(len(df_bg.columns)) + ' columns, ' +
+          str(round(frame_bytes / 1024 / 1024, 1)) + ' MB); one merge per dataset would copy ' +
+          str(round(copied_bytes / 1024 / 1024, 1)) + ' MB (' +
+          str(round((copied_bytes - frame_bytes) / 1024 / 1024, 1)) + ' MB saved)')
+    return df_bg
@@ -0,0 +1,117 @@
+# ---------------------------------------------------------------------------
+# calculate_percentiles
+# Last updated: 2026-10-17
+# Authors: Mariel Sorlien
+#
+# Description:
+# Helper functions to calculate state, study area, and national percentiles
+# for ejmap_step2. All metrics are ranked at once (one grouped pass over the
+# metric table) instead of one metric and one state at a time.
+# Study area percentiles for several regions (ex: one per estuary program)
+# are also calculated in one grouped pass (calculate_region_percentiles).
+# ---------------------------------------------------------------------------
+
+import pandas as pd
+import numpy as np
+
+from functions.instrumentation import instrument_stage
+
+# --------------------- calculate_percentiles -----------------------------
+# Calculate percentiles for all metrics, return dataframe of percentile columns
+# Percentiles are multiplied by 100 and truncated (ex: 0.257 -> 25)
+# df = block group dataframe
+# metrics = column names for selected metrics (list)
+# inverse_metrics = metrics where higher values are better, not worse (list)
+# state_column = column in df with state names
+# states = list of states (None = skip state percentiles, P_ columns set to 0)
+# study_area_rows = boolean series, True for study area rows
+#   (None = skip study area percentiles, N_ columns set to 0)
+# national = if True, add national percentiles (U_ columns)
+#
+# Matches the original metric x state loop:
+#   P_ = state percentile; 0 if state not in states; null if metric is null
+#   N_ = study area percentile; null if outside study area or metric is null
+#   U_ = national percentile; null if metric is null
+
+
+@instrument_stage
+def calculate_percentiles(df, metrics, inverse_metrics, state_column, states,
+                          study_area_rows, national=False):
+    values = metric_table(df, metrics, inverse_metrics)
+    is_null = values.isnull()
+
+    percentiles = []
+
+    if states is not None:
+        print('Calculating state percentiles')
+        state_rows = df[state_column].isin(states)
+        df_rank = values.loc[state_rows].groupby(df.loc[state_rows, state_column]).rank(pct=True)
+        # Rows outside selected states are set to 0
+        df_rank = df_rank.reindex(values.index).fillna(0)
+        df_pct = np.trunc(100 * df_rank)
+        df_pct = df_pct.mask(is_null)
+    else:
+        df_pct = pd.DataFrame(0, index=values.index, columns=metrics)
+    percentiles.append(df_pct.add_prefix('P_'))
+
+    if study_area_rows is not None:
+        print('Calculating study area percentiles')
+        df_pct = region_percentiles(values, study_area_rows.to_frame('study_area'))['study_area']
+    else:
+        df_pct = pd.DataFrame(0, index=values.index, columns=metrics)
+    percentiles.append(df_pct.add_prefix('N_'))
+
+    if national is True:
+        print('Calculating national percentiles')
+        df_pct = np.trunc(100 * values.rank(pct=True))
+        percentiles.append(df_pct.add_prefix('U_'))
+
+    return pd.concat(percentiles, axis=1)
+
+# --------------------- calculate_region_percentiles -----------------------------
+# Calculate study area percentiles for several regions at once, return dictionary (region: dataframe of N_ columns)
+# Same values as N_ columns from calculate_percentiles, with each region as the study area
+# df, metrics, inverse_metrics = same as calculate_percentiles
+# region_rows = dataframe of booleans, one column per region (see area_membership); regions can overlap
+
+
+@instrument_stage
+def calculate_region_percentiles(df, metrics, inverse_metrics, region_rows):
+    values = metric_table(df, metrics, inverse_metrics)
+    print('Calculating percentiles for ' + str(len(region_rows.columns)) + ' regions')
+    region_pct = region_percentiles(values, region_rows)
+    return {region: df_pct.add_prefix('N_') for region, df_pct in region_pct.items()}
+
+# --------------------- metric_table -----------------------------
+# Metric values as floats; inverse metrics flipped so that all metrics rank in the same direction
+
+
+def metric_table(df, metrics, inverse_metrics):
+    print('Building metric table')
+    values = df[metrics].astype(float)
+    # Rank inverse metrics in descending order by flipping the sign
+    # (same ranks, ties, and nulls as rank(ascending=False))
+    inverse_columns = [col for col in metrics if col in inverse_metrics]
+    if len(inverse_columns) > 0:
+        values[inverse_columns] = -values[inverse_columns]
+    return values
+
+# --------------------- region_percentiles -----------------------------
+# Rank metric table within each region, return dictionary (region: dataframe of percentiles)
+# Rows in more than one region are repeated (once per region), then all regions are ranked in one groupby
+# Percentiles are null outside region and where metric is null
+
+
+def region_percentiles(values, region_rows):
+    row_position, region_position = np.nonzero(region_rows.to_numpy(dtype=bool))
+    df_stacked = pd.DataFrame(values.to_numpy()[row_position], columns=values.columns)
+    df_rank = df_stacked.groupby(region_position).rank(pct=True)
+    ranks = np.trunc(100 * df_rank.to_numpy())
+
+    region_pct = {}
+    for i, region in enumerate(region_rows.columns):
+        in_region = region_position == i
+        pct = np.full(values.shape, np.nan)
+        pct[row_position[in_region]] = ranks[in_region]
+        region_pct[region] = pd.DataFrame(pct, index=values.index, columns=values.columns)
+    return region_pct
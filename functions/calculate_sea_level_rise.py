@@ -1,53 +1,125 @@
 # ---------------------------------------------------------------------------
 # calculate_sea_level_rise
-# Last updated: 2022-04-20
+# Last updated: 2026-10-17
 # Authors: Mariel Sorlien
 #
 # Description:
 # Helper functions to process NOAA sea level rise data for ejmap_step2
 # ---------------------------------------------------------------------------
 
-import arcpy
+import math
+
+import numpy as np
 import pandas as pd
 
-# Temp values
-temp_shp = arcpy.env.scratchFolder + '/temp_shapefile.shp'
-temp_shp2 = arcpy.env.scratchFolder + '/temp_shapefile2.shp'
-temp_excel = arcpy.env.scratchFolder + '/temp_excel.xls'
+from functions.gis_backend import get_gis_backend
+from functions.instrumentation import instrument_stage
+from functions.source_cache import normalize_key_columns
+
+# --------------------- intersect_slr_all_depths -----------------------------
+# Calculate area of sea level rise per block group for every depth in one pass, return dataframe
+# NOAA depth layers are nested (each depth covers all lower depths). All layers are combined with
+# one Union and intersected with block groups once; each piece is assigned the lowest depth that
+# floods it. Any depth between layers can then be found with interpolate_slr_area (no geometry).
+# slr_layers = dictionary of NOAA sea level rise layers (depth in ft: feature class); must include 0 ft
+# bg_input = block group feature class
+# csv_output = if set, saves copy of output as csv (name and location)
+# backend = GIS backend ('arcpy' or 'geopandas')
+# Output columns: GEOID, ALAND, AREA_0FT, AREA_1FT, ... (square meters newly flooded, compared to 0 ft)
 
-# --------------------- add_csv_dataset -----------------------------
 
+@instrument_stage
+def intersect_slr_all_depths(slr_layers, bg_input, csv_output=None, backend='arcpy'):
+    gis = get_gis_backend(backend)
+    # Temp values (unique names, so stages can run in parallel)
+    # Not saved as shapefiles (shapefiles would cut FID_ field names to 10 characters)
+    temp_union = gis.temp_dataset('temp_slr_union')
+    temp_intersect = gis.temp_dataset('temp_slr_intersect')
 
-def intersect_slr_block_groups(slr_input, slr_erase, bg_input, csv_output):
-    print('\tErasing areas that overlap next lowest flood level')
-    # Avoid double count from overlapping areas
-    arcpy.analysis.Erase(in_features=slr_input,
-                         erase_features=slr_erase,
-                         out_feature_class=temp_shp)
+    depths = sorted(slr_layers)
+    layers = [slr_layers[x] for x in depths]
+    fid_fields = ['FID_' + gis.base_name(x) for x in layers]
+
+    print('\tCombining sea level rise layers (' + ', '.join(str(x) for x in depths) + ' ft)')
+    gis.union(layers, temp_union)
     print('\tIntersecting SLR, block groups')
-    arcpy.analysis.Intersect(in_features=[temp_shp, bg_input],
-                             out_feature_class=temp_shp2)
-    print('\tDissolving data')
-    # Ensure one multipart feature per block group -- prevents big problems later
-    arcpy.management.Dissolve(in_features=temp_shp2,
-                              out_feature_class=temp_shp,
-                              dissolve_field=['GEOID', 'ALAND'])
+    gis.intersect([temp_union, bg_input], temp_intersect)
     print('\tCalculating area (square meters)')
-    arcpy.management.AddField(in_table=temp_shp,
-                              field_name='ASLR',
-                              field_type='FLOAT')
-    arcpy.management.CalculateGeometryAttributes(in_features=temp_shp,
-                                                 geometry_property=[['ASLR', 'AREA']],
-                                                 area_unit='SQUARE_METERS')
-    print('Dropping extra fields')
-    arcpy.management.DeleteField(in_table=temp_shp,
-                                 drop_field=['GEOID', 'ALAND', 'ASLR'],
-                                 method='KEEP_FIELDS')
-    print('Exporting data to excel')
-    arcpy.conversion.TableToExcel(Input_Table=temp_shp,
-                                  Output_Excel_File=temp_excel)
-    print('Converting to csv')
-    # Read in excel as dataframe
-    df = pd.read_excel(temp_excel)
-    # Save as csv
-    df.to_csv(csv_output, index=False)
+    df_pieces = gis.read_areas(temp_intersect, ['GEOID', 'ALAND'] + fid_fields)
+    gis.delete([temp_union, temp_intersect])
+
+    df = slr_area_by_depth(df_pieces, depths, fid_fields)
+    if csv_output is not None:
+        print('Saving csv')
+        df.to_csv(csv_output, index=False)
+    return df
+
+# --------------------- slr_area_by_depth -----------------------------
+# Sum flooded area per block group and depth (pure pandas)
+# df_pieces = one row per piece of union/intersect output (GEOID, ALAND, AREA, FID field per depth)
+# depths = list of depths (ft), sorted
+# fid_fields = FID field for each depth (-1 = piece not in layer)
+
+
+def slr_area_by_depth(df_pieces, depths, fid_fields):
+    print('\tSumming area by depth')
+    df_pieces = normalize_key_columns(df_pieces)
+    # Lowest depth that floods each piece
+    flooded = df_pieces[fid_fields].values != -1
+    first_depth = np.asarray(depths)[flooded.argmax(axis=1)]
+    # Pieces flooded at 0 ft are already water, not sea level rise
+    new_area = np.where(first_depth > 0, df_pieces['AREA'].values, 0)
+
+    df_area = pd.DataFrame({
+        'GEOID': df_pieces['GEOID'].values,
+        'ALAND': df_pieces['ALAND'].values,
+        'DEPTH': first_depth,
+        'AREA': new_area
+    })
+    df = df_area.pivot_table(index=['GEOID', 'ALAND'], columns='DEPTH', values='AREA', aggfunc='sum', fill_value=0)
+    df = df.reindex(columns=depths, fill_value=0)
+    # Area flooded at each depth includes all lower depths
+    df = df.cumsum(axis=1)
+    df.columns = ['AREA_' + str(x) + 'FT' for x in depths]
+    return df.reset_index()
+
+# --------------------- interpolate_slr_area -----------------------------
+# Area flooded at depth_ft, interpolated between nearest depth layers, return series
+# df = output of intersect_slr_all_depths
+# depth_ft = sea level rise (ft), ex: 0.85
+
+
+def interpolate_slr_area(df, depth_ft):
+    slr_low = math.floor(depth_ft)
+    slr_high = math.ceil(depth_ft)
+    slr_remainder = depth_ft - slr_low
+    for depth in [slr_low, slr_high]:
+        if 'AREA_' + str(depth) + 'FT' not in df.columns:
+            raise ValueError('Missing sea level rise layer for ' + str(depth) + ' ft')
+    area_low = df['AREA_' + str(slr_low) + 'FT']
+    area_high = df['AREA_' + str(slr_high) + 'FT']
+    return area_low + slr_remainder * (area_high - area_low)
+
+# --------------------- slr_metric_names -----------------------------
+# Metric name for each sea level rise scenario, return dictionary (depth: metric name)
+# depth_ft = sea level rise (ft); one number (metric 'SLR') or list of numbers (ex: 0.85 -> 'SLR_0_85', 2 -> 'SLR_2')
+
+
+def slr_metric_names(depth_ft):
+    if not isinstance(depth_ft, (list, tuple)):
+        return {depth_ft: 'SLR'}
+    metric_names = {}
+    for depth in depth_ft:
+        # Drop trailing .0 (2.0 ft -> 'SLR_2')
+        if float(depth).is_integer():
+            depth_name = str(int(depth))
+        else:
+            depth_name = str(depth).replace('.', '_')
+        metric = 'SLR_' + depth_name
+        # Shapefile field names are 10 characters max (P_, N_, U_ prefix + 8 character metric)
+        if len(metric) > 8:
+            raise ValueError('Sea level rise metric name is over 8 characters: ' + metric)
+        if metric in metric_names.values():
+            raise ValueError('Duplicate sea level rise depth: ' + str(depth))
+        metric_names[depth] = metric
+    return metric_names
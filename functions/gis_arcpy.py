@@ -0,0 +1,310 @@
+# ---------------------------------------------------------------------------
+# gis_arcpy
+# Last updated: 2026-10-17
+# Authors: Mariel Sorlien
+#
+# Description:
+# ArcGIS Pro GIS backend (see gis_backend). Same functions as gis_geopandas.
+# REQUIRES GIS/ARCPY
+# ---------------------------------------------------------------------------
+
+import os
+import uuid
+
+import arcpy
+import pandas as pd
+
+from functions.read_table import read_table as read_table_any
+
+# --------------------- set_environment -----------------------------
+# output_crs = coordinate system for outputs (WKID or name, ex: 26919 or 'NAD 1983 UTM Zone 19N')
+
+
+def set_environment(output_crs=None):
+    arcpy.env.overwriteOutput = True
+    if output_crs is not None:
+        arcpy.env.outputCoordinateSystem = arcpy.SpatialReference(output_crs)
+
+# --------------------- scratch datasets -----------------------------
+
+
+def scratch_folder():
+    return arcpy.env.scratchFolder
+
+
+def temp_dataset(name):
+    # Unique name (stages may run in parallel); geodatabase keeps long field names
+    return arcpy.env.scratchGDB + '/' + name + '_' + uuid.uuid4().hex[:8]
+
+
+def base_name(dataset):
+    return arcpy.Describe(dataset).baseName
+
+
+def delete(datasets):
+    arcpy.management.Delete(datasets)
+
+# --------------------- read_table -----------------------------
+# Read attribute table as dataframe (see read_table)
+
+
+def read_table(dataset, fields=None, where_clause=None):
+    return read_table_any(dataset, fields, where_clause)
+
+# --------------------- read_areas -----------------------------
+# Read fields and polygon area (column AREA; output coordinate system units), return dataframe
+
+
+def read_areas(dataset, fields):
+    array = arcpy.da.FeatureClassToNumPyArray(dataset, list(fields) + ['SHAPE@AREA'])
+    df = pd.DataFrame(array)
+    return df.rename(columns={'SHAPE@AREA': 'AREA'})
+
+# --------------------- read_geometries, write_attributes, write_geometries -----------------------------
+# read_geometries = return (array of shapely geometries, dataframe of fields), output coordinate system
+# write_attributes = copy geometries of in_features to out_features with attributes from df (replaces all fields;
+#                    df rows in feature order, see read_geometries)
+# write_geometries = save shapely polygons (output coordinate system) with attributes from df (one row per geometry)
+# write_attributes, write_geometries raise ValueError if number of features and df rows differ
+# REQUIRES SHAPELY 2 (read_geometries, write_geometries)
+
+
+def read_geometries(dataset, fields=None):
+    import shapely
+
+    if fields is None:
+        # Attribute fields (not geodatabase Shape_Length, Shape_Area)
+        describe = arcpy.Describe(dataset)
+        shape_fields = [getattr(describe, 'lengthFieldName', ''), getattr(describe, 'areaFieldName', '')]
+        fields = [x.name for x in arcpy.ListFields(dataset)
+                  if x.type not in ['OID', 'Geometry'] and x.name not in shape_fields]
+    cursor_options = {}
+    if arcpy.env.outputCoordinateSystem is not None:
+        cursor_options['spatial_reference'] = arcpy.env.outputCoordinateSystem
+    with arcpy.da.SearchCursor(dataset, ['SHAPE@WKB'] + list(fields), **cursor_options) as cursor:
+        rows = list(cursor)
+    geoms = shapely.from_wkb([bytes(x[0]) if x[0] is not None else None for x in rows])
+    df = pd.DataFrame([x[1:] for x in rows], columns=list(fields))
+    return geoms, df
+
+
+def write_attributes(in_features, out_features, df):
+    # Rows are matched to features by position, so counts must match
+    check_row_count(int(arcpy.management.GetCount(in_features).getOutput(0)), df)
+    describe = arcpy.Describe(in_features)
+    spatial_reference = arcpy.env.outputCoordinateSystem or describe.spatialReference
+    create_feature_class(out_features, describe.shapeType.upper(), spatial_reference, df)
+
+    # Null values (NaN) are written as <Null>
+    df = df.astype(object).where(df.notnull(), None)
+    # Geometries are copied in feature order, so rows line up with read_geometries
+    with arcpy.da.SearchCursor(in_features, ['SHAPE@'], spatial_reference=spatial_reference) as search_cursor, \
+            arcpy.da.InsertCursor(out_features, ['SHAPE@'] + list(df.columns)) as insert_cursor:
+        for shape, values in zip(search_cursor, df.itertuples(index=False, name=None)):
+            insert_cursor.insertRow((shape[0],) + values)
+
+
+def write_geometries(out_features, geoms, df):
+    import shapely
+
+    check_row_count(len(geoms), df)
+    create_feature_class(out_features, 'POLYGON', arcpy.env.outputCoordinateSystem, df)
+    df = df.astype(object).where(df.notnull(), None)
+    wkb = shapely.to_wkb(geoms)
+    with arcpy.da.InsertCursor(out_features, ['SHAPE@WKB'] + list(df.columns)) as insert_cursor:
+        for shape, values in zip(wkb, df.itertuples(index=False, name=None)):
+            insert_cursor.insertRow((bytearray(shape) if shape is not None else None,) + values)
+
+
+def check_row_count(feature_count, df):
+    if feature_count != len(df):
+        raise ValueError('Feature count (' + str(feature_count) + ') does not match row count (' + str(len(df)) + ')')
+
+# --------------------- create_feature_class -----------------------------
+# Create empty feature class with one field per df column (field type from column type)
+
+
+def create_feature_class(out_features, geometry_type, spatial_reference, df):
+    out_path, out_name = os.path.split(out_features)
+    arcpy.management.CreateFeatureclass(out_path=out_path,
+                                        out_name=out_name,
+                                        geometry_type=geometry_type,
+                                        spatial_reference=spatial_reference)
+    fields = []
+    for column in df.columns:
+        if pd.api.types.is_bool_dtype(df[column]):
+            fields.append([column, 'SHORT'])
+        elif pd.api.types.is_integer_dtype(df[column]) and df[column].between(-2 ** 31, 2 ** 31 - 1).all():
+            fields.append([column, 'LONG'])
+        elif pd.api.types.is_numeric_dtype(df[column]):
+            fields.append([column, 'DOUBLE'])
+        else:
+            text_length = int(df[column].dropna().astype(str).str.len().max()) if df[column].notnull().any() else 0
+            fields.append([column, 'TEXT', column, max(50, text_length)])
+    arcpy.management.AddFields(out_features, fields)
+
+# --------------------- select, copy_features -----------------------------
+
+
+def select(in_features, out_features, where_clause):
+    arcpy.analysis.Select(in_features=in_features,
+                          out_feature_class=out_features,
+                          where_clause=where_clause)
+
+
+def copy_features(in_features, out_features):
+    arcpy.management.CopyFeatures(in_features=in_features,
+                                  out_feature_class=out_features)
+
+# --------------------- field edits -----------------------------
+# fields (add_fields) = list of [field name, field type, field alias, field length]
+
+
+def add_fields(table, fields):
+    arcpy.management.AddFields(table, fields)
+
+
+def set_field_values(table, values):
+    # values = dictionary (field: constant value)
+    arcpy.management.CalculateFields(table, 'PYTHON3',
+                                     [[field, repr(value)] for field, value in values.items()])
+
+
+def keep_fields(table, fields):
+    arcpy.management.DeleteField(table, fields, 'KEEP_FIELDS')
+
+
+def delete_fields(table, fields):
+    arcpy.management.DeleteField(table, fields)
+
+
+def rename_field(table, old_name, new_name):
+    # Check if old and new name match, ignoring case
+    # If yes - replace old name with 'temp_name'
+    if old_name.lower() == new_name.lower():
+        arcpy.management.AlterField(in_table=table,
+                                    field=old_name,
+                                    new_field_name='temp_name')
+        old_name = 'temp_name'
+    # Replace old name with new name
+    arcpy.management.AlterField(in_table=table,
+                                field=old_name,
+                                new_field_name=new_name,
+                                new_field_alias=new_name)
+
+
+def replace_null_values(table, values):
+    # values = dictionary (field: replacement value); returns number of rows changed
+    fields = list(values)
+    new_values = [values[x] for x in fields]
+    rows_touched = 0
+    with arcpy.da.UpdateCursor(table, fields) as cursor:
+        for row in cursor:
+            is_dirty = False
+            for i, value in enumerate(row):
+                if value is None or value == '' or value == ' ':
+                    row[i] = new_values[i]
+                    is_dirty = True
+            # Only rows with a replaced value are written
+            if is_dirty:
+                cursor.updateRow(row)
+                rows_touched += 1
+    return rows_touched
+
+# --------------------- join_field -----------------------------
+# Add all fields from join_table to in_data (join_field is dropped)
+# numeric_keys = if True, matches keys as numbers (ex: GEOID text field to csv GEOID with leading 0 dropped)
+
+
+def join_field(in_data, in_field, join_table, join_field, numeric_keys=False):
+    if numeric_keys is True:
+        # Join on temp_ID (number) not in_field (string)
+        arcpy.management.AddField(in_table=in_data,
+                                  field_name='temp_ID',
+                                  field_type='DOUBLE')
+        arcpy.management.CalculateField(in_table=in_data,
+                                        field='temp_ID',
+                                        expression='float(!' + in_field + '!)')
+        arcpy.management.JoinField(in_data=in_data,
+                                   in_field='temp_ID',
+                                   join_table=join_table,
+                                   join_field=join_field)
+        drop_fields = ['temp_ID']
+    else:
+        arcpy.management.JoinField(in_data=in_data,
+                                   in_field=in_field,
+                                   join_table=join_table,
+                                   join_field=join_field)
+        drop_fields = []
+    # Join field is copied with a suffix if in_data already has a field with the same name
+    field_names = [x.name for x in arcpy.ListFields(in_data)]
+    for field in [join_field, join_field + '_1']:
+        if field in field_names and field != in_field:
+            drop_fields.append(field)
+    if len(drop_fields) > 0:
+        arcpy.management.DeleteField(in_table=in_data, drop_field=drop_fields)
+
+# --------------------- spatial_join -----------------------------
+# Join attributes from join_features to target_features, keeps all target features
+# match_option = 'LARGEST_OVERLAP' or 'INTERSECT'
+# concatenate_fields = fields where all matching values are kept, joined with delimiter (list)
+# field_length = text length of concatenated fields
+# workers = not used (ArcGIS manages its own threads)
+
+
+def spatial_join(target_features, join_features, out_features, match_option,
+                 concatenate_fields=None, delimiter='; ', field_length=1000, workers=1):
+    gis_temp = arcpy.env.scratchFolder + '/blockgroup_join_' + uuid.uuid4().hex[:8] + '.shp'
+
+    # Make field map
+    fieldmap = arcpy.FieldMappings()
+    fieldmap.addTable(target_features)
+    fieldmap.addTable(join_features)
+
+    # Update field map to concatenate strings for selected fields
+    for x in concatenate_fields or []:
+        oldfieldmap = fieldmap.findFieldMapIndex(x)
+        newfieldmap = fieldmap.getFieldMap(oldfieldmap)
+        newfieldmap.mergeRule = 'join'
+        newfieldmap.joinDelimiter = delimiter
+
+        newfield = newfieldmap.outputField
+        newfield.length = field_length
+        newfieldmap.outputField = newfield
+
+        fieldmap.replaceFieldMap(oldfieldmap, newfieldmap)
+
+    arcpy.analysis.SpatialJoin(target_features=target_features,
+                               join_features=join_features,
+                               out_feature_class=gis_temp,
+                               field_mapping=fieldmap,
+                               match_option=match_option)
+    arcpy.management.CopyFeatures(in_features=gis_temp,
+                                  out_feature_class=out_features)
+    arcpy.management.Delete(gis_temp)
+
+# --------------------- overlay -----------------------------
+# union (attributes: FID_<input name> only), intersect (all attributes), erase, dissolve
+
+
+def union(in_features, out_features):
+    arcpy.analysis.Union(in_features=in_features,
+                         out_feature_class=out_features,
+                         join_attributes='ONLY_FID')
+
+
+def intersect(in_features, out_features):
+    arcpy.analysis.Intersect(in_features=in_features,
+                             out_feature_class=out_features)
+
+
+def erase(in_features, erase_features, out_features):
+    arcpy.analysis.Erase(in_features=in_features,
+                         erase_features=erase_features,
+                         out_feature_class=out_features)
+
+
+def dissolve(in_features, out_features, fields):
+    arcpy.management.Dissolve(in_features=in_features,
+                              out_feature_class=out_features,
+                              dissolve_field=fields)
@@ -0,0 +1,32 @@
+# ---------------------------------------------------------------------------
+# gis_backend
+# Last updated: 2026-10-17
+# Authors: Mariel Sorlien
+#
+# Description:
+# Selects the library used for GIS operations (spatial join, select, copy,
+# field edits, join field, union/intersect/erase/dissolve, area). Both
+# backends have the same functions, so scripts call gis.select(...) etc.
+# without importing arcpy directly.
+#   'arcpy' = ArcGIS Pro (functions/gis_arcpy.py)
+#   'geopandas' = geopandas + pyogrio, no ArcGIS needed (functions/gis_geopandas.py)
+# Backends are only imported when selected (importing arcpy is slow and only
+# works where ArcGIS Pro is installed).
+# ---------------------------------------------------------------------------
+
+import importlib
+
+gis_backends = {
+    'arcpy': 'functions.gis_arcpy',
+    'geopandas': 'functions.gis_geopandas'
+}
+
+# --------------------- get_gis_backend -----------------------------
+# Return backend module
+# backend = 'arcpy' or 'geopandas'
+
+
+def get_gis_backend(backend):
+    if backend not in gis_backends:
+        raise ValueError('Unknown GIS backend: ' + str(backend))
+    return importlib.import_module(gis_backends[backend])
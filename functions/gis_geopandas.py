@@ -0,0 +1,336 @@
+# ---------------------------------------------------------------------------
+# gis_geopandas
+# Last updated: 2026-10-17
+# Authors: Mariel Sorlien
+#
+# Description:
+# Open source GIS backend (see gis_backend), runs without ArcGIS (ex: Linux).
+# Same functions as gis_arcpy. Features are read and written in bulk with
+# pyogrio (Arrow based when pyarrow is installed); overlays use geopandas,
+# spatial joins use the STRtree engine in spatial_join.
+# Datasets are paths, same as arcpy:
+#   folder/file.shp, folder/file.gpkg, folder/data.gdb/layer,
+#   folder/data.gdb/feature_dataset/layer
+# Field edits (add, delete, rename, join) read the dataset, edit it, and write
+# it back.
+# REQUIRES GEOPANDAS, PYOGRIO
+# ---------------------------------------------------------------------------
+
+import glob
+import importlib.util
+import os
+import shutil
+import tempfile
+import uuid
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import pyogrio
+
+from functions.read_table import read_table as read_table_any
+from functions.replace_null_gis import replace_null_in_dataframe
+from functions.spatial_join import spatial_join_attributes
+
+# Arrow based reads if pyarrow is installed
+use_arrow = importlib.util.find_spec('pyarrow') is not None
+
+container_extensions = ['.gdb', '.gpkg']
+drivers = {'.gdb': 'OpenFileGDB', '.gpkg': 'GPKG', '.shp': 'ESRI Shapefile'}
+# Output coordinate system is saved as an environment variable so worker processes see it too
+crs_variable = 'EJMAP_OUTPUT_CRS'
+
+# --------------------- set_environment -----------------------------
+# output_crs = coordinate system for outputs (EPSG code or name, ex: 26919)
+
+
+def set_environment(output_crs=None):
+    if output_crs is not None:
+        os.environ[crs_variable] = str(output_crs)
+
+# --------------------- scratch datasets -----------------------------
+
+
+def scratch_folder():
+    folder = os.path.join(tempfile.gettempdir(), 'ejmap_scratch')
+    os.makedirs(folder, exist_ok=True)
+    return folder
+
+
+def temp_dataset(name):
+    # Unique name (stages may run in parallel); geopackage keeps long field names
+    return scratch_folder() + '/' + name + '_' + uuid.uuid4().hex[:8] + '.gpkg'
+
+
+def base_name(dataset):
+    path, layer, feature_dataset = split_dataset(dataset)
+    if layer is not None:
+        return layer
+    return os.path.splitext(os.path.basename(path))[0]
+
+
+def delete(datasets):
+    if isinstance(datasets, str):
+        datasets = [datasets]
+    for dataset in datasets:
+        path, layer, feature_dataset = split_dataset(dataset)
+        # Layers inside a .gdb/.gpkg are left in place (overwritten on next write)
+        if layer is not None:
+            continue
+        if os.path.isdir(path):
+            shutil.rmtree(path, ignore_errors=True)
+        elif os.path.splitext(path)[1].lower() == '.shp':
+            # Shapefile sidecar files (.dbf, .shx, .prj, ...)
+            for file_path in glob.glob(glob.escape(os.path.splitext(path)[0]) + '.*'):
+                os.remove(file_path)
+        elif os.path.exists(path):
+            os.remove(path)
+
+# --------------------- split_dataset -----------------------------
+# Split dataset path, return (file path, layer name or None, feature dataset or None)
+# ex: 'data.gdb/source_data/towns' -> ('data.gdb', 'towns', 'source_data')
+
+
+def split_dataset(dataset):
+    parts = dataset.replace('\\', '/').split('/')
+    for i, part in enumerate(parts[:-1]):
+        if os.path.splitext(part)[1].lower() in container_extensions:
+            inner = parts[i + 1:]
+            feature_dataset = inner[0] if len(inner) > 1 else None
+            return '/'.join(parts[:i + 1]), inner[-1], feature_dataset
+    return dataset, None, None
+
+# --------------------- read_features, write_features -----------------------------
+
+
+def read_features(dataset, columns=None, where_clause=None):
+    path, layer, feature_dataset = split_dataset(dataset)
+    gdf = pyogrio.read_dataframe(path, layer=layer, columns=columns, where=where_clause, use_arrow=use_arrow)
+    output_crs = os.environ.get(crs_variable)
+    if output_crs is not None and gdf.crs is not None and not gdf.crs.equals(output_crs):
+        gdf = gdf.to_crs(output_crs)
+    return gdf
+
+
+def write_features(gdf, dataset):
+    path, layer, feature_dataset = split_dataset(dataset)
+    layer_options = None
+    if feature_dataset is not None:
+        layer_options = {'FEATURE_DATASET': feature_dataset}
+    if layer is None:
+        delete(path)
+    driver = drivers.get(os.path.splitext(path)[1].lower())
+    if driver == 'OpenFileGDB':
+        # ArcGIS Pro 3.1 geodatabases have no 64 bit integer fields; use 32 bit where values fit
+        for column in gdf.columns:
+            if gdf[column].dtype == 'int64' and gdf[column].between(-2 ** 31, 2 ** 31 - 1).all():
+                gdf[column] = gdf[column].astype('int32')
+    pyogrio.write_dataframe(gdf, path, layer=layer, driver=driver, layer_options=layer_options,
+                            use_arrow=use_arrow)
+
+# --------------------- read_geometries, write_attributes, write_geometries -----------------------------
+# read_geometries = return (array of shapely geometries, dataframe of fields), output coordinate system
+# write_attributes = copy geometries of in_features to out_features with attributes from df (replaces all fields;
+#                    df rows in feature order, see read_geometries)
+# write_geometries = save shapely polygons (output coordinate system) with attributes from df (one row per geometry)
+# write_attributes, write_geometries raise ValueError if number of features and df rows differ
+
+
+def read_geometries(dataset, fields=None):
+    gdf = read_features(dataset, columns=fields)
+    df = pd.DataFrame(gdf.drop(columns=gdf.geometry.name)).reset_index(drop=True)
+    return np.asarray(gdf.geometry.values), df
+
+
+def write_attributes(in_features, out_features, df):
+    gdf = read_features(in_features, columns=[])
+    # Rows are matched to features by position, so counts must match
+    check_row_count(len(gdf), df)
+    df = df.set_axis(gdf.index)
+    write_features(gpd.GeoDataFrame(df, geometry=gdf.geometry.values, crs=gdf.crs), out_features)
+
+
+def write_geometries(out_features, geoms, df):
+    check_row_count(len(geoms), df)
+    df = df.reset_index(drop=True)
+    write_features(gpd.GeoDataFrame(df, geometry=np.asarray(geoms), crs=os.environ.get(crs_variable)), out_features)
+
+
+def check_row_count(feature_count, df):
+    if feature_count != len(df):
+        raise ValueError('Feature count (' + str(feature_count) + ') does not match row count (' + str(len(df)) + ')')
+
+# --------------------- read_table -----------------------------
+# Read attribute table as dataframe (see read_table)
+
+
+def read_table(dataset, fields=None, where_clause=None):
+    backend = None
+    if split_dataset(dataset)[1] is not None:
+        backend = 'pyogrio'
+    return read_table_any(dataset, fields, where_clause, backend)
+
+# --------------------- read_areas -----------------------------
+# Read fields and polygon area (column AREA; output coordinate system units), return dataframe
+
+
+def read_areas(dataset, fields):
+    gdf = read_features(dataset, list(fields))
+    df = pd.DataFrame(gdf[list(fields)])
+    df['AREA'] = gdf.area.values
+    return df
+
+# --------------------- select, copy_features -----------------------------
+
+
+def select(in_features, out_features, where_clause):
+    write_features(read_features(in_features, where_clause=where_clause), out_features)
+
+
+def copy_features(in_features, out_features):
+    write_features(read_features(in_features), out_features)
+
+# --------------------- field edits -----------------------------
+# fields (add_fields) = list of [field name, field type, field alias, field length]
+
+
+def add_fields(table, fields):
+    gdf = read_features(table)
+    for field in fields:
+        if field[1] == 'TEXT':
+            gdf[field[0]] = pd.Series(None, index=gdf.index, dtype=object)
+        else:
+            gdf[field[0]] = np.nan
+    write_features(gdf, table)
+
+
+def set_field_values(table, values):
+    # values = dictionary (field: constant value)
+    gdf = read_features(table)
+    for field, value in values.items():
+        gdf[field] = value
+    write_features(gdf, table)
+
+
+def keep_fields(table, fields):
+    gdf = read_features(table)
+    write_features(gdf[[x for x in gdf.columns if x in fields or x == gdf.geometry.name]], table)
+
+
+def delete_fields(table, fields):
+    gdf = read_features(table)
+    write_features(gdf.drop(columns=[x for x in fields if x in gdf.columns]), table)
+
+
+def rename_field(table, old_name, new_name):
+    gdf = read_features(table)
+    write_features(gdf.rename(columns={old_name: new_name}), table)
+
+
+def replace_null_values(table, values):
+    # values = dictionary (field: replacement value); returns number of rows changed
+    gdf, rows_touched = replace_null_in_dataframe(read_features(table), values)
+    # Only written if something changed
+    if rows_touched > 0:
+        write_features(gdf, table)
+    return rows_touched
+
+# --------------------- join_field -----------------------------
+# Add all fields from join_table to in_data (join_field is dropped)
+# numeric_keys = if True, matches keys as numbers (ex: GEOID text field to csv GEOID with leading 0 dropped)
+
+
+def join_field(in_data, in_field, join_table, join_field, numeric_keys=False):
+    gdf = read_features(in_data)
+    df_join = read_table(join_table)
+    keys = gdf[in_field]
+    join_keys = df_join[join_field]
+    if numeric_keys is True:
+        keys = pd.to_numeric(keys, errors='coerce').astype('Int64')
+        join_keys = pd.to_numeric(join_keys, errors='coerce').astype('Int64')
+    df_join = df_join.drop(columns=join_field)
+    # Only first match is used (same as ArcGIS)
+    df_join.index = join_keys.values
+    df_join = df_join[~df_join.index.duplicated()]
+    # Fields already in in_data get a _1 suffix (same as ArcGIS)
+    df_join = df_join.rename(columns={x: x + '_1' for x in df_join.columns if x in gdf.columns})
+    df_join = df_join.reindex(keys.values)
+    df_join.index = gdf.index
+    write_features(pd.concat([gdf, df_join], axis=1), in_data)
+
+# --------------------- spatial_join -----------------------------
+# Join attributes from join_features to target_features, keeps all target features
+# match_option = 'LARGEST_OVERLAP' or 'INTERSECT'
+# concatenate_fields = fields where all matching values are kept, joined with delimiter (list)
+# field_length = text length of concatenated fields
+# workers = number of processes (None = all cores)
+
+
+def spatial_join(target_features, join_features, out_features, match_option,
+                 concatenate_fields=None, delimiter='; ', field_length=1000, workers=1):
+    gdf = read_features(target_features)
+    gdf_join = read_features(join_features)
+    if gdf_join.crs != gdf.crs:
+        gdf_join = gdf_join.to_crs(gdf.crs)
+    # Fields already in target features keep target values (same as ArcGIS field mapping)
+    join_columns = [x for x in gdf_join.columns if x != gdf_join.geometry.name and x not in gdf.columns]
+
+    df_joined = spatial_join_attributes(gdf.geometry.values, gdf_join.geometry.values,
+                                        pd.DataFrame(gdf_join[join_columns]), match_option,
+                                        concatenate_fields, delimiter, field_length, workers)
+    df_joined.insert(1, 'TARGET_FID', np.arange(len(gdf)))
+    df_joined.index = gdf.index
+    # Target features from an earlier join already have Join_Count, TARGET_FID (ArcGIS adds _1, _2, ...)
+    for column in ['Join_Count', 'TARGET_FID']:
+        new_name = column
+        suffix = 0
+        while new_name in gdf.columns:
+            suffix += 1
+            new_name = column + '_' + str(suffix)
+        df_joined = df_joined.rename(columns={column: new_name})
+    write_features(pd.concat([gdf, df_joined], axis=1), out_features)
+
+# --------------------- overlay -----------------------------
+# union (attributes: FID_<input name> only), intersect (all attributes), erase, dissolve
+
+
+def union(in_features, out_features):
+    gdf = None
+    fid_fields = []
+    for dataset in in_features:
+        gdf_layer = read_features(dataset, columns=[])
+        fid_field = 'FID_' + base_name(dataset)
+        gdf_layer = gpd.GeoDataFrame({fid_field: np.arange(len(gdf_layer))}, geometry=gdf_layer.geometry.values,
+                                     crs=gdf_layer.crs)
+        fid_fields.append(fid_field)
+        if gdf is None:
+            gdf = gdf_layer
+        else:
+            gdf = gpd.overlay(gdf, gdf_layer.to_crs(gdf.crs), how='union', keep_geom_type=True)
+    # Areas outside a layer get FID -1 (same as ArcGIS)
+    for fid_field in fid_fields:
+        gdf[fid_field] = gdf[fid_field].fillna(-1).astype('int64')
+    write_features(gdf, out_features)
+
+
+def intersect(in_features, out_features):
+    gdf = None
+    for dataset in in_features:
+        gdf_layer = read_features(dataset)
+        gdf_layer.insert(0, 'FID_' + base_name(dataset), np.arange(len(gdf_layer)))
+        if gdf is None:
+            gdf = gdf_layer
+        else:
+            gdf = gpd.overlay(gdf, gdf_layer.to_crs(gdf.crs), how='intersection', keep_geom_type=True)
+    write_features(gdf, out_features)
+
+
+def erase(in_features, erase_features, out_features):
+    gdf = read_features(in_features)
+    gdf_erase = read_features(erase_features, columns=[]).to_crs(gdf.crs)
+    write_features(gpd.overlay(gdf, gdf_erase, how='difference', keep_geom_type=True), out_features)
+
+
+def dissolve(in_features, out_features, fields):
+    gdf = read_features(in_features, columns=fields)
+    write_features(gdf.dissolve(by=fields, as_index=False)[fields + [gdf.geometry.name]], out_features)
@@ -0,0 +1,226 @@
+# ---------------------------------------------------------------------------
+# instrumentation
+# Last updated: 2026-10-17
+# Authors: Mariel Sorlien
+#
+# Description:
+# Records wall time, CPU time, peak memory (RSS), and row counts for each
+# stage of a run, and saves them as a JSON run report.
+#   with stage('epa', 'Adding EPA data') as record:   # script steps
+#       ...
+#       record['rows'] = len(df)
+#   @instrument_stage                                 # helper functions
+#   def add_csv_dataset(...)                          # (rows = len of dataframe output)
+# Stages can be nested; each record lists its parent stages (path).
+# Stages can be profiled with cProfile or tracemalloc (see configure_instrumentation).
+# Stages run in worker processes (run_stages, tiles) are recorded in the
+# worker; the main process records the stage as a whole. Stages run in worker
+# threads (run_stages executor='thread') are added to the main run report;
+# their paths start at the first stage in the thread.
+# ---------------------------------------------------------------------------
+
+import cProfile
+import datetime
+import functools
+import io
+import json
+import os
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+# Current run (main process)
+run_report = {'stages': []}
+settings = {'profile_stages': {}, 'profile_folder': None}
+# Open stages, one list per thread (see stage_stack)
+thread_state = threading.local()
+# Worker threads add records to run_report at the same time
+report_lock = threading.Lock()
+
+# --------------------- configure_instrumentation -----------------------------
+# Start new run report
+# run_name = name saved in report (ex: 'ejmap_step2')
+# profile_stages = dictionary (stage name: 'cprofile' or 'tracemalloc'); profiles are saved to profile_folder
+# profile_folder = profile output location (None = current folder)
+
+
+def configure_instrumentation(run_name=None, profile_stages=None, profile_folder=None):
+    run_report.clear()
+    run_report.update({
+        'run_name': run_name,
+        'started': datetime.datetime.now().isoformat(timespec='seconds'),
+        'python': sys.version.split()[0],
+        'start_wall': time.perf_counter(),
+        'start_cpu': time.process_time(),
+        'stages': []
+    })
+    settings['profile_stages'] = dict(profile_stages or {})
+    for mode in settings['profile_stages'].values():
+        if mode not in ['cprofile', 'tracemalloc']:
+            raise ValueError('Unknown profile mode: ' + str(mode))
+    settings['profile_folder'] = profile_folder
+    del stage_stack()[:]
+
+# --------------------- stage_stack -----------------------------
+# Open stages in this thread (list of records, outermost first)
+
+
+def stage_stack():
+    if not hasattr(thread_state, 'stack'):
+        thread_state.stack = []
+    return thread_state.stack
+
+# --------------------- stage -----------------------------
+# Context manager, records one stage; yields record (dictionary), set record['rows'] to add row count
+# name = stage name (used in report and profile_stages)
+# message = printed at start of stage (None = no message)
+
+
+@contextmanager
+def stage(name, message=None):
+    if message is not None:
+        print(message)
+    open_stages = stage_stack()
+    record = {'name': name, 'path': '/'.join([x['name'] for x in open_stages] + [name]), 'rows': None}
+    profile_mode = settings['profile_stages'].get(name)
+    profiler = start_profile(profile_mode)
+    peak_rss_start = peak_rss_mb()
+    start_wall = time.perf_counter()
+    start_cpu = time.process_time()
+    open_stages.append(record)
+    try:
+        yield record
+    except BaseException:
+        record['failed'] = True
+        raise
+    finally:
+        open_stages.pop()
+        record['wall_s'] = round(time.perf_counter() - start_wall, 3)
+        record['cpu_s'] = round(time.process_time() - start_cpu, 3)
+        record['peak_rss_mb'] = peak_rss_mb()
+        if record['peak_rss_mb'] is not None and peak_rss_start is not None:
+            # Peak RSS never goes down, so an increase means this stage set a new peak
+            record['peak_rss_increase_mb'] = round(record['peak_rss_mb'] - peak_rss_start, 1)
+        if profiler is not None:
+            record['profile'] = stop_profile(profile_mode, profiler, name)
+        with report_lock:
+            run_report.setdefault('stages', []).append(record)
+        print('\t[' + record['path'] + '] ' + str(record['wall_s']) + ' s, CPU ' + str(record['cpu_s']) + ' s' +
+              ('' if record['peak_rss_mb'] is None else ', peak RSS ' + str(record['peak_rss_mb']) + ' MB') +
+              ('' if record['rows'] is None else ', ' + str(record['rows']) + ' rows'))
+
+# --------------------- instrument_stage -----------------------------
+# Decorator, records each call as a stage (name = function name); rows = length of dataframe output
+
+
+def instrument_stage(function):
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        with stage(function.__name__) as record:
+            result = function(*args, **kwargs)
+            if hasattr(result, 'columns') and hasattr(result, 'index'):
+                record['rows'] = len(result)
+            return result
+    return wrapper
+
+# --------------------- add_stage_record -----------------------------
+# Add stage timed somewhere else (ex: stage run in a worker process, wall time only)
+
+
+def add_stage_record(name, wall_s, rows=None):
+    record = {'name': name, 'path': '/'.join([x['name'] for x in stage_stack()] + [name]), 'rows': rows,
+              'wall_s': round(wall_s, 3), 'cpu_s': None, 'peak_rss_mb': None}
+    with report_lock:
+        run_report.setdefault('stages', []).append(record)
+    print('\t[' + record['path'] + '] ' + str(record['wall_s']) + ' s (worker process)')
+
+# --------------------- peak_rss_mb -----------------------------
+# Peak memory (resident set size) of this process so far, in MB (None if unknown)
+
+
+def peak_rss_mb():
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linux reports KB, macOS reports bytes
+        if sys.platform == 'darwin':
+            peak = peak / 1024
+        return round(peak / 1024, 1)
+    except ImportError:
+        pass
+    try:
+        # Windows (psutil is optional)
+        import psutil
+        return round(psutil.Process().memory_info().peak_wset / 1024 / 1024, 1)
+    except (ImportError, AttributeError):
+        return None
+
+# --------------------- profiles -----------------------------
+
+
+def start_profile(mode):
+    if mode == 'cprofile':
+        profiler = cProfile.Profile()
+        profiler.enable()
+        return profiler
+    if mode == 'tracemalloc':
+        # Already tracing (ex: nested profiled stage): keep going, just take a snapshot at the end
+        was_tracing = tracemalloc.is_tracing()
+        if not was_tracing:
+            tracemalloc.start()
+        return {'was_tracing': was_tracing}
+    return None
+
+
+def stop_profile(mode, profiler, name):
+    folder = settings['profile_folder'] or os.getcwd()
+    os.makedirs(folder, exist_ok=True)
+    file_name = os.path.join(folder, name.replace('/', '_') + '_' + mode)
+    if mode == 'cprofile':
+        profiler.disable()
+        profiler.dump_stats(file_name + '.prof')
+        text = io.StringIO()
+        pstats.Stats(profiler, stream=text).sort_stats('cumulative').print_stats(30)
+        with open(file_name + '.txt', 'w') as f:
+            f.write(text.getvalue())
+        print('\tSaved cProfile output to ' + file_name + '.prof')
+        return {'mode': mode, 'files': [file_name + '.prof', file_name + '.txt']}
+
+    snapshot = tracemalloc.take_snapshot()
+    traced_peak = tracemalloc.get_traced_memory()[1]
+    if not profiler['was_tracing']:
+        tracemalloc.stop()
+    top_lines = [str(x) for x in snapshot.statistics('lineno')[:30]]
+    with open(file_name + '.txt', 'w') as f:
+        f.write('Peak traced memory: ' + str(round(traced_peak / 1024 / 1024, 1)) + ' MB\n')
+        f.write('\n'.join(top_lines) + '\n')
+    print('\tSaved tracemalloc output to ' + file_name + '.txt')
+    return {'mode': mode, 'files': [file_name + '.txt'], 'traced_peak_mb': round(traced_peak / 1024 / 1024, 1),
+            'top_lines': top_lines[:10]}
+
+# --------------------- save_run_report -----------------------------
+# Save run report as JSON, print slowest stages
+# report_path = output file (None = print only)
+
+
+def save_run_report(report_path=None):
+    with report_lock:
+        report = dict(run_report, stages=list(run_report.get('stages', [])))
+    if 'start_wall' in report:
+        report['wall_s'] = round(time.perf_counter() - report.pop('start_wall'), 3)
+        report['cpu_s'] = round(time.process_time() - report.pop('start_cpu'), 3)
+    report['peak_rss_mb'] = peak_rss_mb()
+    report['finished'] = datetime.datetime.now().isoformat(timespec='seconds')
+
+    print('\nSlowest stages')
+    for record in sorted(report['stages'], key=lambda x: -x['wall_s'])[:10]:
+        print('\t' + str(record['wall_s']).rjust(9) + ' s  ' + record['path'])
+    if report_path is not None:
+        os.makedirs(os.path.dirname(os.path.abspath(report_path)), exist_ok=True)
+        with open(report_path, 'w') as f:
+            json.dump(report, f, indent=1)
+        print('Saved run report to ' + report_path)
+    return report
@@ -0,0 +1,98 @@
+# ---------------------------------------------------------------------------
+# key_index
+# Last updated: 2026-10-17
+# Authors: Mariel Sorlien
+#
+# Description:
+# Canonical int64 keys for block groups (GEOID) and tracts (GEOID without the
+# last digit). The block group to tract position array is built once, so
+# tract datasets (CDC, First Street) are copied to block groups with an array
+# take instead of a merge on float tract IDs.
+# ---------------------------------------------------------------------------
+
+import numpy as np
+import pandas as pd
+
+from functions.instrumentation import instrument_stage
+
+# --------------------- build_key_index -----------------------------
+# Build key index for block groups, return dictionary
+# geoids = block group GEOIDs (series or array; string, float, or int)
+# Returns dictionary:
+#   geoid = block group GEOIDs (int64 array)
+#   tract = tract ID for each block group (int64 array)
+#   tracts = unique tract IDs (int64 array, sorted)
+#   tract_position = position of each block group's tract in tracts
+
+
+@instrument_stage
+def build_key_index(geoids):
+    geoid = to_int64_keys(geoids, 'GEOID')
+    if not pd.Index(geoid).is_unique:
+        raise ValueError('Duplicate block group GEOIDs')
+    # Block group GEOID = tract ID + 1 digit block group number
+    tract = geoid // 10
+    tracts, tract_position = np.unique(tract, return_inverse=True)
+    return {'geoid': geoid, 'tract': tract, 'tracts': tracts, 'tract_position': tract_position.ravel()}
+
+# --------------------- to_int64_keys -----------------------------
+# Convert ID column to int64 array (raises error if any IDs are missing)
+
+
+def to_int64_keys(values, column_name):
+    keys = pd.to_numeric(pd.Series(values), errors='coerce')
+    if keys.isnull().any():
+        raise ValueError('Missing or non numeric IDs in ' + column_name)
+    return keys.astype('int64').values
+
+# --------------------- broadcast_tract_data -----------------------------
+# Copy tract data to block groups, return dataframe (one row per block group, key column dropped)
+# key_index = output of build_key_index
+# df = tract dataset (one row per tract)
+# key_column = tract ID column in df
+# index = index of output (ex: df_bg.index; None = 0, 1, 2...)
+
+
+@instrument_stage
+def broadcast_tract_data(key_index, df, key_column, index=None):
+    tract_rows = key_positions(key_index['tracts'], df, key_column)
+    return take_rows(df.drop(columns=key_column), tract_rows[key_index['tract_position']], index)
+
+# --------------------- align_block_group_data -----------------------------
+# Reorder block group data to match key index, return dataframe (key column dropped)
+# df = block group dataset (one row per block group)
+# key_column = GEOID column in df
+
+
+@instrument_stage
+def align_block_group_data(key_index, df, key_column, index=None):
+    rows = key_positions(key_index['geoid'], df, key_column)
+    return take_rows(df.drop(columns=key_column), rows, index)
+
+# --------------------- key_positions -----------------------------
+# Row in df for each key (-1 = key not in df)
+
+
+def key_positions(keys, df, key_column):
+    df_keys = pd.to_numeric(df[key_column], errors='coerce')
+    has_key = df_keys.notnull().values
+    key_lookup = pd.Index(df_keys[has_key].astype('int64').values)
+    if not key_lookup.is_unique:
+        raise ValueError('Duplicate IDs in ' + key_column)
+    lookup_rows = key_lookup.get_indexer(keys)
+    if len(key_lookup) == 0:
+        return lookup_rows
+    # Convert from position among rows with keys to position in df
+    return np.where(lookup_rows >= 0, np.flatnonzero(has_key)[lookup_rows], -1)
+
+# --------------------- take_rows -----------------------------
+# Select rows by position (-1 = blank row)
+
+
+def take_rows(df, rows, index=None):
+    # Row labels are 0, 1, 2..., so -1 is missing and becomes a blank (NaN) row
+    df = df.reset_index(drop=True).reindex(rows)
+    if index is None:
+        return df.reset_index(drop=True)
+    df.index = index
+    return df
@@ -0,0 +1,197 @@
+# ---------------------------------------------------------------------------
+# read_table
+# Last updated: 2026-10-17
+# Authors: Mariel Sorlien
+#
+# Description:
+# Reads attribute tables straight into pandas (replaces TableToExcel +
+# read_excel, which is slow and limited to 65,536 rows)
+#   'arcpy' backend: arcpy.da.TableToNumPyArray (geodatabase tables, feature classes)
+#   'file' backend: pure python, for local files (.dbf, .shp, .csv, .feather, .parquet)
+#   'pyogrio' backend: GDAL/OGR, no arcpy (geodatabase and geopackage layers; Arrow based if pyarrow is installed)
+# ---------------------------------------------------------------------------
+
+import codecs
+import os
+import re
+import struct
+import time
+
+import numpy as np
+import pandas as pd
+
+from functions.instrumentation import instrument_stage
+
+file_extensions = ['.dbf', '.shp', '.csv', '.feather', '.parquet']
+
+# --------------------- read_table -----------------------------
+# Read attribute table as dataframe, print rows per second
+# in_table = table, feature class, or file name and location
+# fields = fields to import (list; None = all attribute fields)
+# where_clause = if set, only imports matching rows (file backend: simple comparisons only, ex: 'ALAND > 0')
+# backend = 'arcpy', 'file', 'pyogrio' (None = 'file' for local files, 'arcpy' for everything else)
+
+
+@instrument_stage
+def read_table(in_table, fields=None, where_clause=None, backend=None):
+    if backend is None:
+        backend = 'arcpy'
+        if os.path.splitext(in_table)[1].lower() in file_extensions:
+            backend = 'file'
+
+    print('Reading table (' + backend + ')')
+    start_time = time.perf_counter()
+    if backend == 'arcpy':
+        df = read_table_arcpy(in_table, fields, where_clause)
+    elif backend == 'file':
+        df = read_table_file(in_table, fields, where_clause)
+    elif backend == 'pyogrio':
+        df = read_table_pyogrio(in_table, fields, where_clause)
+    else:
+        raise ValueError('Unknown table backend: ' + str(backend))
+    run_time = time.perf_counter() - start_time
+
+    print('\tRead ' + str(len(df)) + ' rows in ' + str(round(run_time, 2)) + ' s (' +
+          str(int(len(df) / max(run_time, 1e-9))) + ' rows/sec)')
+    return df
+
+# --------------------- read_table_arcpy -----------------------------
+
+
+def read_table_arcpy(in_table, fields, where_clause):
+    import arcpy
+
+    field_types = {}
+    for field in arcpy.ListFields(in_table):
+        if field.type not in ['Geometry', 'Blob', 'Raster', 'GUID', 'GlobalID', 'Date']:
+            field_types[field.name] = field.type
+    if fields is None:
+        fields = [x for x in field_types if x.upper() not in ['SHAPE_LENGTH', 'SHAPE_AREA']]
+
+    # TableToNumPyArray can't store nulls, so set placeholder values
+    null_int = -2147483647
+    null_values = {}
+    for field in fields:
+        if field_types.get(field) in ['Double', 'Single']:
+            null_values[field] = np.nan
+        elif field_types.get(field) in ['Integer', 'SmallInteger', 'OID']:
+            null_values[field] = null_int
+        else:
+            null_values[field] = ''
+
+    array = arcpy.da.TableToNumPyArray(in_table, fields, where_clause, null_value=null_values)
+    df = pd.DataFrame(array)
+    for field in fields:
+        if null_values[field] == null_int:
+            df[field] = df[field].where(df[field] != null_int)
+    return df
+
+# --------------------- read_table_pyogrio -----------------------------
+
+
+def read_table_pyogrio(in_table, fields, where_clause):
+    import pyogrio
+    from functions.gis_geopandas import split_dataset
+    from functions.gis_geopandas import use_arrow
+
+    path, layer, feature_dataset = split_dataset(in_table)
+    df = pyogrio.read_dataframe(path, layer=layer, columns=fields, where=where_clause, read_geometry=False,
+                                use_arrow=use_arrow)
+    return pd.DataFrame(df)
+
+# --------------------- read_table_file -----------------------------
+
+
+def read_table_file(in_table, fields, where_clause):
+    extension = os.path.splitext(in_table)[1].lower()
+    if extension in ['.dbf', '.shp']:
+        # Shapefile attributes are stored in .dbf file
+        df = read_dbf(os.path.splitext(in_table)[0] + '.dbf', fields)
+    elif extension == '.csv':
+        df = pd.read_csv(in_table, sep=',', usecols=fields)
+    elif extension == '.feather':
+        df = pd.read_feather(in_table, columns=fields)
+    elif extension == '.parquet':
+        df = pd.read_parquet(in_table, columns=fields)
+    else:
+        raise ValueError('Unsupported file type: ' + in_table)
+
+    if where_clause is not None:
+        df = df.query(where_clause).reset_index(drop=True)
+    return df
+
+# --------------------- read_dbf -----------------------------
+# Read dBASE table (.dbf) in one pass using numpy record array
+# dbf_input = dbf name and location
+# fields = fields to import (list; None = all fields)
+
+
+def read_dbf(dbf_input, fields=None):
+    # Text encoding (ArcGIS writes .cpg file next to .dbf)
+    encoding = 'utf-8'
+    cpg_file = os.path.splitext(dbf_input)[0] + '.cpg'
+    if os.path.exists(cpg_file):
+        with open(cpg_file, errors='replace') as f:
+            encoding = read_codepage(f.read())
+
+    with open(dbf_input, 'rb') as f:
+        data = f.read()
+
+    # Header: record count, header length, record length
+    num_records, header_length, record_length = struct.unpack('<IHH', data[4:12])
+    field_info = []
+    position = 32
+    while data[position] != 0x0D:
+        descriptor = data[position:position + 32]
+        name = descriptor[:11].split(b'\x00')[0].decode(encoding)
+        field_type = chr(descriptor[11])
+        length = descriptor[16]
+        decimals = descriptor[17]
+        field_info.append([name, field_type, length, decimals])
+        position += 32
+
+    # Read all records at once
+    record_dtype = np.dtype([('deleted', 'S1')] + [(x[0], 'S' + str(x[2])) for x in field_info])
+    records = np.frombuffer(data, dtype=record_dtype, count=num_records, offset=header_length)
+    records = records[records['deleted'] != b'*']
+
+    df = pd.DataFrame()
+    for name, field_type, length, decimals in field_info:
+        if fields is not None and name not in fields:
+            continue
+        values = np.char.strip(records[name])
+        if field_type in ['N', 'F']:
+            values = pd.to_numeric(pd.Series(values.astype(str)), errors='coerce')
+            if decimals == 0 and values.notnull().all():
+                values = values.astype('int64')
+        elif field_type == 'L':
+            values = pd.Series(np.isin(values, [b'T', b't', b'Y', b'y']))
+        else:
+            values = pd.Series([x.decode(encoding, errors='replace') for x in values], dtype=object)
+        df[name] = values.values
+
+    if fields is not None:
+        df = df[fields]
+    return df
+
+# --------------------- read_codepage -----------------------------
+# Convert .cpg file text to python encoding name (ex: 'ANSI 1252', '1252' -> 'cp1252'; '65001' -> 'utf-8')
+# Unknown code pages are read as latin-1 (every byte can be decoded)
+
+
+def read_codepage(cpg_text):
+    codepage = cpg_text.strip().upper()
+    if codepage == '':
+        return 'utf-8'
+    codepage_aliases = {'65001': 'utf-8', 'UTF8': 'utf-8', '88591': 'latin-1', 'ISO 88591': 'latin-1'}
+    if codepage in codepage_aliases:
+        return codepage_aliases[codepage]
+    # Windows/OEM code page numbers (ex: 'ANSI 1252', 'OEM 437', '1252')
+    match = re.fullmatch(r'(?:ANSI|OEM|CP)?\s*(\d+)', codepage)
+    if match is not None:
+        codepage = 'cp' + match.group(1)
+    try:
+        return codecs.lookup(codepage).name
+    except LookupError:
+        print('\tWarning: unknown code page ' + cpg_text.strip() + ', reading text as latin-1')
+        return 'latin-1'
@@ -1,53 +1,98 @@
 # ---------------------------------------------------------------------------
 # fun_block_groups.py
 # Authors: Mariel Sorlien
-# Last updated: 2023-05-04
+# Last updated: 2026-10-17
 # Python 3.7
 #
 # Description: Joins additional dataset to block group data, saves file to scratch folder
+# block_group_overlay joins several datasets at once (see spatial_join)
 # ---------------------------------------------------------------------------
 
-import arcpy
+import pandas as pd
 
+from functions.gis_backend import get_gis_backend
+from functions.instrumentation import instrument_stage
+from functions.replace_null_gis import replace_null_in_dataframe
 
-def block_group_spatial_join(target_features, join_features, concatenate_fields, output_features):
-    gis_temp = arcpy.env.scratchFolder + '/blockgroup_join.shp'
 
-    # Make field map
-    fieldmap = arcpy.FieldMappings()
-    fieldmap.addTable(target_features)
-    fieldmap.addTable(join_features)
+# backend = GIS backend ('arcpy' or 'geopandas')
+# workers = processes for geopandas spatial join engine (see spatial_join; None = all cores)
 
-    # Update field map to concatenate strings for selected fields
-    if concatenate_fields != '':
-        for x in concatenate_fields:
-            oldfieldmap = fieldmap.findFieldMapIndex(x)
-            newfieldmap = fieldmap.getFieldMap(oldfieldmap)
-            newfieldmap.mergeRule = 'join'
-            newfieldmap.joinDelimiter = '; '
-
-            newfield = newfieldmap.outputField
-            newfield.length = 1000
-            newfieldmap.outputField = newfield
-
-            fieldmap.replaceFieldMap(oldfieldmap, newfieldmap)
+@instrument_stage
+def block_group_spatial_join(target_features, join_features, concatenate_fields, output_features,
+                             backend='arcpy', workers=1):
+    gis = get_gis_backend(backend)
 
     # Set join type
     join_type = 'LARGEST_OVERLAP'
     if concatenate_fields != '':
         join_type = 'INTERSECT'
+    else:
+        concatenate_fields = []
 
     print('Adding spatial join')
-    arcpy.analysis.SpatialJoin(
+    # Concatenate strings for selected fields (INTERSECT only)
+    gis.spatial_join(
         target_features=target_features,
         join_features=join_features,
-        out_feature_class=gis_temp,
-        field_mapping=fieldmap,
-        match_option=join_type
+        out_features=output_features,
+        match_option=join_type,
+        concatenate_fields=concatenate_fields,
+        delimiter='; ',
+        field_length=1000,
+        workers=workers
     )
 
-    print('Saving data')
-    arcpy.management.CopyFeatures(
-        in_features=gis_temp,
-        out_feature_class=output_features
-    )
+
+# Fused mode: all overlay layers in one R-tree, one query per block group, one output write
+# overlay_layers = list of [join features, fields, match option, null value]
+#   match option = 'LARGEST_OVERLAP' or 'INTERSECT' (INTERSECT fields are concatenated with '; ')
+#   null value = replaces null/blank values (None = leave null)
+# keep_fields = block group fields to keep
+# new_column_names = dictionary (old name: new name)
+# REQUIRES SHAPELY 2
+
+@instrument_stage
+def block_group_overlay(target_features, overlay_layers, output_features, keep_fields, new_column_names=None,
+                        backend='arcpy', workers=1):
+    from functions.spatial_join import overlay_join_pairs, pairs_to_attributes
+
+    gis = get_gis_backend(backend)
+
+    print('Reading block groups')
+    target_geoms, df = gis.read_geometries(target_features, keep_fields)
+    layer_geoms = []
+    layer_tables = []
+    for layer in overlay_layers:
+        print('Reading ' + gis.base_name(layer[0]))
+        geoms, df_layer = gis.read_geometries(layer[0], layer[1])
+        layer_geoms.append(geoms)
+        layer_tables.append(df_layer)
+
+    print('Adding spatial joins')
+    layer_pairs = overlay_join_pairs(target_geoms, layer_geoms, [x[2] for x in overlay_layers], workers)
+
+    df_list = [df]
+    null_values = {}
+    for layer, df_layer, (target_rows, join_rows) in zip(overlay_layers, layer_tables, layer_pairs):
+        # Fields already in block groups keep block group values (same as spatial join field map)
+        fields = [x for x in layer[1] if x not in df.columns]
+        concatenate_fields = fields if layer[2] == 'INTERSECT' else None
+        df_joined = pairs_to_attributes(target_rows, join_rows, len(df), df_layer[fields], layer[2],
+                                        concatenate_fields, delimiter='; ', field_length=1000)[fields]
+        if layer[3] is not None:
+            null_values.update({x: layer[3] for x in fields})
+        df_list.append(df_joined)
+    df = pd.concat(df_list, axis=1)
+
+    if len(null_values) > 0:
+        print('Replacing null values')
+        df, rows_touched = replace_null_in_dataframe(df, null_values)
+        print('\t' + str(rows_touched) + ' rows updated')
+
+    if new_column_names:
+        print('Renaming columns')
+        df = df.rename(columns=new_column_names)
+
+    print('Saving output')
+    gis.write_attributes(target_features, output_features, df)
@@ -1,22 +1,58 @@
 # ---------------------------------------------------------------------------
 # fun_block_groups.py
 # Authors: Mariel Sorlien
-# Last updated: 2023-05-05
+# Last updated: 2026-10-17
 # Python 3.7
 #
 # Description: Replace null values
+# All fields are updated in one pass (one cursor for arcpy); only rows with
+# null/blank values are written. Null = None, NaN, '', or ' '.
 # ---------------------------------------------------------------------------
 
-import arcpy
+from functions.gis_backend import get_gis_backend
+from functions.instrumentation import instrument_stage
 
+# fields = list of fields (all get new_text), or dictionary (field: replacement value)
+# backend = GIS backend ('arcpy' or 'geopandas')
+# Returns number of rows changed
 
-def replace_null_in_field(in_table, fields, new_text):
 
-    print('Replacing null values with "' + new_text + '"')
-    for field in fields:
-        print('\tUpdating ' + field)
-        with arcpy.da.UpdateCursor(in_table, field) as cursor:
-            for row in cursor:
-                if row[0] is None or row[0] == '' or row[0] == ' ':
-                    row[0] = new_text
-                cursor.updateRow(row)
+@instrument_stage
+def replace_null_in_field(in_table, fields, new_text=None, backend='arcpy'):
+    gis = get_gis_backend(backend)
+
+    values = null_values_dict(fields, new_text)
+    print('Replacing null values (' + ', '.join(field + ': "' + str(value) + '"'
+                                                for field, value in values.items()) + ')')
+    rows_touched = gis.replace_null_values(in_table, values)
+    print('\t' + str(rows_touched) + ' rows updated')
+    return rows_touched
+
+# --------------------- replace_null_in_dataframe -----------------------------
+# Same as replace_null_in_field, for a dataframe (pandas only, no GIS)
+# Returns (dataframe, number of rows changed)
+
+
+def replace_null_in_dataframe(df, fields, new_text=None):
+    values = null_values_dict(fields, new_text)
+    df = df.copy()
+    rows_touched = None
+    for field, value in values.items():
+        is_null = df[field].isnull() | df[field].isin(['', ' '])
+        print('\tUpdating ' + field + ' (' + str(is_null.sum()) + ' rows)')
+        if is_null.any():
+            df[field] = df[field].astype(object).where(~is_null, value)
+        rows_touched = is_null if rows_touched is None else rows_touched | is_null
+    if rows_touched is None:
+        return df, 0
+    return df, int(rows_touched.sum())
+
+# --------------------- null_values_dict -----------------------------
+
+
+def null_values_dict(fields, new_text=None):
+    if isinstance(fields, dict):
+        return dict(fields)
+    if new_text is None:
+        raise ValueError('new_text is required when fields is a list')
+    return {field: new_text for field in fields}
@@ -0,0 +1,117 @@
+# ---------------------------------------------------------------------------
+# run_stages
+# Last updated: 2026-10-17
+# Authors: Mariel Sorlien
+#
+# Description:
+# Runs pipeline stages in parallel. Each stage lists the stages it needs
+# (inputs); a stage starts as soon as its inputs are done. Results are
+# returned by stage name, so later steps (ex: merges) can use them in a fixed
+# order no matter which stage finished first.
+#
+# NOTE: Use executor='process' for arcpy stages (arcpy is not thread safe). On
+# Windows, worker processes re-import the script that started them, so only
+# use workers > 1 from code that runs under an if __name__ == '__main__' guard.
+# ---------------------------------------------------------------------------
+
+import time
+from concurrent.futures import FIRST_COMPLETED
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import wait
+
+from functions.instrumentation import add_stage_record
+
+# --------------------- run_stages -----------------------------
+# Run stages, return dictionary of results (stage name: result)
+# stages = list of stages (dictionaries):
+#   name = stage name (name of output)
+#   function = stage function
+#   args = arguments for function (list)
+#   kwargs = keyword arguments for function (dictionary; optional)
+#   inputs = names of stages whose results are added to the end of args (list; optional)
+# workers = number of stages to run at once (1 = run in order, no pool)
+# executor = 'process' or 'thread'
+
+
+def run_stages(stages, workers=1, executor='process'):
+    stage_dict = {}
+    for stage in stages:
+        if stage['name'] in stage_dict:
+            raise ValueError('Duplicate stage name: ' + stage['name'])
+        stage_dict[stage['name']] = stage
+    for stage in stages:
+        for input_name in stage.get('inputs', []):
+            if input_name not in stage_dict:
+                raise ValueError('Stage ' + stage['name'] + ' needs missing stage: ' + input_name)
+
+    results = {}
+    start_time = time.perf_counter()
+    if workers == 1:
+        for stage in order_stages(stages):
+            results[stage['name']] = run_stage(stage, results)
+    else:
+        if executor == 'process':
+            pool = ProcessPoolExecutor(max_workers=workers)
+        elif executor == 'thread':
+            pool = ThreadPoolExecutor(max_workers=workers)
+        else:
+            raise ValueError('Unknown executor: ' + str(executor))
+
+        waiting = list(stages)
+        running = {}
+        start_times = {}
+        with pool:
+            while waiting or running:
+                # Start every stage whose inputs are done
+                for stage in list(waiting):
+                    if all(x in results for x in stage.get('inputs', [])):
+                        print('Starting stage: ' + stage['name'])
+                        future = pool.submit(stage['function'], *stage_args(stage, results),
+                                             **stage.get('kwargs', {}))
+                        running[future] = stage['name']
+                        start_times[stage['name']] = time.perf_counter()
+                        waiting.remove(stage)
+                if not running:
+                    raise ValueError('Stages have circular inputs: ' + ', '.join(x['name'] for x in waiting))
+                done, not_done = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    stage_name = running.pop(future)
+                    # Raises error from stage, if any
+                    results[stage_name] = future.result()
+                    print('Finished stage: ' + stage_name)
+                    # Stage details are recorded in the worker process; main process records wall time
+                    add_stage_record(stage_name, time.perf_counter() - start_times[stage_name],
+                                     getattr(results[stage_name], 'shape', [None])[0])
+
+    print('Ran ' + str(len(stages)) + ' stages in ' + str(round(time.perf_counter() - start_time, 1)) + ' s')
+    return results
+
+# --------------------- order_stages -----------------------------
+# Sort stages so each stage comes after its inputs (keeps list order otherwise)
+
+
+def order_stages(stages):
+    ordered = []
+    done = set()
+    waiting = list(stages)
+    while waiting:
+        ready = [x for x in waiting if all(y in done for y in x.get('inputs', []))]
+        if not ready:
+            raise ValueError('Stages have circular inputs: ' + ', '.join(x['name'] for x in waiting))
+        for stage in ready:
+            ordered.append(stage)
+            done.add(stage['name'])
+            waiting.remove(stage)
+    return ordered
+
+# --------------------- run_stage -----------------------------
+
+
+def run_stage(stage, results):
+    print('Running stage: ' + stage['name'])
+    return stage['function'](*stage_args(stage, results), **stage.get('kwargs', {}))
+
+
+def stage_args(stage, results):
+    return list(stage.get('args', [])) + [results[x] for x in stage.get('inputs', [])]
@@ -0,0 +1,299 @@
+# ---------------------------------------------------------------------------
+# simplify_topology
+# Last updated: 2026-10-17
+# Authors: Mariel Sorlien
+#
+# Description:
+# Simplifies polygons (ex: block groups) for display without gaps or overlaps
+# between neighbors, and saves them as TopoJSON for leaflet.
+#   1. Polygon boundaries are split into arcs at junctions (points where 3+
+#      polygons meet); a boundary shared by two polygons is stored once
+#   2. Each arc is simplified once per tolerance (Douglas-Peucker, arc ends
+#      fixed), so both neighbors get the same simplified line. Arcs are
+#      simplified in chunks, on several cores if workers > 1
+#   3. Arcs are quantized (rounded to a grid) and delta encoded (TopoJSON)
+# One TopoJSON file is saved per tolerance (ex: small tolerance for zoomed in
+# maps, large tolerance for zoomed out maps).
+#
+# NOTE: On Windows, worker processes re-import the script that started them.
+# Only use workers > 1 from code that runs under an if __name__ == '__main__' guard.
+# REQUIRES SHAPELY 2; pyproj to save TopoJSON in another coordinate system (ex: 4326 for leaflet)
+# ---------------------------------------------------------------------------
+
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+import shapely
+
+from functions.gis_backend import get_gis_backend
+from functions.instrumentation import instrument_stage
+from functions.instrumentation import stage
+
+# --------------------- simplify_features -----------------------------
+# Simplify polygons at several tolerances, save TopoJSON (one file per tolerance) and/or a feature class
+# in_features = polygons (ex: block_groups_final)
+# tolerances = list of tolerances (coordinate system units, ex: meters)
+# topojson_folder = TopoJSON output folder; files = object_name + '_' + tolerance + 'm.topojson' (None = skip)
+# fields = attribute fields saved with each polygon (None = all fields)
+# out_features = simplified feature class (None = skip)
+# out_tolerance = tolerance used for out_features (must be in tolerances)
+# quantization = TopoJSON grid size (ex: 100000 = coordinates rounded to 1/100000 of map width)
+# crs = coordinate system of in_features geometry (EPSG code, ex: 26919)
+# topojson_crs = coordinate system of TopoJSON (EPSG code, ex: 4326 for leaflet; None = same as crs)
+# workers = number of processes (None = all cores; 1 = no process pool)
+# backend = GIS backend ('arcpy' or 'geopandas')
+# Returns dictionary (tolerance: TopoJSON file)
+
+
+@instrument_stage
+def simplify_features(in_features, tolerances, topojson_folder=None, fields=None, out_features=None,
+                      out_tolerance=None, quantization=100000, crs=None, topojson_crs=4326,
+                      object_name='block_groups', workers=1, backend='arcpy'):
+    if out_features is not None and out_tolerance not in tolerances:
+        raise ValueError('out_tolerance must be in tolerances: ' + str(out_tolerance))
+    gis = get_gis_backend(backend)
+
+    print('Reading features')
+    geoms, df = gis.read_geometries(in_features, fields)
+    print('Building topology')
+    topology = build_topology(geoms)
+    print('\t' + str(len(geoms)) + ' features, ' + str(len(topology['arcs'])) + ' arcs, ' +
+          str(sum(len(x) for x in topology['arcs'])) + ' points')
+
+    to_topojson_crs = None
+    if topojson_folder is not None:
+        os.makedirs(topojson_folder, exist_ok=True)
+        if topojson_crs is not None and topojson_crs != crs:
+            to_topojson_crs = coordinate_transformer(crs, topojson_crs)
+
+    topojson_files = {}
+    for tolerance in tolerances:
+        with stage('tolerance_' + str(tolerance), 'Simplifying (tolerance ' + str(tolerance) + ')'):
+            arcs = simplify_arcs(topology, tolerance, workers)
+            print('\t' + str(sum(len(x) for x in arcs)) + ' points')
+            if topojson_folder is not None:
+                topojson_files[tolerance] = os.path.join(topojson_folder,
+                                                         object_name + '_' + str(tolerance) + 'm.topojson')
+                write_topojson(topojson_files[tolerance], topology, arcs, df, quantization, object_name,
+                               to_topojson_crs)
+            if out_features is not None and tolerance == out_tolerance:
+                print('Saving ' + out_features)
+                gis.write_geometries(out_features, topology_geometries(topology, arcs), df)
+    return topojson_files
+
+# --------------------- build_topology -----------------------------
+# Split polygon boundaries into shared arcs, return dictionary
+#   arcs = list of arcs (array of coordinates); arc ends are junctions
+#   rings = list of rings (list of arc references; ~i = arc i reversed)
+#   ring_offsets, polygon_offsets = rings of each polygon, polygons of each feature (same as shapely ragged arrays)
+# geoms = polygons and multipolygons (array of shapely geometries)
+# Points are matched by exact coordinates (neighbors from the same source share vertices)
+
+
+def build_topology(geoms):
+    parts, part_features = shapely.get_parts(np.asarray(geoms), return_index=True)
+    # Polygons of each feature (features without polygons have none)
+    polygon_offsets = np.r_[0, np.cumsum(np.bincount(part_features, minlength=len(geoms)))]
+    if len(parts) == 0:
+        return {'arcs': [], 'rings': [], 'ring_offsets': np.zeros(1, dtype=np.int64),
+                'polygon_offsets': polygon_offsets}
+    geom_type, coords, (coord_offsets, ring_offsets) = shapely.to_ragged_array(parts)
+
+    # Rings without closing point
+    ring_lengths = np.diff(coord_offsets) - 1
+    keep = np.ones(len(coords), dtype=bool)
+    keep[coord_offsets[1:] - 1] = False
+    coords = coords[keep]
+    ring_starts = np.r_[0, np.cumsum(ring_lengths)[:-1]] if len(ring_lengths) > 0 else np.zeros(0, dtype=int)
+
+    # Point IDs (same coordinates = same ID)
+    point_ids, point_coords = pd.factorize(coords[:, 0] + 1j * coords[:, 1])
+    # Next point in each ring (last point wraps to ring start)
+    ring_of_point = np.repeat(np.arange(len(ring_lengths)), ring_lengths)
+    next_position = np.arange(len(coords)) + 1
+    ring_ends = ring_starts + ring_lengths
+    next_position[ring_ends[ring_lengths > 0] - 1] = ring_starts[ring_lengths > 0]
+    next_ids = point_ids[next_position]
+
+    # Junction = point with more or less than 2 distinct neighbors
+    edges = np.unique(np.sort(np.column_stack([point_ids, next_ids]), axis=1), axis=0)
+    edges = edges[edges[:, 0] != edges[:, 1]]
+    neighbor_count = np.bincount(edges.ravel(), minlength=len(point_coords))
+    is_junction = neighbor_count != 2
+
+    arcs = []
+    arc_keys = {}
+    rings = []
+    junction_positions = np.flatnonzero(is_junction[point_ids])
+    junction_rings = ring_of_point[junction_positions]
+    junction_starts = np.searchsorted(junction_rings, np.arange(len(ring_lengths) + 1))
+    for ring in range(len(ring_lengths)):
+        start = ring_starts[ring]
+        ids = point_ids[start:start + ring_lengths[ring]]
+        cuts = junction_positions[junction_starts[ring]:junction_starts[ring + 1]] - start
+        if len(cuts) == 0:
+            # Ring with no junctions (ex: island): cut at lowest point ID, so shared rings are cut at the same point
+            cuts = np.array([np.argmin(ids)])
+        # Start ring at first junction; each arc runs from one junction to the next
+        order = np.r_[np.arange(cuts[0], len(ids)), np.arange(0, cuts[0] + 1)]
+        ring_ids = ids[order]
+        ring_cuts = np.r_[cuts - cuts[0], len(ids)]
+        ring_arcs = []
+        for arc_start, arc_end in zip(ring_cuts[:-1], ring_cuts[1:]):
+            arc_ids = ring_ids[arc_start:arc_end + 1]
+            # Points between junctions have 2 neighbors, so first 2 points identify the arc
+            key = (arc_ids[0], arc_ids[1])
+            if key not in arc_keys:
+                arc_keys[key] = len(arcs)
+                arc_keys[(arc_ids[-1], arc_ids[-2])] = ~len(arcs)
+                arcs.append(np.column_stack([point_coords.real[arc_ids], point_coords.imag[arc_ids]]))
+            ring_arcs.append(arc_keys[key])
+        rings.append(ring_arcs)
+
+    return {'arcs': arcs, 'rings': rings, 'ring_offsets': ring_offsets, 'polygon_offsets': polygon_offsets}
+
+# --------------------- simplify_arcs -----------------------------
+# Simplify all arcs (ends fixed), return list of arcs
+# Arcs of rings that would collapse (less than 3 points), and of polygons that simplification makes invalid
+# (ex: arcs that cross, hole outside a small polygon), are not simplified. Neighbors share these arcs, so they
+# stay the same too.
+
+
+def simplify_arcs(topology, tolerance, workers=1, chunk_size=20000, max_passes=5):
+    arcs = topology['arcs']
+    chunks = [arcs[x:x + chunk_size] for x in range(0, len(arcs), chunk_size)]
+    if workers is None:
+        workers = os.cpu_count() or 1
+    workers = max(1, min(workers, len(chunks)))
+    if workers == 1:
+        results = [simplify_chunk(x, tolerance) for x in chunks]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(simplify_chunk, chunks, [tolerance] * len(chunks)))
+    simple_arcs = [x for result in results for x in result]
+
+    # Ring points = sum of arc points, minus one shared point per arc
+    arc_points = np.array([len(x) - 1 for x in simple_arcs])
+    collapsed = [ring for ring in topology['rings'] if arc_points[[x if x >= 0 else ~x for x in ring]].sum() < 3]
+    restore_arcs(simple_arcs, arcs, collapsed)
+    if len(collapsed) > 0:
+        print('\t' + str(len(collapsed)) + ' small rings not simplified')
+
+    was_valid = shapely.is_valid(topology_geometries(topology, arcs))
+    ring_offsets = topology['ring_offsets']
+    polygon_offsets = topology['polygon_offsets']
+    for _ in range(max_passes):
+        invalid = np.flatnonzero(was_valid & ~shapely.is_valid(topology_geometries(topology, simple_arcs)))
+        if len(invalid) == 0:
+            break
+        print('\t' + str(len(invalid)) + ' invalid features, not simplified')
+        invalid_rings = [topology['rings'][ring] for feature in invalid
+                         for ring in range(ring_offsets[polygon_offsets[feature]],
+                                           ring_offsets[polygon_offsets[feature + 1]])]
+        restore_arcs(simple_arcs, arcs, invalid_rings)
+    return simple_arcs
+
+
+def restore_arcs(simple_arcs, arcs, rings):
+    for ring in rings:
+        for x in ring:
+            x = x if x >= 0 else ~x
+            simple_arcs[x] = arcs[x]
+
+# --------------------- simplify_chunk -----------------------------
+# Simplify list of arcs (runs in worker process)
+
+
+def simplify_chunk(arcs, tolerance):
+    if len(arcs) == 0:
+        return []
+    lines = shapely.linestrings(np.concatenate(arcs), indices=np.repeat(np.arange(len(arcs)), [len(x) for x in arcs]))
+    # preserve_topology keeps lines from crossing themselves (and closed arcs from collapsing)
+    lines = shapely.simplify(lines, tolerance, preserve_topology=True)
+    coords, line_index = shapely.get_coordinates(lines, return_index=True)
+    return np.split(coords, np.searchsorted(line_index, np.arange(1, len(arcs))))
+
+# --------------------- topology_geometries -----------------------------
+# Rebuild polygons from (simplified) arcs, return array of shapely geometries (multipolygons)
+
+
+def topology_geometries(topology, arcs):
+    ring_coords = []
+    for ring in topology['rings']:
+        parts = [arcs[x] if x >= 0 else arcs[~x][::-1] for x in ring]
+        # Arcs share end points: drop first point of each arc, close ring with first point
+        coords = np.concatenate([parts[0][:1]] + [x[1:] for x in parts])
+        ring_coords.append(coords)
+    coord_offsets = np.r_[0, np.cumsum([len(x) for x in ring_coords])]
+    coords = np.concatenate(ring_coords) if len(ring_coords) > 0 else np.zeros((0, 2))
+    return shapely.from_ragged_array(shapely.GeometryType.MULTIPOLYGON, coords,
+                                     (coord_offsets, topology['ring_offsets'], topology['polygon_offsets']))
+
+# --------------------- write_topojson -----------------------------
+# Save TopoJSON (quantized, delta encoded arcs); one geometry per feature with attributes from df
+# transformer = function (x, y) -> (x, y) for output coordinate system (None = no change)
+
+
+def write_topojson(topojson_file, topology, arcs, df, quantization, object_name, transformer=None):
+    if transformer is not None:
+        arc_lengths = [len(x) for x in arcs]
+        coords = np.concatenate(arcs)
+        x, y = transformer(coords[:, 0], coords[:, 1])
+        arcs = np.split(np.column_stack([x, y]), np.cumsum(arc_lengths)[:-1])
+
+    all_coords = np.concatenate(arcs) if len(arcs) > 0 else np.zeros((1, 2))
+    bbox = np.r_[all_coords.min(axis=0), all_coords.max(axis=0)]
+    scale = (bbox[2:] - bbox[:2]) / (quantization - 1)
+    scale[scale == 0] = 1
+
+    encoded_arcs = []
+    for arc in arcs:
+        points = np.round((arc - bbox[:2]) / scale).astype(np.int64)
+        deltas = np.diff(points, axis=0)
+        # Drop points that round to the previous point (keep at least 2 points)
+        deltas = deltas[(deltas != 0).any(axis=1)]
+        if len(deltas) == 0:
+            deltas = np.zeros((1, 2), dtype=np.int64)
+        encoded_arcs.append(np.vstack([points[:1], deltas]).tolist())
+
+    # Attributes: nulls as null, numpy numbers as python numbers
+    records = df.astype(object).where(df.notnull(), None).to_dict('records')
+    ring_offsets = topology['ring_offsets']
+    polygon_offsets = topology['polygon_offsets']
+    geometries = []
+    for feature in range(len(polygon_offsets) - 1):
+        polygons = []
+        for polygon in range(polygon_offsets[feature], polygon_offsets[feature + 1]):
+            polygons.append([[int(x) for x in topology['rings'][ring]]
+                             for ring in range(ring_offsets[polygon], ring_offsets[polygon + 1])])
+        geometry = {'type': None}
+        if len(polygons) == 1:
+            geometry = {'type': 'Polygon', 'arcs': polygons[0]}
+        elif len(polygons) > 1:
+            geometry = {'type': 'MultiPolygon', 'arcs': polygons}
+        geometry['properties'] = {k: (v.item() if hasattr(v, 'item') else v) for k, v in records[feature].items()}
+        geometries.append(geometry)
+
+    topojson = {
+        'type': 'Topology',
+        'bbox': bbox.tolist(),
+        'transform': {'scale': scale.tolist(), 'translate': bbox[:2].tolist()},
+        'objects': {object_name: {'type': 'GeometryCollection', 'geometries': geometries}},
+        'arcs': encoded_arcs
+    }
+    with open(topojson_file, 'w') as f:
+        json.dump(topojson, f, separators=(',', ':'))
+    print('\tSaved ' + topojson_file + ' (' + str(round(os.path.getsize(topojson_file) / 1024 / 1024, 2)) + ' MB)')
+
+# --------------------- coordinate_transformer -----------------------------
+# Return function (x, y) -> (x, y) from crs to output_crs (EPSG codes)
+
+
+def coordinate_transformer(crs, output_crs):
+    if crs is None:
+        raise ValueError('crs is needed to save TopoJSON in another coordinate system')
+    from pyproj import Transformer
+    return Transformer.from_crs(crs, output_crs, always_xy=True).transform
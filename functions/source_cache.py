@@ -0,0 +1,297 @@
+# ---------------------------------------------------------------------------
+# source_cache
+# Last updated: 2026-10-17
+# Authors: Mariel Sorlien
+#
+# Description:
+# Caches source csv files (EJScreen, CDC PLACES, First Street) as Feather
+# files so each csv is only parsed once. Only the selected columns and states
+# are cached (csv is read in chunks if a memory limit is set). Cached files are
+# memory mapped.
+# REQUIRES PYARROW (falls back to reading the csv if pyarrow is missing)
+#
+# Inspect or purge cache from the command line:
+#   python -m functions.source_cache cache_folder
+#   python -m functions.source_cache cache_folder --purge
+#   python -m functions.source_cache cache_folder --max-mb 2000
+# ---------------------------------------------------------------------------
+
+import argparse
+import glob
+import hashlib
+import json
+import os
+import time
+import uuid
+from contextlib import contextmanager
+
+import pandas as pd
+
+from functions.instrumentation import instrument_stage
+
+# ID columns saved as int64
+key_columns = ['ID', 'GEOID', 'TractFIPS', 'fips', 'Tract_ID']
+manifest_name = 'manifest.json'
+lock_name = 'manifest.lock'
+
+# --------------------- read_source_csv -----------------------------
+# Read csv from cache, add csv to cache if missing or out of date
+# Each cache entry is one csv and one selection (columns, states), saved in its own file. Entries are keyed by
+# file path and selection; they are reused while the file size, modified time, and content hash are unchanged.
+# csv_input = input csv name and location
+# cache_folder = cache folder location
+# columns = columns to import (list; None = all columns)
+# max_cache_mb = if set, deletes least recently used files until cache is smaller than max_cache_mb
+# states = if set, only keeps rows for these states (list)
+# state_column = column in csv input with state names
+# chunk_rows, max_memory_mb = if set, csv is read in chunks when the cache is built (see read_csv_by_state)
+
+
+@instrument_stage
+def read_source_csv(csv_input, cache_folder, columns=None, max_cache_mb=None,
+                    states=None, state_column=None, chunk_rows=None, max_memory_mb=None):
+    try:
+        from pyarrow import feather
+    except ImportError:
+        print('pyarrow not installed, reading csv without cache')
+        return read_csv_selection(csv_input, columns, states, state_column, chunk_rows,
+                                  max_memory_mb)
+
+    os.makedirs(cache_folder, exist_ok=True)
+    csv_path = os.path.abspath(csv_input)
+    csv_stat = os.stat(csv_path)
+    selection = {'columns': columns, 'states': states, 'state_column': state_column}
+    entry_key = csv_path + '|' + hashlib.sha1(json.dumps(selection, sort_keys=True).encode()).hexdigest()[:12]
+
+    # Reuse content hash if file size and modified time are unchanged (any selection of the same csv)
+    with cache_lock(cache_folder):
+        manifest = read_manifest(cache_folder)
+    content_hash = None
+    for other in [manifest.get(entry_key)] + [x for x in manifest.values() if x.get('path') == csv_path]:
+        if other is not None and other['size'] == csv_stat.st_size and other['mtime'] == csv_stat.st_mtime:
+            content_hash = other['hash']
+            break
+    if content_hash is None:
+        print('Hashing csv')
+        content_hash = hash_file(csv_path)
+    # File name from path, selection, and content (never shared by two entries)
+    cache_file = os.path.join(cache_folder, hashlib.sha1((entry_key + content_hash).encode()).hexdigest() + '.feather')
+
+    temp_file = None
+    while True:
+        if temp_file is None and not os.path.exists(cache_file):
+            print('Converting csv to feather (only runs once per csv and selection)')
+            df = read_csv_selection(csv_path, columns, states, state_column, chunk_rows,
+                                    max_memory_mb)
+            # Write to temp file (not locked, other stages can use the cache while the csv is read)
+            temp_file = cache_file + '.' + uuid.uuid4().hex[:8] + '.tmp'
+            feather.write_feather(df.reset_index(drop=True), temp_file, compression='uncompressed')
+            del df
+        elif temp_file is None:
+            print('Reading csv from cache')
+
+        # Manifest is read, updated, and saved by one stage at a time
+        with cache_lock(cache_folder):
+            if temp_file is not None:
+                os.replace(temp_file, cache_file)
+            if os.path.exists(cache_file):
+                manifest = read_manifest(cache_folder)
+                # Drop out of date copy of the same csv and selection
+                entry = manifest.get(entry_key)
+                if entry is not None and entry['file'] != os.path.basename(cache_file):
+                    manifest.pop(entry_key)
+                    remove_unused_file(cache_folder, manifest, entry['file'])
+                manifest[entry_key] = {
+                    'path': csv_path,
+                    'size': csv_stat.st_size,
+                    'mtime': csv_stat.st_mtime,
+                    'hash': content_hash,
+                    'file': os.path.basename(cache_file),
+                    'bytes': os.path.getsize(cache_file),
+                    'last_used': time.time()
+                }
+                if max_cache_mb is not None:
+                    evict_cache(cache_folder, manifest, max_cache_mb, keep=entry_key)
+                write_manifest(cache_folder, manifest)
+                # Memory map feather file (opened before another stage can evict it)
+                table = feather.read_table(cache_file, memory_map=True)
+                break
+        # Cached file was evicted by another stage before it was read, convert csv again
+    return table.to_pandas()
+
+# --------------------- read_csv_selection -----------------------------
+# Read selected columns and states from csv (in chunks if chunk_rows or max_memory_mb is set), ID columns as int64
+
+
+def read_csv_selection(csv_input, columns, states, state_column, chunk_rows, max_memory_mb):
+    # Imported here (add_csv_dataset imports this module)
+    from functions.add_csv_dataset import read_csv_by_state
+
+    if states is not None or chunk_rows is not None or max_memory_mb is not None:
+        if chunk_rows is None and max_memory_mb is None:
+            chunk_rows = 100000
+        df = read_csv_by_state(csv_input, columns, states, state_column, chunk_rows, max_memory_mb)
+    else:
+        df = pd.read_csv(csv_input, sep=",", usecols=columns, low_memory=False)
+    return normalize_key_columns(df)
+
+# --------------------- normalize_key_columns -----------------------------
+# Convert ID columns (key_columns) to int64
+
+
+def normalize_key_columns(df):
+    for col in key_columns:
+        if col in df.columns:
+            values = pd.to_numeric(df[col], errors='coerce')
+            # Leave column as float if any IDs are missing
+            if values.notnull().all():
+                values = values.astype('int64')
+            df[col] = values
+    return df
+
+# --------------------- hash_file -----------------------------
+
+
+def hash_file(file_path):
+    file_hash = hashlib.sha1()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            file_hash.update(block)
+    return file_hash.hexdigest()
+
+# --------------------- evict_cache -----------------------------
+# Delete least recently used files until cache is smaller than max_cache_mb (call with cache_lock held)
+# Also deletes cached files that are not in the manifest (ex: left by a stage that was stopped)
+# keep = manifest entry that is never deleted (file currently in use)
+
+
+def evict_cache(cache_folder, manifest, max_cache_mb, keep=None):
+    remove_orphan_files(cache_folder, manifest)
+    max_bytes = max_cache_mb * 1024 * 1024
+    total_bytes = sum(entry['bytes'] for entry in manifest.values())
+    for entry_key in sorted(manifest, key=lambda x: manifest[x]['last_used']):
+        if total_bytes <= max_bytes:
+            break
+        if entry_key == keep:
+            continue
+        print('\tRemoving ' + manifest[entry_key].get('path', entry_key) + ' from cache')
+        total_bytes -= manifest[entry_key]['bytes']
+        remove_unused_file(cache_folder, manifest, manifest.pop(entry_key)['file'])
+
+# --------------------- purge_cache -----------------------------
+
+
+def purge_cache(cache_folder):
+    with cache_lock(cache_folder):
+        manifest = read_manifest(cache_folder)
+        for entry in manifest.values():
+            remove_cache_file(cache_folder, entry['file'])
+        write_manifest(cache_folder, {})
+        orphan_count = remove_orphan_files(cache_folder, {})
+    print('Removed ' + str(len(manifest) + orphan_count) + ' files from cache')
+
+# --------------------- list_cache -----------------------------
+
+
+def list_cache(cache_folder):
+    manifest = read_manifest(cache_folder)
+    total_bytes = 0
+    for entry_key, entry in sorted(manifest.items(), key=lambda x: x[1]['last_used'], reverse=True):
+        total_bytes += entry['bytes']
+        csv_path = entry.get('path', entry_key)
+        print(entry['file'] + '\t' + str(round(entry['bytes'] / 1024 / 1024, 1)) + ' MB\tlast used ' +
+              time.strftime('%Y-%m-%d %H:%M', time.localtime(entry['last_used'])) + '\t' + csv_path)
+    print('Total: ' + str(len(manifest)) + ' files, ' + str(round(total_bytes / 1024 / 1024, 1)) + ' MB')
+
+# --------------------- manifest helpers -----------------------------
+
+
+def read_manifest(cache_folder):
+    manifest_file = os.path.join(cache_folder, manifest_name)
+    if not os.path.exists(manifest_file):
+        return {}
+    with open(manifest_file) as f:
+        return json.load(f)
+
+
+def write_manifest(cache_folder, manifest):
+    manifest_file = os.path.join(cache_folder, manifest_name)
+    temp_file = manifest_file + '.' + uuid.uuid4().hex[:8] + '.tmp'
+    with open(temp_file, 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(temp_file, manifest_file)
+
+
+def remove_cache_file(cache_folder, file_name):
+    cache_file = os.path.join(cache_folder, file_name)
+    try:
+        os.remove(cache_file)
+    except FileNotFoundError:
+        pass
+    except OSError:
+        # File in use (Windows); deleted later as an orphan file
+        print('\tCould not delete ' + file_name + ' (in use)')
+
+
+def remove_unused_file(cache_folder, manifest, file_name):
+    # Older caches named files by content only (file can be shared by two entries)
+    if not any(x['file'] == file_name for x in manifest.values()):
+        remove_cache_file(cache_folder, file_name)
+
+
+def remove_orphan_files(cache_folder, manifest):
+    # Cached files are added to the manifest in the same lock as they are renamed, so other files are not in use
+    used_files = set(x['file'] for x in manifest.values())
+    orphan_files = [x for x in glob.glob(os.path.join(cache_folder, '*.feather'))
+                    if os.path.basename(x) not in used_files]
+    for orphan_file in orphan_files:
+        remove_cache_file(cache_folder, os.path.basename(orphan_file))
+    return len(orphan_files)
+
+# --------------------- cache_lock -----------------------------
+# Context manager, only one stage (thread or process) at a time holds the lock
+# Lock file is created with O_EXCL (works on Windows and network drives); locks older than stale_s are removed
+
+
+@contextmanager
+def cache_lock(cache_folder, timeout_s=600, stale_s=120):
+    lock_file = os.path.join(cache_folder, lock_name)
+    start_time = time.time()
+    while True:
+        try:
+            lock_fd = os.open(lock_file, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            break
+        except FileExistsError:
+            try:
+                if time.time() - os.path.getmtime(lock_file) > stale_s:
+                    # Lock left by a stage that was stopped
+                    os.remove(lock_file)
+                    continue
+            except OSError:
+                # Lock released or removed by another stage
+                continue
+            if time.time() - start_time > timeout_s:
+                raise TimeoutError('Source cache is locked: ' + lock_file)
+            time.sleep(0.05)
+    try:
+        yield
+    finally:
+        os.close(lock_fd)
+        os.remove(lock_file)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Inspect or purge the source csv cache')
+    parser.add_argument('cache_folder')
+    parser.add_argument('--purge', action='store_true', help='delete all cached files')
+    parser.add_argument('--max-mb', type=float, help='delete least recently used files until cache fits')
+    args = parser.parse_args()
+
+    if args.purge:
+        purge_cache(args.cache_folder)
+    elif args.max_mb is not None:
+        with cache_lock(args.cache_folder):
+            cache_manifest = read_manifest(args.cache_folder)
+            evict_cache(args.cache_folder, cache_manifest, args.max_mb)
+            write_manifest(args.cache_folder, cache_manifest)
+    list_cache(args.cache_folder)
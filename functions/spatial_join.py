@@ -0,0 +1,185 @@
+# ---------------------------------------------------------------------------
+# spatial_join
+# Last updated: 2026-10-17
+# Authors: Mariel Sorlien
+#
+# Description:
+# Spatial join engine (replaces ArcGIS SpatialJoin + FieldMappings for the
+# geopandas backend and for block_group_overlay). Join features are loaded
+# into a packed R-tree (shapely STRtree) once; target features are queried in
+# chunks, on several cores if workers > 1. Overlap areas for LARGEST_OVERLAP are calculated for all
+# candidate pairs at once (vectorized shapely). Several join layers can share
+# one R-tree (overlay_join_pairs), so each target is only queried once.
+#   LARGEST_OVERLAP = attributes of the join feature with the largest overlap
+#   INTERSECT = attributes of the first intersecting join feature; for
+#               concatenate_fields, all values joined with delimiter ('; ')
+#
+# NOTE: On Windows, worker processes re-import the script that started them.
+# Only use workers > 1 from code that runs under an if __name__ == '__main__' guard.
+# REQUIRES SHAPELY 2
+# ---------------------------------------------------------------------------
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+import shapely
+
+# Join features for current process (set once per worker, see init_join_worker)
+worker_data = {}
+
+# --------------------- spatial_join_attributes -----------------------------
+# Join attributes to target geometries, return dataframe (one row per target, in target order)
+# target_geoms = target geometries (array of shapely geometries)
+# join_geoms = join geometries (array of shapely geometries, same coordinate system)
+# df_join = join attributes (one row per join geometry)
+# match_option = 'LARGEST_OVERLAP' or 'INTERSECT'
+# concatenate_fields = fields where all matching values are kept, joined with delimiter (INTERSECT only)
+# field_length = max text length of concatenated fields
+# workers = number of processes (None = all cores; 1 = no process pool)
+# Output includes Join_Count (number of matching join features; max 1 for LARGEST_OVERLAP)
+
+
+def spatial_join_attributes(target_geoms, join_geoms, df_join, match_option, concatenate_fields=None,
+                            delimiter='; ', field_length=1000, workers=1):
+    target_rows, join_rows = spatial_join_pairs(target_geoms, join_geoms, match_option, workers)
+    return pairs_to_attributes(target_rows, join_rows, len(target_geoms), df_join, match_option,
+                               concatenate_fields, delimiter, field_length)
+
+# --------------------- spatial_join_pairs -----------------------------
+# Matching (target row, join row) pairs, sorted by target then join row
+# LARGEST_OVERLAP returns one pair per matched target
+
+
+def spatial_join_pairs(target_geoms, join_geoms, match_option, workers=1, chunk_size=20000):
+    return overlay_join_pairs(target_geoms, [join_geoms], [match_option], workers, chunk_size)[0]
+
+# --------------------- overlay_join_pairs -----------------------------
+# Matching pairs for several join layers at once (one R-tree, one query per target)
+# layer_geoms = list of join geometry arrays (one per layer)
+# match_options = list of match options (one per layer)
+# Returns list of (target rows, join rows) per layer; join rows count from 0 in each layer
+
+
+def overlay_join_pairs(target_geoms, layer_geoms, match_options, workers=1, chunk_size=20000):
+    for match_option in match_options:
+        if match_option not in ['LARGEST_OVERLAP', 'INTERSECT']:
+            raise ValueError('Unknown match option: ' + str(match_option))
+    target_geoms = np.asarray(target_geoms)
+    layer_geoms = [np.asarray(x) for x in layer_geoms]
+    # All layers go in one R-tree; layer code = position in layer_geoms
+    join_geoms = np.concatenate(layer_geoms)
+    layer_codes = np.repeat(np.arange(len(layer_geoms)), [len(x) for x in layer_geoms])
+    chunks = [(x, min(x + chunk_size, len(target_geoms))) for x in range(0, len(target_geoms), chunk_size)]
+    if workers is None:
+        workers = os.cpu_count() or 1
+    workers = max(1, min(workers, len(chunks)))
+    print('\tJoining ' + str(len(target_geoms)) + ' features to ' + str(len(join_geoms)) + ' features (' +
+          ', '.join(match_options) + ', ' + str(workers) + ' workers)')
+
+    chunk_args = [(target_geoms[start:end], start, match_options) for start, end in chunks]
+    if workers == 1:
+        init_join_worker(join_geoms, layer_codes)
+        results = [join_chunk(*args) for args in chunk_args]
+        worker_data.clear()
+    else:
+        # Join features are sent to each worker once, not once per chunk
+        with ProcessPoolExecutor(max_workers=workers, initializer=init_join_worker,
+                                 initargs=(join_geoms, layer_codes)) as executor:
+            results = list(executor.map(join_chunk, *zip(*chunk_args)))
+
+    layer_starts = np.r_[0, np.cumsum([len(x) for x in layer_geoms])]
+    layer_pairs = []
+    for code in range(len(layer_geoms)):
+        if len(results) == 0:
+            layer_pairs.append((np.zeros(0, dtype=np.intp), np.zeros(0, dtype=np.intp)))
+            continue
+        target_rows = np.concatenate([x[code][0] for x in results])
+        join_rows = np.concatenate([x[code][1] for x in results]) - layer_starts[code]
+        layer_pairs.append((target_rows, join_rows))
+    return layer_pairs
+
+# --------------------- init_join_worker -----------------------------
+# Build R-tree of join features (once per process)
+# layer_codes = layer of each join feature (None = all one layer)
+
+
+def init_join_worker(join_geoms, layer_codes=None):
+    worker_data['join_geoms'] = np.asarray(join_geoms)
+    if layer_codes is None:
+        layer_codes = np.zeros(len(worker_data['join_geoms']), dtype=np.intp)
+    worker_data['layer_codes'] = np.asarray(layer_codes)
+    worker_data['tree'] = shapely.STRtree(worker_data['join_geoms'])
+
+# --------------------- join_chunk -----------------------------
+# Find pairs for one chunk of target features (runs in worker process)
+# offset = row number of first target in chunk
+# Returns list of (target rows, join rows) per layer
+
+
+def join_chunk(target_geoms, offset, match_options):
+    target_rows, join_rows = worker_data['tree'].query(target_geoms, predicate='intersects')
+    pair_layers = worker_data['layer_codes'][join_rows]
+    results = []
+    for code, match_option in enumerate(match_options):
+        in_layer = pair_layers == code
+        layer_targets, layer_joins = select_pairs(target_geoms, target_rows[in_layer], join_rows[in_layer],
+                                                  match_option)
+        results.append((layer_targets + offset, layer_joins))
+    return results
+
+# --------------------- select_pairs -----------------------------
+# Sort pairs for one layer by target then join row; LARGEST_OVERLAP keeps largest overlap per target
+
+
+def select_pairs(target_geoms, target_rows, join_rows, match_option):
+    if match_option == 'LARGEST_OVERLAP':
+        # Overlap only needed where a target has more than one candidate (ex: block group on a town line)
+        overlap = np.zeros(len(target_rows))
+        candidates = np.bincount(target_rows, minlength=len(target_geoms))
+        shared = candidates[target_rows] > 1
+        overlap[shared] = shapely.area(shapely.intersection(target_geoms[target_rows[shared]],
+                                                            worker_data['join_geoms'][join_rows[shared]]))
+        # Largest overlap first for each target (ties: lowest join row), keep first
+        order = np.lexsort((join_rows, -overlap, target_rows))
+    else:
+        order = np.lexsort((join_rows, target_rows))
+    target_rows = target_rows[order]
+    join_rows = join_rows[order]
+    if match_option == 'LARGEST_OVERLAP':
+        first = np.ones(len(target_rows), dtype=bool)
+        first[1:] = target_rows[1:] != target_rows[:-1]
+        target_rows = target_rows[first]
+        join_rows = join_rows[first]
+    return target_rows, join_rows
+
+# --------------------- pairs_to_attributes -----------------------------
+
+
+def pairs_to_attributes(target_rows, join_rows, n_targets, df_join, match_option, concatenate_fields=None,
+                        delimiter='; ', field_length=1000):
+    df_pairs = df_join.iloc[join_rows].reset_index(drop=True)
+    df_pairs.index = target_rows
+    # First match per target (pairs are sorted, so first = largest overlap or lowest join row)
+    df_first = df_pairs[~df_pairs.index.duplicated()]
+
+    if match_option == 'INTERSECT':
+        for field in concatenate_fields or []:
+            values = df_pairs[field].dropna().astype(str)
+            # Blank values are skipped
+            values = values[values.str.strip() != '']
+            # Pairs are sorted by target, so each target's values are one slice
+            value_targets = values.index.values
+            starts = np.flatnonzero(np.r_[True, value_targets[1:] != value_targets[:-1]])
+            groups = np.split(values.values.astype(object), starts[1:]) if len(values) > 0 else []
+            joined = pd.Series([delimiter.join(x)[:field_length] for x in groups], index=value_targets[starts],
+                               dtype=object)
+            df_first = df_first.assign(**{field: joined.reindex(df_first.index)})
+
+    df = df_first.reindex(np.arange(n_targets))
+    join_count = np.bincount(target_rows, minlength=n_targets)
+    if match_option == 'LARGEST_OVERLAP':
+        join_count = np.minimum(join_count, 1)
+    df.insert(0, 'Join_Count', join_count)
+    return df.reset_index(drop=True)
@@ -0,0 +1,276 @@
+# ---------------------------------------------------------------------------
+# stage_cache
+# Last updated: 2026-10-17
+# Authors: Mariel Sorlien
+#
+# Description:
+# Caches the output of slow ejmap_step2 stages (zonal statistics, sea level
+# rise intersections, csv imports). Each output is saved under a fingerprint of
+# the stage inputs and parameters. If nothing has changed, the stage is skipped
+# and the cached dataframe is reused. If an input changes, only stages that use
+# that input are rerun.
+# ---------------------------------------------------------------------------
+
+import ast
+import glob
+import hashlib
+import inspect
+import json
+import os
+import uuid
+
+import pandas as pd
+
+from functions.instrumentation import stage
+
+# Feature class fingerprints, reused while the geodatabase files are unchanged
+# (dataset, fields): (geodatabase fingerprint, dataset fingerprint); also saved to memo_name in the cache folder
+gis_fingerprints = {}
+memo_name = 'gis_fingerprints.json'
+
+# --------------------- run_cached_stage -----------------------------
+# Return function(*args, **kwargs), or a cached copy of its output if inputs are unchanged
+# cache_folder = stage cache folder location (None = always run function)
+# stage_name = name of stage, used as subfolder name
+# function = function that returns stage output as a dataframe
+# args = arguments for function (list)
+# inputs = input datasets (list of paths, or (path, fields) for feature classes)
+# params = extra settings that change the output (dictionary)
+# kwargs = arguments for function that do not change the output (ex: memory limits)
+# csv_output = if set, saves copy of output as csv (name and location)
+
+
+def run_cached_stage(cache_folder, stage_name, function, args, inputs, params, kwargs=None, csv_output=None):
+    if kwargs is None:
+        kwargs = {}
+    with stage(stage_name) as record:
+        if cache_folder is None:
+            df = function(*args, **kwargs)
+        else:
+            print('Checking stage cache (' + stage_name + ')')
+            stage_key = fingerprint_stage(function, args, inputs, params, cache_folder)
+            stage_folder = os.path.join(cache_folder, stage_name)
+            # Pickle keeps column dtypes (ex: GEOID stays int64)
+            cache_file = os.path.join(stage_folder, stage_key + '.pkl')
+
+            record['cached'] = os.path.exists(cache_file)
+            if record['cached']:
+                print('\tInputs unchanged, using cached output')
+                df = pd.read_pickle(cache_file)
+            else:
+                print('\tInputs changed or no cached output, running stage')
+                df = function(*args, **kwargs)
+                os.makedirs(stage_folder, exist_ok=True)
+                df.to_pickle(cache_file + '.tmp', compression=None)
+                os.replace(cache_file + '.tmp', cache_file)
+                # Delete out of date outputs for this stage
+                for old_file in glob.glob(os.path.join(stage_folder, '*.pkl')):
+                    if old_file != cache_file:
+                        os.remove(old_file)
+        if csv_output is not None:
+            print('Saving csv')
+            df.to_csv(csv_output, index=False)
+        record['rows'] = len(df)
+    return df
+
+# --------------------- fingerprint_stage -----------------------------
+# Includes the source files of function and the helper modules it uses, so cached outputs are rerun when the code
+# changes
+# memo_folder = folder for saved feature class fingerprints (None = only kept in memory)
+
+
+def fingerprint_stage(function, args, inputs, params, memo_folder=None):
+    stage_info = {
+        'function': function.__module__ + '.' + function.__name__,
+        'source': fingerprint_source(function),
+        'args': repr(args),
+        'params': repr(sorted((params or {}).items())),
+        'inputs': [fingerprint_input(x, memo_folder) for x in inputs]
+    }
+    return hashlib.sha1(json.dumps(stage_info, sort_keys=True).encode()).hexdigest()
+
+# --------------------- fingerprint_source -----------------------------
+# Hash of the module file that defines function and every functions/*.py module it imports (directly or through
+# other helper modules, including imports inside functions)
+
+
+def fingerprint_source(function):
+    function = inspect.unwrap(function)
+    try:
+        source_file = inspect.getsourcefile(function)
+    except TypeError:
+        # Source not available (ex: built-in function)
+        return None
+    if source_file is None:
+        return None
+    source_hash = hashlib.sha1()
+    for module_file in list_source_files(source_file):
+        source_hash.update(os.path.basename(module_file).encode())
+        with open(module_file, 'rb') as f:
+            source_hash.update(hashlib.sha1(f.read()).digest())
+    return source_hash.hexdigest()
+
+
+def list_source_files(source_file):
+    # Follow 'from functions.x import y' / 'import functions.x' statements, and module names in text
+    # (ex: 'functions.gis_arcpy' in gis_backend, imported with importlib)
+    functions_folder = os.path.dirname(os.path.abspath(__file__))
+    found = set()
+    waiting = [os.path.abspath(source_file)]
+    while waiting:
+        module_file = waiting.pop()
+        if module_file in found or not os.path.isfile(module_file):
+            continue
+        found.add(module_file)
+        with open(module_file, 'rb') as f:
+            tree = ast.parse(f.read())
+        for node in ast.walk(tree):
+            if isinstance(node, ast.ImportFrom) and node.level == 0 and node.module is not None:
+                module_names = [node.module]
+            elif isinstance(node, ast.Import):
+                module_names = [x.name for x in node.names]
+            elif isinstance(node, ast.Constant) and isinstance(node.value, str) and '\n' not in node.value:
+                module_names = [node.value]
+            else:
+                continue
+            for module_name in module_names:
+                parts = module_name.split('.')
+                if parts[0] == 'functions' and len(parts) == 2 and parts[1].isidentifier():
+                    waiting.append(os.path.join(functions_folder, parts[1] + '.py'))
+    return sorted(found, key=os.path.basename)
+
+# --------------------- fingerprint_input -----------------------------
+# Files (csv, tif, shp): size and modified time of file and sidecar files
+# Geodatabase feature classes: hash of geometry and selected fields (read with pyogrio if arcpy is missing)
+#   Only hashed again if the geodatabase files change (see gis_fingerprints)
+# Geodatabase rasters: extent, cell size, projection, and raster statistics
+# dataset = path, or (path, fields) for feature classes
+# memo_folder = folder for saved feature class fingerprints (None = only kept in memory)
+
+
+def fingerprint_input(dataset, memo_folder=None):
+    fields = []
+    if isinstance(dataset, (tuple, list)):
+        dataset, fields = dataset
+    if os.path.isfile(dataset):
+        return fingerprint_file(dataset)
+    if '.gdb' in dataset or '.gpkg' in dataset:
+        return fingerprint_gis_dataset(dataset, fields, memo_folder)
+    if os.path.isdir(dataset):
+        return fingerprint_folder(dataset)
+    return [dataset, 'missing']
+
+
+def fingerprint_file(file_path):
+    # Include sidecar files (ex: .dbf, .prj for shapefiles; .aux.xml for rasters)
+    file_list = sorted(glob.glob(glob.escape(os.path.splitext(file_path)[0]) + '.*'))
+    return [[os.path.basename(x), os.path.getsize(x), os.path.getmtime(x)] for x in file_list]
+
+
+def fingerprint_folder(folder_path):
+    file_list = []
+    for root, dirs, files in os.walk(folder_path):
+        for file_name in sorted(files):
+            file_path = os.path.join(root, file_name)
+            file_list.append([os.path.relpath(file_path, folder_path),
+                              os.path.getsize(file_path), os.path.getmtime(file_path)])
+    return sorted(file_list)
+
+
+def fingerprint_gis_dataset(dataset, fields, memo_folder=None):
+    # Geodatabase items are not separate files, so they are fingerprinted by content
+    # Hashing reads every feature; reuse the last fingerprint if the geodatabase has not been modified
+    memo_key = json.dumps([dataset, list(fields)])
+    # Lists (same as values read back from memo file)
+    container_info = json.loads(json.dumps(fingerprint_container(dataset)))
+    if container_info is None:
+        return hash_gis_dataset(dataset, fields)
+
+    if memo_key not in gis_fingerprints and memo_folder is not None:
+        gis_fingerprints.update(read_gis_memo(memo_folder))
+    if memo_key in gis_fingerprints and gis_fingerprints[memo_key][0] == container_info:
+        return gis_fingerprints[memo_key][1]
+
+    info = json.loads(json.dumps(hash_gis_dataset(dataset, fields)))
+    gis_fingerprints[memo_key] = [container_info, info]
+    if memo_folder is not None:
+        save_gis_memo(memo_folder, memo_key, gis_fingerprints[memo_key])
+    return info
+
+
+def read_gis_memo(memo_folder):
+    memo_file = os.path.join(memo_folder, memo_name)
+    if not os.path.exists(memo_file):
+        return {}
+    try:
+        with open(memo_file) as f:
+            return json.load(f)
+    except ValueError:
+        # Unreadable memo file; fingerprints are hashed again
+        return {}
+
+
+def save_gis_memo(memo_folder, memo_key, memo_value):
+    # Reread memo file in case another stage updated it (entry lost to a concurrent write is only hashed again)
+    os.makedirs(memo_folder, exist_ok=True)
+    memo = read_gis_memo(memo_folder)
+    memo[memo_key] = memo_value
+    memo_file = os.path.join(memo_folder, memo_name)
+    temp_file = memo_file + '.' + uuid.uuid4().hex[:8] + '.tmp'
+    with open(temp_file, 'w') as f:
+        json.dump(memo, f)
+    os.replace(temp_file, memo_file)
+
+
+def fingerprint_container(dataset):
+    # Size and modified time of the geodatabase / geopackage / shapefile holding dataset (None = unknown)
+    for extension in ['.gdb', '.gpkg']:
+        if extension in dataset:
+            container = dataset[:dataset.index(extension) + len(extension)]
+            if os.path.isdir(container):
+                return fingerprint_folder(container)
+            if os.path.isfile(container):
+                return fingerprint_file(container)
+    if os.path.isfile(dataset):
+        return fingerprint_file(dataset)
+    return None
+
+
+def hash_gis_dataset(dataset, fields):
+    try:
+        import arcpy
+    except ImportError:
+        return fingerprint_ogr_dataset(dataset, fields)
+
+    desc = arcpy.Describe(dataset)
+    info = [dataset, desc.dataType, desc.extent.JSON, desc.spatialReference.name]
+    if desc.dataType in ['FeatureClass', 'ShapeFile']:
+        print('\tHashing ' + os.path.basename(dataset))
+        row_hash = hashlib.sha1()
+        with arcpy.da.SearchCursor(dataset, ['SHAPE@WKB'] + list(fields)) as cursor:
+            for row in cursor:
+                row_hash.update(bytes(row[0] or b''))
+                row_hash.update(repr(row[1:]).encode())
+        info.append(row_hash.hexdigest())
+    elif desc.dataType in ['RasterDataset', 'RasterBand']:
+        info += [desc.meanCellWidth, desc.meanCellHeight, desc.pixelType]
+        for stat in ['MINIMUM', 'MAXIMUM', 'MEAN', 'STD', 'ROWCOUNT', 'COLUMNCOUNT']:
+            try:
+                info.append(arcpy.management.GetRasterProperties(dataset, stat).getOutput(0))
+            except arcpy.ExecuteError:
+                # Statistics not calculated for raster
+                info.append(None)
+    return info
+
+
+def fingerprint_ogr_dataset(dataset, fields):
+    # Feature classes without ArcGIS (geopandas backend)
+    from functions.gis_geopandas import read_features
+
+    print('\tHashing ' + os.path.basename(dataset))
+    gdf = read_features(dataset, list(fields))
+    row_hash = hashlib.sha1()
+    row_hash.update(b''.join(x or b'' for x in gdf.geometry.to_wkb()))
+    if len(fields) > 0:
+        row_hash.update(pd.util.hash_pandas_object(pd.DataFrame(gdf[list(fields)]), index=False).values.tobytes())
+    return [dataset, 'FeatureClass', gdf.total_bounds.tolist(), str(gdf.crs), row_hash.hexdigest()]
@@ -0,0 +1,122 @@
+# ---------------------------------------------------------------------------
+# tiled_zonal_statistics
+# Last updated: 2026-10-17
+# Authors: Mariel Sorlien
+#
+# Description:
+# Zonal statistics for very large (CONUS) rasters. The zone grid is memory
+# mapped and the value raster is read one tile at a time. Each tile is
+# summarized (count, sum, min, max for the zones in the tile only) in a
+# process pool, then the tile summaries are merged into exact per-GEOID
+# statistics. Only a few tiles are queued at a time, so peak memory depends on
+# tile size and number of workers, not raster size.
+#
+# NOTE: On Windows, worker processes re-import the script that started them.
+# Only use workers > 1 from code that runs under an if __name__ == '__main__' guard.
+# ---------------------------------------------------------------------------
+
+import os
+from concurrent.futures import FIRST_COMPLETED
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import wait
+
+import numpy as np
+
+from functions.instrumentation import instrument_stage
+from functions.zonal_statistics import add_sparse_partials
+from functions.zonal_statistics import empty_partials
+from functions.zonal_statistics import finalize_partials
+from functions.zonal_statistics import sparse_partials
+from functions.zone_index import window_lower_left
+
+# --------------------- tiled_zonal_statistics -----------------------------
+# Calculate zonal statistics tile by tile, return dataframe
+# zone_index = output of get_zone_index
+# value_source = value raster (dictionary):
+#   {'type': 'arcpy', 'path': raster}  -- read with arcpy.RasterToNumPyArray
+#   {'type': 'rasterio', 'path': raster}  -- read with rasterio (no arcpy)
+#   {'type': 'npy', 'path': npy_file}  -- memory mapped numpy grid (same shape as zone grid)
+# tile_size = tile width and height (cells)
+# workers = number of processes (None = all cores; 1 = no process pool)
+# max_value = only cells with values below max_value are used
+# nodata_value = value raster null value
+
+
+@instrument_stage
+def tiled_zonal_statistics(zone_index, value_source, tile_size=4096, workers=None,
+                           max_value=101, nodata_value=255):
+    grid = zone_index['grid']
+    n_zones = len(zone_index['zone_lookup'])
+    tiles = list_tiles(grid, tile_size)
+    if workers is None:
+        workers = os.cpu_count() or 1
+    workers = max(1, min(workers, len(tiles)))
+    print('Calculating zonal statistics (' + str(len(tiles)) + ' tiles, ' + str(workers) + ' workers)')
+
+    partials = empty_partials(n_zones)
+    if workers == 1:
+        for tile in tiles:
+            add_sparse_partials(partials, zonal_tile(zone_index['zones_path'], value_source, grid, tile, max_value,
+                                                     nodata_value))
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            # Submit a few tiles per worker at a time; tile summaries are merged as they are returned
+            waiting = list(reversed(tiles))
+            running = set()
+            while waiting or running:
+                while waiting and len(running) < 2 * workers:
+                    running.add(executor.submit(zonal_tile, zone_index['zones_path'], value_source, grid,
+                                                waiting.pop(), max_value, nodata_value))
+                done, running = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    add_sparse_partials(partials, future.result())
+
+    return finalize_partials(partials, zone_index['zone_lookup'])
+
+# --------------------- list_tiles -----------------------------
+# Split grid into tiles (row, col, nrows, ncols)
+
+
+def list_tiles(grid, tile_size):
+    tiles = []
+    for row in range(0, grid['nrows'], tile_size):
+        for col in range(0, grid['ncols'], tile_size):
+            tiles.append((row, col, min(tile_size, grid['nrows'] - row), min(tile_size, grid['ncols'] - col)))
+    return tiles
+
+# --------------------- zonal_tile -----------------------------
+# Summarize one tile (runs in worker process), return sparse_partials for zones in tile
+
+
+def zonal_tile(zones_path, value_source, grid, tile, max_value, nodata_value):
+    row, col, nrows, ncols = tile
+    zones = np.load(zones_path, mmap_mode='r')[row:row + nrows, col:col + ncols]
+    # Skip tiles with no block groups (ex: ocean)
+    if not zones.any():
+        return sparse_partials(np.zeros(0, dtype=np.int32), np.zeros(0))
+    values = read_value_tile(value_source, grid, tile, nodata_value)
+    return sparse_partials(zones, values, max_value, nodata_value)
+
+# --------------------- read_value_tile -----------------------------
+
+
+def read_value_tile(value_source, grid, tile, nodata_value):
+    row, col, nrows, ncols = tile
+    if value_source['type'] == 'npy':
+        values = np.load(value_source['path'], mmap_mode='r')
+        return np.asarray(values[row:row + nrows, col:col + ncols])
+
+    x, y = window_lower_left(grid, row, col, nrows)
+    if value_source['type'] == 'arcpy':
+        import arcpy
+        lower_left = arcpy.Point(x, y)
+        return arcpy.RasterToNumPyArray(value_source['path'], lower_left, ncols, nrows,
+                                        nodata_to_value=nodata_value)
+    if value_source['type'] == 'rasterio':
+        import rasterio
+        from rasterio.windows import from_bounds
+        with rasterio.open(value_source['path']) as src:
+            window = from_bounds(x, y, x + ncols * grid['cell_width'], y + nrows * grid['cell_height'],
+                                 src.transform).round_offsets().round_lengths()
+            return src.read(1, window=window, boundless=True, fill_value=nodata_value)
+    raise ValueError('Unknown value source type: ' + str(value_source['type']))
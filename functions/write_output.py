@@ -0,0 +1,96 @@
+# ---------------------------------------------------------------------------
+# write_output
+# Last updated: 2026-10-17
+# Authors: Mariel Sorlien
+#
+# Description:
+# Writes block group geometry with an attribute dataframe in one pass
+# (replaces CopyFeatures + KEEP_FIELDS + temp_ID + JoinField to a csv).
+# Rows are matched on GEOID in memory (hash join), then geometry and all
+# fields are written at once:
+#   'feature_class' = feature class / shapefile / geopackage layer (GIS backend)
+#   'geoparquet' = GeoParquet file (columnar; REQUIRES GEOPANDAS, PYARROW)
+# ---------------------------------------------------------------------------
+
+import pandas as pd
+
+from functions.gis_backend import get_gis_backend
+from functions.instrumentation import instrument_stage
+
+output_formats = ['feature_class', 'geoparquet']
+
+# --------------------- write_joined_features -----------------------------
+# Copy geometries of in_features to out_features; fields = key field of in_features + all other columns of df
+# Same output as copying in_features, keeping key field, and joining a csv of df with JoinField
+# in_features = features with geometry (ex: block groups); only key field is read
+# df = attribute dataframe (ex: block group data)
+# key_field = join field in both in_features and df (ex: 'GEOID')
+# null_value = replaces nulls in df (ex: -999999, same as csv output; None = keep nulls)
+# numeric_keys = if True, matches keys as numbers (ex: GEOID text field to int64 GEOID)
+# output_format = 'feature_class' or 'geoparquet' (out_features = .parquet file)
+# crs = coordinate system for geoparquet (EPSG code, ex: 26919; None = unknown)
+# backend = GIS backend ('arcpy' or 'geopandas')
+# Features without a match in df get null values (same as JoinField)
+
+
+@instrument_stage
+def write_joined_features(in_features, out_features, df, key_field, null_value=None, numeric_keys=True,
+                          output_format='feature_class', crs=None, backend='arcpy'):
+    if output_format not in output_formats:
+        raise ValueError('Unknown output format: ' + str(output_format))
+    gis = get_gis_backend(backend)
+
+    if null_value is not None:
+        df = fill_null_values(df, null_value)
+
+    print('Reading ' + key_field)
+    if output_format == 'geoparquet':
+        geoms, df_keys = gis.read_geometries(in_features, [key_field])
+    else:
+        # Feature order (same as write_attributes)
+        df_keys = gis.read_table(in_features, [key_field])
+
+    print('Joining ' + str(len(df.columns) - 1) + ' fields on ' + key_field)
+    df_join = join_attributes(df_keys[key_field], df, key_field, numeric_keys)
+    df_out = pd.concat([df_keys[[key_field]].reset_index(drop=True), df_join], axis=1)
+
+    print('Writing ' + str(len(df_out)) + ' features')
+    if output_format == 'geoparquet':
+        import geopandas as gpd
+        gdf = gpd.GeoDataFrame(df_out, geometry=geoms, crs=crs)
+        gdf.to_parquet(out_features, index=False)
+    else:
+        gis.write_attributes(in_features, out_features, df_out)
+    return df_out
+
+# --------------------- join_attributes -----------------------------
+# Match df rows to keys, return dataframe (one row per key, in key order; key_field dropped)
+# Only first match is used (same as ArcGIS); fields are null where key has no match
+
+
+def join_attributes(keys, df, key_field, numeric_keys=True):
+    join_keys = df[key_field]
+    if numeric_keys is True:
+        keys = pd.to_numeric(keys, errors='coerce').astype('Int64')
+        join_keys = pd.to_numeric(join_keys, errors='coerce').astype('Int64')
+    df_join = df.drop(columns=key_field)
+    df_join.index = join_keys.values
+    df_join = df_join[~df_join.index.duplicated()]
+    df_join = df_join.reindex(keys.values)
+    return df_join.reset_index(drop=True)
+
+# --------------------- fill_null_values -----------------------------
+# Replace nulls (numeric fields: null_value, text fields: null_value as text), return copy of df
+# Same values as a csv saved with na_rep=null_value
+
+
+def fill_null_values(df, null_value):
+    df = df.copy()
+    for column in df.columns:
+        if not df[column].isnull().any():
+            continue
+        if pd.api.types.is_numeric_dtype(df[column]):
+            df[column] = df[column].fillna(null_value)
+        else:
+            df[column] = df[column].astype(object).fillna(str(null_value))
+    return df
@@ -0,0 +1,156 @@
+# ---------------------------------------------------------------------------
+# zonal_statistics
+# Last updated: 2026-10-17
+# Authors: Mariel Sorlien
+#
+# Description:
+# Pure numpy zonal statistics (replaces ExtractByAttributes +
+# ZonalStatisticsAsTable). Takes a zone ID grid and a value grid of the same
+# shape, calculates count, mean, min, max, and std per zone in one pass.
+# Cells with value >= max_value (NLCD null data) are skipped in the same pass.
+# ---------------------------------------------------------------------------
+
+import numpy as np
+import pandas as pd
+
+# --------------------- zonal_statistics -----------------------------
+# Calculate zonal statistics, return dataframe (same columns as ZonalStatisticsAsTable)
+# zones = zone ID grid (numpy array of int; 0 = outside all zones)
+# values = value grid (numpy array, same shape as zones)
+# zone_lookup = array of GEOIDs, indexed by zone ID (zone_lookup[zone_id] = GEOID)
+# max_value = only cells with values below max_value are used (None = use all cells)
+# nodata_value = value grid null value (None = no null value)
+
+
+def zonal_statistics(zones, values, zone_lookup, max_value=101, nodata_value=None):
+    partials = zonal_partials(zones, values, len(zone_lookup), max_value, nodata_value)
+    return finalize_partials(partials, zone_lookup)
+
+# --------------------- zonal_partials -----------------------------
+# Count, sum, sum of squares, min, max per zone (can be merged across tiles)
+# n_zones = number of zone IDs (max zone ID + 1)
+
+
+def zonal_partials(zones, values, n_zones, max_value=101, nodata_value=None):
+    zones = np.asarray(zones).ravel()
+    values = np.asarray(values).ravel()
+
+    # Skip cells outside zones and null data cells
+    mask = zones > 0
+    if max_value is not None:
+        mask &= values < max_value
+    if nodata_value is not None:
+        mask &= values != nodata_value
+    if values.dtype.kind == 'f':
+        mask &= ~np.isnan(values)
+    zone_cells = zones[mask].astype(np.intp)
+    value_cells = values[mask].astype(np.float64)
+
+    partials = {
+        'count': np.bincount(zone_cells, minlength=n_zones).astype(np.int64),
+        'sum': np.bincount(zone_cells, weights=value_cells, minlength=n_zones),
+        'sumsq': np.bincount(zone_cells, weights=value_cells * value_cells, minlength=n_zones),
+        'min': np.full(n_zones, np.inf),
+        'max': np.full(n_zones, -np.inf)
+    }
+    np.minimum.at(partials['min'], zone_cells, value_cells)
+    np.maximum.at(partials['max'], zone_cells, value_cells)
+    return partials
+
+# --------------------- sparse_partials -----------------------------
+# Count, sum, sum of squares, min, max for zones in one tile only (zones = zone IDs in tile)
+# Size depends on the number of zones in the tile, not the total number of zones (sent between processes)
+
+
+def sparse_partials(zones, values, max_value=101, nodata_value=None):
+    zones = np.asarray(zones).ravel()
+    values = np.asarray(values).ravel()
+
+    # Skip cells outside zones and null data cells
+    mask = zones > 0
+    if max_value is not None:
+        mask &= values < max_value
+    if nodata_value is not None:
+        mask &= values != nodata_value
+    if values.dtype.kind == 'f':
+        mask &= ~np.isnan(values)
+    tile_zones, zone_cells = np.unique(zones[mask], return_inverse=True)
+    value_cells = values[mask].astype(np.float64)
+
+    partials = {
+        'zones': tile_zones.astype(np.intp),
+        'count': np.bincount(zone_cells, minlength=len(tile_zones)).astype(np.int64),
+        'sum': np.bincount(zone_cells, weights=value_cells, minlength=len(tile_zones)),
+        'sumsq': np.bincount(zone_cells, weights=value_cells * value_cells, minlength=len(tile_zones)),
+        'min': np.full(len(tile_zones), np.inf),
+        'max': np.full(len(tile_zones), -np.inf)
+    }
+    np.minimum.at(partials['min'], zone_cells, value_cells)
+    np.maximum.at(partials['max'], zone_cells, value_cells)
+    return partials
+
+# --------------------- empty_partials, add_sparse_partials -----------------------------
+# Zonal partials for n_zones zones with no cells; add sparse_partials of one tile (in place)
+
+
+def empty_partials(n_zones):
+    return {
+        'count': np.zeros(n_zones, dtype=np.int64),
+        'sum': np.zeros(n_zones),
+        'sumsq': np.zeros(n_zones),
+        'min': np.full(n_zones, np.inf),
+        'max': np.full(n_zones, -np.inf)
+    }
+
+
+def add_sparse_partials(partials, tile_partials):
+    tile_zones = tile_partials['zones']
+    np.add.at(partials['count'], tile_zones, tile_partials['count'])
+    np.add.at(partials['sum'], tile_zones, tile_partials['sum'])
+    np.add.at(partials['sumsq'], tile_zones, tile_partials['sumsq'])
+    np.minimum.at(partials['min'], tile_zones, tile_partials['min'])
+    np.maximum.at(partials['max'], tile_zones, tile_partials['max'])
+    return partials
+
+# --------------------- merge_partials -----------------------------
+# Combine zonal_partials from several tiles into one
+
+
+def merge_partials(partials_list):
+    merged = None
+    for partials in partials_list:
+        if merged is None:
+            merged = {key: value.copy() for key, value in partials.items()}
+            continue
+        merged['count'] += partials['count']
+        merged['sum'] += partials['sum']
+        merged['sumsq'] += partials['sumsq']
+        np.minimum(merged['min'], partials['min'], out=merged['min'])
+        np.maximum(merged['max'], partials['max'], out=merged['max'])
+    return merged
+
+# --------------------- finalize_partials -----------------------------
+# Convert partials to zonal statistics table (zones with no data are dropped)
+
+
+def finalize_partials(partials, zone_lookup):
+    count = partials['count']
+    has_data = count > 0
+    # Zone ID 0 is "outside all zones"
+    has_data[0] = False
+
+    count = count[has_data]
+    mean = partials['sum'][has_data] / count
+    # Population standard deviation (same as ArcGIS)
+    variance = partials['sumsq'][has_data] / count - mean * mean
+    std = np.sqrt(np.maximum(variance, 0))
+
+    df = pd.DataFrame({
+        'GEOID': np.asarray(zone_lookup)[has_data],
+        'COUNT': count,
+        'MEAN': mean,
+        'MIN': partials['min'][has_data],
+        'MAX': partials['max'][has_data],
+        'STD': std
+    })
+    return df
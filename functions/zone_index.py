@@ -0,0 +1,227 @@
+# ---------------------------------------------------------------------------
+# zone_index
+# Last updated: 2026-10-17
+# Authors: Mariel Sorlien
+#
+# Description:
+# Rasterizes block groups once on a raster grid (ex: NLCD) and saves the zone
+# ID grid (.npy, memory mapped on reuse) and a zone ID to GEOID lookup table.
+# Every raster on the same grid (tree canopy, impervious surface, other NLCD
+# years) reuses the same zone index. The index is only rebuilt if block group
+# geometry or the raster grid changes.
+# Index is built with arcpy, or with rasterio + geopandas (backend='geopandas').
+# ---------------------------------------------------------------------------
+
+import hashlib
+import json
+import os
+import shutil
+import uuid
+
+import numpy as np
+import pandas as pd
+
+from functions.instrumentation import instrument_stage
+from functions.read_table import read_table
+from functions.source_cache import normalize_key_columns
+from functions.stage_cache import fingerprint_gis_dataset
+
+# --------------------- get_zone_index -----------------------------
+# Load zone index for block groups on raster grid, build index if missing
+# gis_block_groups = block group feature class
+# raster_input = raster that sets grid (cell size, alignment, projection)
+# index_folder = zone index folder location
+# backend = GIS backend ('arcpy' or 'geopandas')
+# Returns dictionary:
+#   zones = zone ID grid (memory mapped numpy array; 0 = outside block groups)
+#   zones_path = zone ID grid file (.npy)
+#   zone_lookup = array of GEOIDs, indexed by zone ID
+#   grid = grid info (xmin, ymin, cell_width, cell_height, ncols, nrows)
+
+
+@instrument_stage
+def get_zone_index(gis_block_groups, raster_input, index_folder, backend='arcpy'):
+    index_key = zone_index_key(gis_block_groups, raster_input, backend, index_folder)
+    index_path = os.path.join(index_folder, index_key)
+
+    if not os.path.exists(os.path.join(index_path, 'grid.json')):
+        print('Building zone index (only runs when block groups or raster grid change)')
+        # Build in temp folder, then rename (another stage may be building the same index)
+        temp_path = index_path + '_' + uuid.uuid4().hex[:8]
+        if backend == 'arcpy':
+            build_zone_index(gis_block_groups, raster_input, temp_path)
+        else:
+            build_zone_index_rasterio(gis_block_groups, raster_input, temp_path)
+        try:
+            os.rename(temp_path, index_path)
+        except OSError:
+            # Index was saved by another stage first
+            shutil.rmtree(temp_path, ignore_errors=True)
+    else:
+        print('Using saved zone index')
+    return load_zone_index(index_path)
+
+# --------------------- zone_index_key -----------------------------
+# Fingerprint of block group geometry + raster grid (not raster values)
+# index_folder = if set, block group fingerprint is saved here and reused while the geodatabase is unchanged
+
+
+def zone_index_key(gis_block_groups, raster_input, backend='arcpy', index_folder=None):
+    if backend == 'arcpy':
+        import arcpy
+
+        raster_desc = arcpy.Describe(raster_input)
+        grid_info = [
+            raster_desc.extent.JSON,
+            raster_desc.meanCellWidth,
+            raster_desc.meanCellHeight,
+            raster_desc.spatialReference.exportToString()
+        ]
+    else:
+        import rasterio
+
+        with rasterio.open(raster_input) as src:
+            grid_info = [list(src.bounds), src.res[0], src.res[1], src.crs.to_wkt()]
+    bg_info = fingerprint_gis_dataset(gis_block_groups, ['GEOID'], index_folder)[1:]
+    key_info = json.dumps([bg_info, grid_info], sort_keys=True)
+    return hashlib.sha1(key_info.encode()).hexdigest()
+
+# --------------------- build_zone_index -----------------------------
+
+
+def build_zone_index(gis_block_groups, raster_input, index_path):
+    import arcpy
+
+    os.makedirs(index_path, exist_ok=True)
+    temp_zones = arcpy.env.scratchFolder + '/temp_zones_' + uuid.uuid4().hex[:8] + '.tif'
+    spatial_ref = arcpy.Describe(raster_input).spatialReference
+    oid_field = arcpy.Describe(gis_block_groups).OIDFieldName
+    # Block group extent in raster coordinate system
+    bg_extent = arcpy.Describe(gis_block_groups).extent.projectAs(spatial_ref)
+
+    print('\tRasterizing block groups')
+    with arcpy.EnvManager(outputCoordinateSystem=spatial_ref, snapRaster=raster_input,
+                          extent=bg_extent, cellSize=raster_input):
+        arcpy.conversion.PolygonToRaster(in_features=gis_block_groups,
+                                         value_field=oid_field,
+                                         out_rasterdataset=temp_zones,
+                                         cell_assignment='CELL_CENTER')
+    zone_raster = arcpy.Raster(temp_zones)
+    grid = {
+        'xmin': zone_raster.extent.XMin,
+        'ymin': zone_raster.extent.YMin,
+        'cell_width': zone_raster.meanCellWidth,
+        'cell_height': zone_raster.meanCellHeight,
+        'ncols': zone_raster.width,
+        'nrows': zone_raster.height
+    }
+
+    print('\tSaving zone grid')
+    # Copy in blocks of rows so large (CONUS) grids are never fully in memory
+    zones = np.lib.format.open_memmap(os.path.join(index_path, 'zones.npy'), mode='w+', dtype=np.int32,
+                                      shape=(grid['nrows'], grid['ncols']))
+    block_rows = max(1, 2 ** 26 // grid['ncols'])
+    for row in range(0, grid['nrows'], block_rows):
+        nrows = min(block_rows, grid['nrows'] - row)
+        lower_left = arcpy.Point(*window_lower_left(grid, row, 0, nrows))
+        zones[row:row + nrows] = arcpy.RasterToNumPyArray(zone_raster, lower_left, grid['ncols'], nrows,
+                                                          nodata_to_value=0)
+    zones.flush()
+    del zones
+
+    print('\tSaving GEOID lookup table')
+    df_lookup = normalize_key_columns(read_table(gis_block_groups, [oid_field, 'GEOID']))
+    df_lookup = df_lookup.rename(columns={oid_field: 'ZONE_ID'})
+    df_lookup.to_csv(os.path.join(index_path, 'lookup.csv'), index=False)
+
+    # Save grid last (marks index as complete)
+    with open(os.path.join(index_path, 'grid.json'), 'w') as f:
+        json.dump(grid, f, indent=2)
+    del zone_raster
+    arcpy.management.Delete(temp_zones)
+
+# --------------------- build_zone_index_rasterio -----------------------------
+# Same output as build_zone_index, without arcpy (cell center rule, same as PolygonToRaster)
+
+
+def build_zone_index_rasterio(gis_block_groups, raster_input, index_path):
+    import rasterio
+    from rasterio import features
+    from rasterio import windows
+    from shapely.geometry import box
+    from functions.gis_geopandas import read_features
+
+    os.makedirs(index_path, exist_ok=True)
+    with rasterio.open(raster_input) as src:
+        transform = src.transform
+        raster_crs = src.crs
+    gdf = read_features(gis_block_groups, ['GEOID']).to_crs(raster_crs)
+    # Zone ID = row number + 1 (0 = outside block groups)
+    zone_ids = np.arange(1, len(gdf) + 1, dtype=np.int32)
+
+    # Block group extent, snapped to raster grid
+    window = windows.from_bounds(*gdf.total_bounds, transform=transform)
+    window = window.round_offsets(op='floor').round_lengths(op='ceil')
+    window_transform = windows.transform(window, transform)
+    grid = {
+        'xmin': window_transform.c,
+        'ymin': window_transform.f + window.height * window_transform.e,
+        'cell_width': window_transform.a,
+        'cell_height': -window_transform.e,
+        'ncols': int(window.width),
+        'nrows': int(window.height)
+    }
+
+    print('\tRasterizing block groups')
+    # Rasterize in blocks of rows so large (CONUS) grids are never fully in memory
+    zones = np.lib.format.open_memmap(os.path.join(index_path, 'zones.npy'), mode='w+', dtype=np.int32,
+                                      shape=(grid['nrows'], grid['ncols']))
+    block_rows = max(1, 2 ** 26 // grid['ncols'])
+    for row in range(0, grid['nrows'], block_rows):
+        nrows = min(block_rows, grid['nrows'] - row)
+        x, y = window_lower_left(grid, row, 0, nrows)
+        block_bounds = (x, y, x + grid['ncols'] * grid['cell_width'], y + nrows * grid['cell_height'])
+        # Only block groups that overlap this block of rows
+        rows = gdf.sindex.query(box(*block_bounds))
+        if len(rows) == 0:
+            continue
+        zones[row:row + nrows] = features.rasterize(
+            zip(gdf.geometry.values[rows], zone_ids[rows]),
+            out_shape=(nrows, grid['ncols']),
+            transform=rasterio.transform.from_bounds(*block_bounds, grid['ncols'], nrows),
+            fill=0,
+            dtype=np.int32)
+    zones.flush()
+    del zones
+
+    print('\tSaving GEOID lookup table')
+    df_lookup = normalize_key_columns(pd.DataFrame({'ZONE_ID': zone_ids, 'GEOID': gdf['GEOID'].values}))
+    df_lookup.to_csv(os.path.join(index_path, 'lookup.csv'), index=False)
+
+    # Save grid last (marks index as complete)
+    with open(os.path.join(index_path, 'grid.json'), 'w') as f:
+        json.dump(grid, f, indent=2)
+
+# --------------------- load_zone_index -----------------------------
+
+
+def load_zone_index(index_path):
+    with open(os.path.join(index_path, 'grid.json')) as f:
+        grid = json.load(f)
+    zones_path = os.path.join(index_path, 'zones.npy')
+    zones = np.load(zones_path, mmap_mode='r')
+
+    df_lookup = pd.read_csv(os.path.join(index_path, 'lookup.csv'))
+    zone_lookup = np.zeros(max(df_lookup['ZONE_ID'].max(), 0) + 1, dtype=np.int64)
+    zone_lookup[df_lookup['ZONE_ID'].values] = df_lookup['GEOID'].values
+
+    return {'zones': zones, 'zones_path': zones_path, 'zone_lookup': zone_lookup, 'grid': grid}
+
+# --------------------- window_lower_left -----------------------------
+# Map coordinates of lower left corner of a grid window (row 0 = top row)
+
+
+def window_lower_left(grid, row, col, nrows):
+    x = grid['xmin'] + col * grid['cell_width']
+    y = grid['ymin'] + (grid['nrows'] - row - nrows) * grid['cell_height']
+    return x, y
@@ -0,0 +1,39 @@
+# ---------------------------------------------------------------------------
+# test_add_csv_dataset
+# Last updated: 2026-10-17
+# Authors: Mariel Sorlien
+#
+# Description:
+# Checks the chunked, state-filtered csv reader (read_csv_by_state)
+# ---------------------------------------------------------------------------
+
+import pandas as pd
+
+from functions.add_csv_dataset import read_csv_by_state
+
+column_list = ['ID', 'STATE_NAME', 'PM25']
+states = ['Rhode Island', 'Connecticut']
+
+
+def test_chunks_match_full_read(tmp_path):
+    csv_path = tmp_path / 'epa.csv'
+    df = pd.DataFrame({'ID': range(25), 'STATE_NAME': ['Rhode Island', 'Maine', 'Connecticut', 'Maine', 'Texas'] * 5,
+                       'PM25': [x / 10 for x in range(25)], 'EXTRA': 1})
+    df.to_csv(csv_path, index=False)
+
+    expected = df.loc[df['STATE_NAME'].isin(states), column_list].reset_index(drop=True)
+    for chunk_rows in [1, 4, 100]:
+        result = read_csv_by_state(csv_path, column_list, states, 'STATE_NAME', chunk_rows=chunk_rows)
+        pd.testing.assert_frame_equal(result, expected)
+    result = read_csv_by_state(csv_path, column_list, states, 'STATE_NAME', max_memory_mb=1)
+    pd.testing.assert_frame_equal(result, expected)
+
+
+def test_header_only(tmp_path):
+    csv_path = tmp_path / 'empty.csv'
+    csv_path.write_text('ID,STATE_NAME,PM25\n')
+    result = read_csv_by_state(csv_path, column_list, states, 'STATE_NAME', chunk_rows=10)
+    assert len(result) == 0
+    assert list(result.columns) == column_list
+    result = read_csv_by_state(csv_path, column_list, states, 'STATE_NAME', max_memory_mb=1)
+    assert len(result) == 0
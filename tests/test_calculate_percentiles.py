@@ -0,0 +1,105 @@
+# ---------------------------------------------------------------------------
+# test_calculate_percentiles
+# Last updated: 2026-10-17
+# Authors: Mariel Sorlien
+#
+# Description:
+# Checks calculate_percentiles against the original metric x state loop
+# from ejmap_step2 (ties, nulls, inverse metrics, rows outside state_list,
+# rows outside the study area).
+# ---------------------------------------------------------------------------
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from functions.calculate_percentiles import calculate_percentiles
+
+state_list = ['Rhode Island', 'Connecticut']
+metrics = ['PM25', 'OZONE', 'TREE']
+inverse_metrics = ['TREE']
+
+# --------------------- original_percentiles -----------------------------
+# Original ejmap_step2 loop (one metric and one state at a time)
+
+
+def original_percentiles(df_bg, all_metrics, states, study_area_rows):
+    df_bg = df_bg.copy()
+    if study_area_rows is not None:
+        df_study_area = df_bg.loc[study_area_rows]
+    for col in all_metrics:
+        n_col = 'N_' + col
+        p_col = 'P_' + col
+        pct_ascending = col not in inverse_metrics
+        df_bg[['p_temp', p_col, n_col]] = [0, 0, 0]
+
+        if states is not None:
+            for state in states:
+                df_temp = df_bg.loc[df_bg['State'] == state]
+                df_bg['p_temp'] = df_temp[col].rank(pct=True, ascending=pct_ascending)
+                df_bg['p_temp'] = df_bg['p_temp'].fillna(0)
+                df_bg['p_temp'] = np.trunc(100 * df_bg['p_temp'])
+                df_bg[p_col] += df_bg['p_temp']
+            df_bg[p_col] = np.where(df_bg[col].isnull(), np.nan, df_bg[p_col])
+
+        if study_area_rows is not None:
+            df_bg[n_col] = df_study_area[col].rank(pct=True, ascending=pct_ascending)
+            df_bg[n_col] = np.trunc(100 * df_bg[n_col])
+    return df_bg[['P_' + x for x in all_metrics] + ['N_' + x for x in all_metrics]]
+
+# --------------------- block_groups -----------------------------
+# Synthetic block groups: repeated values (ties), nulls, a state outside state_list
+
+
+def block_groups(seed=0, n_rows=300):
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame({
+        'State': rng.choice(state_list + ['Massachusetts'], n_rows),
+        # Few distinct values, so many ties
+        'PM25': rng.integers(0, 10, n_rows).astype(float),
+        'OZONE': rng.random(n_rows),
+        'TREE': rng.integers(0, 5, n_rows).astype(float)
+    })
+    for col in metrics:
+        df.loc[rng.random(n_rows) < 0.1, col] = np.nan
+    return df
+
+
+@pytest.mark.parametrize('use_states', [True, False])
+@pytest.mark.parametrize('use_study_area', [True, False])
+def test_matches_original_loop(use_states, use_study_area):
+    df = block_groups()
+    states = state_list if use_states else None
+    study_area_rows = None
+    if use_study_area:
+        study_area_rows = pd.Series(np.arange(len(df)) % 3 == 0, index=df.index)
+
+    expected = original_percentiles(df, metrics, states, study_area_rows)
+    result = calculate_percentiles(df, metrics, inverse_metrics, 'State', states, study_area_rows)
+    pd.testing.assert_frame_equal(result[expected.columns].astype(float), expected.astype(float))
+
+
+def test_special_rows():
+    df = block_groups(seed=1)
+    study_area_rows = pd.Series(np.arange(len(df)) % 2 == 0, index=df.index)
+    result = calculate_percentiles(df, metrics, inverse_metrics, 'State', state_list, study_area_rows)
+
+    outside_states = ~df['State'].isin(state_list)
+    for col in metrics:
+        # Rows outside state_list: P_ = 0 (null if metric is null)
+        rows = outside_states & df[col].notnull()
+        assert (result.loc[rows, 'P_' + col] == 0).all()
+        assert result.loc[df[col].isnull(), 'P_' + col].isnull().all()
+        # Rows outside study area: N_ is null
+        assert result.loc[~study_area_rows, 'N_' + col].isnull().all()
+
+
+def test_inverse_metric_order():
+    df = pd.DataFrame({'State': 'Rhode Island', 'PM25': [1.0, 2.0, 3.0, 4.0], 'OZONE': 1.0,
+                       'TREE': [1.0, 2.0, 3.0, 4.0]})
+    result = calculate_percentiles(df, metrics, inverse_metrics, 'State', state_list, None)
+    # Higher TREE is better, so it ranks lower
+    assert result['P_PM25'].tolist() == [25, 50, 75, 100]
+    assert result['P_TREE'].tolist() == [100, 75, 50, 25]
+    # All tied
+    assert result['P_OZONE'].tolist() == [62, 62, 62, 62]
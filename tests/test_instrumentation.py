@@ -0,0 +1,48 @@
+# ---------------------------------------------------------------------------
+# test_instrumentation
+# Last updated: 2026-10-17
+# Authors: Mariel Sorlien
+#
+# Description:
+# Checks stage records when stages run in worker threads
+# ---------------------------------------------------------------------------
+
+import threading
+import time
+
+from functions.instrumentation import configure_instrumentation
+from functions.instrumentation import run_report
+from functions.instrumentation import save_run_report
+from functions.instrumentation import stage
+from functions.run_stages import run_stages
+
+
+def nested_stage(name, barrier):
+    with stage(name):
+        # All threads have a stage open at the same time
+        barrier.wait()
+        for x in range(50):
+            with stage('inner'):
+                time.sleep(0)
+    return name
+
+
+def test_thread_stages():
+    configure_instrumentation('test')
+    n_threads = 4
+    barrier = threading.Barrier(n_threads)
+    stages = [{'name': 'stage' + str(x), 'function': nested_stage, 'args': ['stage' + str(x), barrier]}
+              for x in range(n_threads)]
+    with stage('main'):
+        results = run_stages(stages, workers=n_threads, executor='thread')
+    assert results == {'stage' + str(x): 'stage' + str(x) for x in range(n_threads)}
+
+    paths = [x['path'] for x in run_report['stages']]
+    for x in range(n_threads):
+        # Thread stages are not nested in each other (one stack per thread)
+        assert paths.count('stage' + str(x)) == 1
+        assert paths.count('stage' + str(x) + '/inner') == 50
+        # Wall time recorded by the main thread
+        assert paths.count('main/stage' + str(x)) == 1
+    assert paths[-1] == 'main'
+    assert len(save_run_report()['stages']) == n_threads * 52 + 1
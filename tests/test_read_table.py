@@ -0,0 +1,61 @@
+# ---------------------------------------------------------------------------
+# test_read_table
+# Last updated: 2026-10-17
+# Authors: Mariel Sorlien
+#
+# Description:
+# Checks dbf text encoding from .cpg files (read_dbf, read_codepage)
+# ---------------------------------------------------------------------------
+
+import struct
+
+import pytest
+
+from functions.read_table import read_codepage
+from functions.read_table import read_dbf
+
+names = ['Pawtucket', 'Woonsocket Café', 'Señora']
+
+# --------------------- write_dbf -----------------------------
+# Write dBASE table with one text field (NAME) and one number field (POP)
+
+
+def write_dbf(dbf_path, encoding):
+    fields = [(b'NAME', b'C', 20, 0), (b'POP', b'N', 8, 0)]
+    record_length = 1 + sum(x[2] for x in fields)
+    header_length = 32 + 32 * len(fields) + 1
+    data = struct.pack('<BBBBIHH20x', 3, 126, 10, 17, len(names), header_length, record_length)
+    for name, field_type, length, decimals in fields:
+        data += name.ljust(11, b'\x00') + field_type + b'\x00' * 4 + bytes([length, decimals]) + b'\x00' * 14
+    data += b'\x0D'
+    for x, name in enumerate(names):
+        data += b' ' + name.encode(encoding).ljust(20) + str(x * 1000).encode().rjust(8)
+    data += b'\x1A'
+    with open(dbf_path, 'wb') as f:
+        f.write(data)
+
+
+@pytest.mark.parametrize('cpg_text, encoding', [('ANSI 1252', 'cp1252'), ('1252', 'cp1252'),
+                                                ('UTF-8', 'utf-8'), ('65001', 'utf-8')])
+def test_read_dbf_with_cpg(tmp_path, cpg_text, encoding):
+    write_dbf(tmp_path / 'places.dbf', encoding)
+    (tmp_path / 'places.cpg').write_text(cpg_text)
+    df = read_dbf(str(tmp_path / 'places.dbf'))
+    assert df['NAME'].tolist() == names
+    assert df['POP'].tolist() == [0, 1000, 2000]
+
+
+def test_unknown_codepage(tmp_path):
+    write_dbf(tmp_path / 'places.dbf', 'cp1252')
+    (tmp_path / 'places.cpg').write_text('UNKNOWN PAGE')
+    df = read_dbf(str(tmp_path / 'places.dbf'))
+    # latin-1 matches cp1252 for these characters
+    assert df['NAME'].tolist() == names
+
+
+def test_read_codepage():
+    assert read_codepage('ANSI 1252\n') == 'cp1252'
+    assert read_codepage('OEM 437') == 'cp437'
+    assert read_codepage('ISO 88591') == 'latin-1'
+    assert read_codepage('') == 'utf-8'
+    assert read_codepage('not a code page') == 'latin-1'
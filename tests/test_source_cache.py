@@ -0,0 +1,91 @@
+# ---------------------------------------------------------------------------
+# test_source_cache
+# Last updated: 2026-10-17
+# Authors: Mariel Sorlien
+#
+# Description:
+# Checks source csv cache entries (one file per csv path and selection)
+# ---------------------------------------------------------------------------
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+from functions.source_cache import purge_cache
+from functions.source_cache import read_manifest
+from functions.source_cache import read_source_csv
+
+column_list = ['ID', 'STATE_NAME', 'PM25']
+states = ['Rhode Island', 'Connecticut']
+
+
+def write_csv(csv_path):
+    df = pd.DataFrame({'ID': range(20), 'STATE_NAME': ['Rhode Island', 'Maine', 'Connecticut', 'Texas'] * 5,
+                       'PM25': [x / 3 for x in range(20)], 'EXTRA': ['x'] * 20})
+    df.to_csv(csv_path, index=False)
+    return df
+
+
+def test_cache_matches_csv(tmp_path):
+    df = write_csv(tmp_path / 'epa.csv')
+    expected = df[df['STATE_NAME'].isin(states)][column_list].reset_index(drop=True)
+    for x in range(2):
+        # Built in chunks (memory limit), then read from cache
+        df_cache = read_source_csv(tmp_path / 'epa.csv', tmp_path / 'cache', column_list, None,
+                                   states, 'STATE_NAME', chunk_rows=3)
+        pd.testing.assert_frame_equal(df_cache, expected, check_dtype=False)
+    # Other selection of the same csv is a separate entry
+    df_all = read_source_csv(tmp_path / 'epa.csv', tmp_path / 'cache', ['ID', 'EXTRA'])
+    assert len(df_all) == 20
+    assert len(read_manifest(tmp_path / 'cache')) == 2
+
+
+def test_same_content_two_paths(tmp_path):
+    write_csv(tmp_path / 'a.csv')
+    write_csv(tmp_path / 'b.csv')
+    cache_folder = tmp_path / 'cache'
+    read_source_csv(tmp_path / 'a.csv', cache_folder, column_list, None, states, 'STATE_NAME')
+    read_source_csv(tmp_path / 'b.csv', cache_folder, column_list, None, states, 'STATE_NAME')
+    manifest = read_manifest(cache_folder)
+    files = [x['file'] for x in manifest.values()]
+    assert len(set(files)) == 2
+
+    # Cache limit of 0 MB evicts every entry except the one in use
+    read_source_csv(tmp_path / 'b.csv', cache_folder, column_list, 0, states, 'STATE_NAME')
+    manifest = read_manifest(cache_folder)
+    assert [x['path'] for x in manifest.values()] == [os.path.abspath(tmp_path / 'b.csv')]
+    assert os.path.exists(os.path.join(cache_folder, list(manifest.values())[0]['file']))
+
+
+def test_parallel_stages(tmp_path):
+    cache_folder = tmp_path / 'cache'
+    csv_paths = []
+    for x in range(6):
+        csv_paths.append(tmp_path / ('epa' + str(x) + '.csv'))
+        write_csv(csv_paths[-1])
+    with ThreadPoolExecutor(max_workers=6) as executor:
+        results = list(executor.map(lambda x: read_source_csv(x, cache_folder, column_list, 100,
+                                                              states, 'STATE_NAME'), csv_paths))
+    assert all(len(x) == 10 for x in results)
+    # Every stage's entry is in the manifest, and every cached file has an entry
+    manifest = read_manifest(cache_folder)
+    assert len(manifest) == 6
+    cached_files = sorted(x for x in os.listdir(cache_folder) if x.endswith('.feather'))
+    assert sorted(x['file'] for x in manifest.values()) == cached_files
+    assert not os.path.exists(os.path.join(cache_folder, 'manifest.lock'))
+
+
+def test_orphan_files_removed(tmp_path):
+    write_csv(tmp_path / 'epa.csv')
+    cache_folder = tmp_path / 'cache'
+    os.makedirs(cache_folder)
+    # Cached file that is not in the manifest (ex: stage was stopped)
+    (cache_folder / 'orphan.feather').write_bytes(b'x' * 100)
+    read_source_csv(tmp_path / 'epa.csv', cache_folder, column_list, 100, states, 'STATE_NAME')
+    assert not os.path.exists(cache_folder / 'orphan.feather')
+
+    (cache_folder / 'orphan.feather').write_bytes(b'x' * 100)
+    purge_cache(cache_folder)
+    assert [x for x in os.listdir(cache_folder) if x.endswith('.feather')] == []
+    assert read_manifest(cache_folder) == {}
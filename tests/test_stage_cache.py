@@ -0,0 +1,57 @@
+# ---------------------------------------------------------------------------
+# test_stage_cache
+# Last updated: 2026-10-17
+# Authors: Mariel Sorlien
+#
+# Description:
+# Checks stage fingerprints: helper module source files and saved feature
+# class fingerprints
+# ---------------------------------------------------------------------------
+
+import os
+
+import geopandas as gpd
+from shapely.geometry import box
+
+from functions import stage_cache
+from functions.stage_cache import fingerprint_gis_dataset
+from functions.stage_cache import list_source_files
+
+
+def test_helper_modules_in_source(tmp_path):
+    stage_file = tmp_path / 'stage_module.py'
+    stage_file.write_text('def run():\n    from functions.tiled_zonal_statistics import tiled_zonal_statistics\n')
+    names = [os.path.basename(x) for x in list_source_files(str(stage_file))]
+    # Imported by tiled_zonal_statistics, zone_index, and gis_backend (by name)
+    for name in ['zonal_statistics.py', 'zone_index.py', 'source_cache.py', 'read_table.py', 'gis_arcpy.py']:
+        assert name in names
+
+
+def write_block_groups(gpkg_path, n_features):
+    gdf = gpd.GeoDataFrame({'GEOID': [str(440010101001 + x) for x in range(n_features)]},
+                           geometry=[box(x, 0, x + 1, 1) for x in range(n_features)], crs=26919)
+    gdf.to_file(gpkg_path, layer='block_groups', driver='GPKG')
+
+
+def test_saved_fingerprint(tmp_path, monkeypatch):
+    gpkg_path = str(tmp_path / 'bg.gpkg')
+    write_block_groups(gpkg_path, 3)
+    dataset = gpkg_path + '/block_groups'
+    memo_folder = str(tmp_path / 'cache')
+    monkeypatch.setattr(stage_cache, 'gis_fingerprints', {})
+    info = fingerprint_gis_dataset(dataset, ['GEOID'], memo_folder)
+    assert os.path.exists(os.path.join(memo_folder, stage_cache.memo_name))
+
+    # New run (empty memory): fingerprint is read from memo file, features are not read
+    hash_calls = []
+    hash_gis_dataset = stage_cache.hash_gis_dataset
+    monkeypatch.setattr(stage_cache, 'gis_fingerprints', {})
+    monkeypatch.setattr(stage_cache, 'hash_gis_dataset', lambda *args: hash_calls.append(args) or
+                        hash_gis_dataset(*args))
+    assert fingerprint_gis_dataset(dataset, ['GEOID'], memo_folder) == info
+    assert hash_calls == []
+
+    # Changed geopackage is hashed again
+    write_block_groups(gpkg_path, 4)
+    assert fingerprint_gis_dataset(dataset, ['GEOID'], memo_folder) != info
+    assert len(hash_calls) == 1
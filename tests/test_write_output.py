@@ -0,0 +1,93 @@
+# ---------------------------------------------------------------------------
+# test_write_output
+# Last updated: 2026-10-17
+# Authors: Mariel Sorlien
+#
+# Description:
+# Checks the in-memory GEOID join (join_attributes) against JoinField
+# behavior: first match wins, unmatched features get nulls, numeric keys
+# ---------------------------------------------------------------------------
+
+import os
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import pytest
+from shapely.geometry import box
+
+from functions.gis_backend import get_gis_backend
+from functions.write_output import fill_null_values
+from functions.write_output import join_attributes
+
+# --------------------- join_field -----------------------------
+# JoinField, one feature at a time (first matching row in df, nulls if no match)
+
+
+def join_field(keys, df, key_field, numeric_keys):
+    rows = []
+    for key in keys:
+        match = None
+        for x in range(len(df)):
+            df_key = df[key_field].iloc[x]
+            if numeric_keys is True:
+                same = str(key).strip() != '' and str(df_key).strip() != '' and int(key) == int(df_key)
+            else:
+                same = key == df_key
+            if same:
+                match = df.drop(columns=key_field).iloc[x].tolist()
+                break
+        if match is None:
+            match = [None] * (len(df.columns) - 1)
+        rows.append(match)
+    return pd.DataFrame(rows, columns=[x for x in df.columns if x != key_field])
+
+
+def test_matches_join_field():
+    # Feature keys are text (ex: GEOID field of block groups), table keys are int64 (csv output)
+    keys = pd.Series(['090010101001', '440010101001', '440010101002', '250010101001', '440010101001', ''])
+    df = pd.DataFrame({'GEOID': [440010101001, 90010101001, 440010101002, 440010101001, 440010109999],
+                       'HUC10': ['0109000501', '0110000601', '0109000502', 'duplicate', '0109000503'],
+                       'PM25': [7.25, 6.5, np.nan, 1.0, 8.0]})
+    df_join = join_attributes(keys, df, 'GEOID', numeric_keys=True)
+    expected = join_field(keys, df, 'GEOID', numeric_keys=True)
+
+    assert len(df_join) == len(keys)
+    assert df_join['HUC10'].tolist()[:3] == ['0110000601', '0109000501', '0109000502']
+    # First match wins (duplicate GEOID 440010101001)
+    assert df_join['HUC10'].iloc[4] == '0109000501'
+    # Unmatched and blank keys get nulls
+    assert df_join.iloc[3].isnull().all()
+    assert df_join.iloc[5].isnull().all()
+    pd.testing.assert_frame_equal(df_join.astype(object).where(df_join.notnull(), None),
+                                  expected.astype(object).where(expected.notnull(), None))
+
+
+def test_text_keys():
+    # Without numeric_keys, '090010101001' does not match 90010101001
+    keys = pd.Series(['090010101001', '440010101001'])
+    df = pd.DataFrame({'GEOID': ['440010101001', '90010101001'], 'PM25': [1.5, 2.5]})
+    df_join = join_attributes(keys, df, 'GEOID', numeric_keys=False)
+    expected = join_field(keys, df, 'GEOID', numeric_keys=False)
+    assert df_join['PM25'].isnull().tolist() == [True, False]
+    pd.testing.assert_frame_equal(df_join, expected, check_dtype=False)
+
+
+def test_fill_null_values():
+    df = pd.DataFrame({'HUC10': ['0109000501', None], 'PM25': [np.nan, 7.25]})
+    df_filled = fill_null_values(df, -999999)
+    assert df_filled['HUC10'].tolist() == ['0109000501', '-999999']
+    assert df_filled['PM25'].tolist() == [-999999, 7.25]
+
+
+def test_row_count_mismatch(tmp_path):
+    gis = get_gis_backend('geopandas')
+    gdf = gpd.GeoDataFrame({'GEOID': ['440010101001', '440010101002']}, geometry=[box(0, 0, 1, 1), box(1, 0, 2, 1)],
+                           crs=26919)
+    gdf.to_file(tmp_path / 'bg.gpkg', layer='block_groups', driver='GPKG')
+    df = pd.DataFrame({'GEOID': ['440010101001'], 'PM25': [7.25]})
+    with pytest.raises(ValueError):
+        gis.write_attributes(str(tmp_path / 'bg.gpkg') + '/block_groups', str(tmp_path / 'out.gpkg') + '/out', df)
+    with pytest.raises(ValueError):
+        gis.write_geometries(str(tmp_path / 'out.gpkg') + '/out', gdf.geometry.values, df)
+    assert not os.path.exists(tmp_path / 'out.gpkg')
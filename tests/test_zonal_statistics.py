@@ -0,0 +1,116 @@
+# ---------------------------------------------------------------------------
+# test_zonal_statistics
+# Last updated: 2026-10-17
+# Authors: Mariel Sorlien
+#
+# Description:
+# Checks numpy zonal statistics against a plain per-zone loop on small
+# zone and value grids (count, mean, min, max, std, null data cells)
+# ---------------------------------------------------------------------------
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from functions.tiled_zonal_statistics import tiled_zonal_statistics
+from functions.zonal_statistics import add_sparse_partials
+from functions.zonal_statistics import empty_partials
+from functions.zonal_statistics import finalize_partials
+from functions.zonal_statistics import merge_partials
+from functions.zonal_statistics import sparse_partials
+from functions.zonal_statistics import zonal_partials
+from functions.zonal_statistics import zonal_statistics
+
+# --------------------- loop_zonal_statistics -----------------------------
+# Same statistics, one zone at a time (ExtractByAttributes + ZonalStatisticsAsTable)
+
+
+def loop_zonal_statistics(zones, values, zone_lookup, max_value, nodata_value):
+    rows = []
+    for zone_id in range(1, len(zone_lookup)):
+        zone_values = []
+        for zone, value in zip(zones.ravel().tolist(), values.ravel().tolist()):
+            if zone != zone_id or value != value:
+                continue
+            if max_value is not None and value >= max_value:
+                continue
+            if nodata_value is not None and value == nodata_value:
+                continue
+            zone_values.append(float(value))
+        if len(zone_values) == 0:
+            continue
+        mean = sum(zone_values) / len(zone_values)
+        std = (sum((x - mean) ** 2 for x in zone_values) / len(zone_values)) ** 0.5
+        rows.append([zone_lookup[zone_id], len(zone_values), mean, min(zone_values), max(zone_values), std])
+    return pd.DataFrame(rows, columns=['GEOID', 'COUNT', 'MEAN', 'MIN', 'MAX', 'STD'])
+
+
+def grids(seed, dtype):
+    rng = np.random.default_rng(seed)
+    # Zone 0 = outside all zones, zone 5 has no cells
+    zones = rng.choice([0, 1, 2, 3, 4, 6], size=(30, 40)).astype(np.int32)
+    # NLCD style values: 0-100 percent, 127 and 255 = null data
+    values = rng.choice(list(range(101)) + [127, 255], size=(30, 40)).astype(dtype)
+    if dtype == np.float32:
+        values[rng.random((30, 40)) < 0.1] = np.nan
+    zone_lookup = np.array([0, 440010101001, 440010101002, 90010101001, 440010102001, 440010102002,
+                            250010101001], dtype=np.int64)
+    return zones, values, zone_lookup
+
+
+@pytest.mark.parametrize('dtype', [np.uint8, np.float32])
+@pytest.mark.parametrize('max_value, nodata_value', [(101, None), (None, 255), (101, 255), (None, None)])
+def test_matches_loop(dtype, max_value, nodata_value):
+    zones, values, zone_lookup = grids(7, dtype)
+    df = zonal_statistics(zones, values, zone_lookup, max_value, nodata_value)
+    expected = loop_zonal_statistics(zones, values, zone_lookup, max_value, nodata_value)
+    pd.testing.assert_frame_equal(df, expected, check_dtype=False)
+    # Zones without cells are dropped
+    assert 440010102002 not in df['GEOID'].tolist()
+
+
+def test_null_cells_skipped():
+    zones = np.array([[1, 1, 1], [2, 2, 0]])
+    values = np.array([[10, 101, 255], [255, 255, 50]], dtype=np.uint8)
+    df = zonal_statistics(zones, values, np.array([0, 11, 22]), max_value=101)
+    # Zone 2 only has null data cells; zone 0 cell is outside all zones
+    assert df['GEOID'].tolist() == [11]
+    assert df['COUNT'].tolist() == [1]
+    assert df['MEAN'].tolist() == [10.0]
+    assert df['STD'].tolist() == [0.0]
+
+
+def test_tiles_match_whole_grid():
+    zones, values, zone_lookup = grids(3, np.uint8)
+    tiles = [zonal_partials(zones[rows, cols], values[rows, cols], len(zone_lookup), 101, 255)
+             for rows in [slice(0, 13), slice(13, 30)] for cols in [slice(0, 25), slice(25, 40)]]
+    df = finalize_partials(merge_partials(tiles), zone_lookup)
+    expected = zonal_statistics(zones, values, zone_lookup, 101, 255)
+    pd.testing.assert_frame_equal(df, expected)
+
+
+def test_sparse_tiles_match_whole_grid():
+    zones, values, zone_lookup = grids(5, np.float32)
+    partials = empty_partials(len(zone_lookup))
+    for rows in [slice(0, 7), slice(7, 30)]:
+        for cols in [slice(0, 9), slice(9, 40)]:
+            tile_partials = sparse_partials(zones[rows, cols], values[rows, cols], 101, 255)
+            # Only zones in the tile are returned
+            assert set(tile_partials['zones']) <= set(np.unique(zones[rows, cols])) - {0}
+            add_sparse_partials(partials, tile_partials)
+    df = finalize_partials(partials, zone_lookup)
+    expected = zonal_statistics(zones, values, zone_lookup, 101, 255)
+    pd.testing.assert_frame_equal(df, expected)
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_tiled_zonal_statistics(tmp_path, workers):
+    zones, values, zone_lookup = grids(11, np.uint8)
+    np.save(tmp_path / 'zones.npy', zones)
+    np.save(tmp_path / 'values.npy', values)
+    zone_index = {'zones_path': str(tmp_path / 'zones.npy'), 'zone_lookup': zone_lookup,
+                  'grid': {'nrows': zones.shape[0], 'ncols': zones.shape[1]}}
+    df = tiled_zonal_statistics(zone_index, {'type': 'npy', 'path': str(tmp_path / 'values.npy')}, tile_size=8,
+                                workers=workers, max_value=101, nodata_value=255)
+    expected = loop_zonal_statistics(zones, values, zone_lookup, 101, 255)
+    pd.testing.assert_frame_equal(df, expected, check_dtype=False)